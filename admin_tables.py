@@ -0,0 +1,181 @@
+from datetime import datetime, timedelta
+
+from flask import url_for
+
+from pagination import MAX_PAGE_SIZE
+
+
+def parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        return None
+
+
+def parse_date_end(value):
+    """Exclusive upper bound for an inclusive 'to' date"""
+    day = parse_date(value)
+    return day + timedelta(days=1) if day else None
+
+
+def parse_int(value):
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def prefix_like(value):
+    """LIKE pattern for a starts-with search (can use an index, unlike '%x%')"""
+    value = value.strip()
+    if not value:
+        return None
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def one_of(*choices):
+    return lambda value: value if value in choices else None
+
+
+def apply_filters(filters, args, prefix=''):
+    """(SQL conditions, params, raw values applied) for the `filters` set in the request args.
+
+    `filters` maps an arg name to (SQL condition, converter); a converter
+    returning None drops the filter.
+    """
+    conditions = []
+    params = []
+    applied = {}
+    for name, (condition, convert) in filters.items():
+        raw = args.get(prefix + name, '')
+        value = convert(raw) if raw else None
+        if value is not None:
+            conditions.append(condition)
+            params.extend([value] * condition.count('%s'))
+            applied[name] = raw
+    return conditions, params, applied
+
+
+class AdminTable:
+    """A server-side paginated, sortable and filterable admin listing.
+
+    `sorts` maps a sort key to a column of the base table, `filters` maps a
+    query arg to (SQL condition, converter); a converter returning None drops
+    the filter. A page of rows is fetched with a deferred join: the ids are
+    picked from the base table alone (filtered and ordered on its indexed
+    columns) and only those ids are joined to the lookup tables.
+    """
+
+    def __init__(self, name, endpoint, template, base, alias, select, sorts, default_sort,
+                 joins='', where=None, filters=None, per_page=20, prefix=''):
+        self.name = name
+        self.endpoint = endpoint
+        self.template = template
+        self.base = base
+        self.alias = alias
+        self.select = select
+        self.sorts = sorts
+        self.default_sort = default_sort  # (key, 'asc' | 'desc')
+        self.joins = joins
+        self.where = where
+        self.filters = filters or {}
+        self.per_page = per_page
+        self.prefix = prefix  # keeps the args of two tables on one page apart
+
+    def arg(self, name):
+        return self.prefix + name
+
+    def fetch(self, cur, args):
+        """Count and load the page of rows described by the request args"""
+        steps = self.queries(args)
+        try:
+            sql, params = next(steps)
+            while True:
+                cur.execute(sql, params)
+                sql, params = steps.send(cur.fetchall())
+        except StopIteration as done:
+            return done.value
+
+    def queries(self, args):
+        """The statements behind fetch(), for any connection: yields (sql, params), is sent
+        each statement's rows (dicts) and returns the TablePage"""
+        sort = args.get(self.arg('sort'))
+        if sort not in self.sorts:
+            sort = self.default_sort[0]
+        direction = args.get(self.arg('dir'), '').lower()
+        if direction not in ('asc', 'desc'):
+            direction = self.default_sort[1] if sort == self.default_sort[0] else 'asc'
+        per_page = args.get(self.arg('per_page'), self.per_page, type=int) or self.per_page
+        per_page = max(1, min(per_page, MAX_PAGE_SIZE))
+
+        conditions, params, applied = apply_filters(self.filters, args, self.prefix)
+        if self.where:
+            conditions.insert(0, self.where)
+        where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+
+        count = yield "SELECT COUNT(*) AS n FROM %s %s%s" % (self.base, self.alias, where), params
+        total = count[0]['n']
+        pages = max(1, -(-total // per_page))
+        page = max(1, min(args.get(self.arg('page'), 1, type=int) or 1, pages))
+
+        # The primary key breaks ties so pages never overlap
+        order = '%s %s, %s.id %s' % (self.sorts[sort], direction.upper(), self.alias, direction.upper())
+        rows = yield """
+            SELECT %s
+            FROM (SELECT %s.id FROM %s %s%s ORDER BY %s LIMIT %%s OFFSET %%s) page_ids
+            JOIN %s %s ON %s.id = page_ids.id
+            %s
+            ORDER BY %s
+        """ % (self.select, self.alias, self.base, self.alias, where, order,
+               self.base, self.alias, self.alias, self.joins, order), params + [per_page, (page - 1) * per_page]
+        return TablePage(self, args, rows, page, pages, total, per_page, sort, direction, applied)
+
+
+class TablePage:
+    """One page of an AdminTable, plus the URLs the template needs to move around"""
+
+    def __init__(self, table, args, rows, page, pages, total, per_page, sort, direction, filters):
+        self.table = table
+        self.args = args
+        self.rows = rows
+        self.page = page
+        self.pages = pages
+        self.total = total
+        self.per_page = per_page
+        self.sort = sort
+        self.direction = direction
+        self.filters = filters
+
+    def url(self, **changes):
+        """URL of the page endpoint with this table's args changed; other args are kept"""
+        args = self.args.to_dict()
+        for name, value in changes.items():
+            if value is None:
+                args.pop(self.table.arg(name), None)
+            else:
+                args[self.table.arg(name)] = value
+        return url_for(self.table.endpoint, **args)
+
+    def sort_url(self, key):
+        direction = 'desc' if key == self.sort and self.direction == 'asc' else 'asc'
+        return self.url(sort=key, dir=direction, page=None)
+
+    def clear_url(self):
+        return self.url(page=None, **dict.fromkeys(self.table.filters))
+
+    def other_args(self):
+        """Args that belong to something else on the page, for hidden inputs in a filter form"""
+        own = {self.table.arg(name) for name in ('page', 'sort', 'dir', 'per_page', *self.table.filters)}
+        return {name: value for name, value in self.args.to_dict().items() if name not in own}
+
+    def to_json(self):
+        return {
+            'rows': self.rows,
+            'page': self.page,
+            'pages': self.pages,
+            'total': self.total,
+            'per_page': self.per_page,
+            'sort': self.sort,
+            'dir': self.direction,
+            'filters': self.filters,
+        }
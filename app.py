@@ -1,14 +1,54 @@
-from flask import Flask, render_template, redirect, url_for, flash, request, session, send_from_directory
-from flask_mysqldb import MySQL
+from flask import Flask, render_template, redirect, url_for, flash, request, session, send_from_directory, jsonify, g, \
+    stream_with_context
+from werkzeug.middleware.proxy_fix import ProxyFix
+from db import MySQLPool, PoolTimeout
+from metrics import RequestMetrics
 from forms import RegisterForm, LoginForm, ProductForm, CategoryForm, PaymentProofForm
 from config import Config
+from scheduler import PeriodicJob
+from cache import VersionedCache
+from pagecache import PageCache
+from fragments import FragmentCache, FragmentCacheExtension
+from search import ProductSearchIndex, SuggestionIndex
+from loaders import ProductLoader
+from repositories import Repositories, OrderExport, UserExport, ORDER_EXPORT_ITEM_FIELDS, SALES_EXPORTS
+from exports import EXPORT_FORMATS, export_chunks
+from imports import ProductImporter, ImageSource, feed_format
+from carts import create_cart_store, cart_clear_statements, DbCartStore, UnknownCart
+from ratelimit import RateLimiter, ConcurrencyLimit, create_bucket_store
+from images import ImagePipeline
+from storage import BlobStore, UploadTooLarge
+from assets import AssetServer
+from ordering import place_order, OutOfStock
+import rollups
+import migrations
+from migrations.checks import HOT_QUERIES, check_hot_queries
+from pagination import get_page_size, encode_cursor, decode_cursor, keyset_condition
+from admin_tables import AdminTable, apply_filters, parse_date, parse_date_end, parse_int, prefix_like, one_of
 import os
-from datetime import datetime, timedelta
+import shutil
+import zipfile
+import tempfile
+import click
+from collections import namedtuple
+from datetime import datetime, timedelta, date
 
 app = Flask(__name__)
 app.config.from_object(Config)
 
-mysql = MySQL(app)
+# Client addresses from X-Forwarded-For when behind PROXY_FIX_X_FOR trusted proxies
+if app.config['PROXY_FIX_X_FOR']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'])
+
+# {% cache key %}...{% endcache %} for product cards
+app.jinja_env.add_extension(FragmentCacheExtension)
+app.jinja_env.fragment_cache = FragmentCache(app.config['FRAGMENT_CACHE_MAX_ENTRIES'])
+
+# Pooled MySQL connections; mysql.connection is checked out per app context
+mysql = MySQLPool(app)
+
+# Per-endpoint latency, SQL and template timings, scraped from /admin/metrics
+request_metrics = RequestMetrics(app)
 
 # Folder for payment proofs
 UPLOAD_FOLDER = 'static/uploads/proofs'
@@ -19,6 +59,44 @@ PRODUCT_UPLOAD_FOLDER = 'static/uploads/products'
 app.config['PRODUCT_UPLOAD_FOLDER'] = PRODUCT_UPLOAD_FOLDER
 os.makedirs(PRODUCT_UPLOAD_FOLDER, exist_ok=True)
 
+# Uploads are stored once per distinct content (sha256 filename) and reference counted
+proof_store = BlobStore(UPLOAD_FOLDER, 'proofs', max_size=app.config['MAX_PROOF_SIZE'])
+product_images = BlobStore(PRODUCT_UPLOAD_FOLDER, 'products', max_size=app.config['MAX_PRODUCT_IMAGE_SIZE'])
+
+# Resized WebP variants of product images, built in the background after upload
+image_pipeline = ImagePipeline(PRODUCT_UPLOAD_FOLDER, workers=app.config['IMAGE_WORKERS'])
+
+# In-memory full-text index used by the catalog search box
+search_index = ProductSearchIndex(max_age=app.config['SEARCH_INDEX_TTL'])
+
+# Prefix index behind the search box's typeahead
+suggestion_index = SuggestionIndex(max_age=app.config['SEARCH_INDEX_TTL'])
+
+# Categories only change when an admin adds one, so keep them in memory
+category_cache = VersionedCache('categories', ttl=app.config['CATEGORY_CACHE_TTL'], stamp_dir=app.instance_path)
+
+# Rendered catalog responses; invalidated whenever products or categories change, or a product sells out
+catalog_pages = PageCache('catalog_pages', ttl=app.config['PAGE_CACHE_TTL'],
+                          stale_ttl=app.config['PAGE_CACHE_STALE_TTL'],
+                          max_entries=app.config['PAGE_CACHE_MAX_ENTRIES'],
+                          disk_dir=app.config['PAGE_CACHE_DIR'], stamp_dir=app.instance_path)
+
+# MySQL named lock held while the auto-delivery job runs
+AUTO_DELIVERY_LOCK = 'py_etr_auto_delivery'
+
+# Carts live server-side; the session only remembers the cart id
+cart_store = create_cart_store(app.config['CART_BACKEND'], lambda: mysql.connection, mysql.pool,
+                               max_carts=app.config['CART_MEMORY_MAX_CARTS'])
+
+# Admission control: token buckets per route, client IP and account, plus a cap on requests in flight
+rate_limiter = RateLimiter(
+    create_bucket_store(app.config['RATE_LIMIT_BACKEND'], mysql.pool,
+                        path=app.config['RATE_LIMIT_LOCAL_PATH'] or os.path.join(app.instance_path, 'rate_limits.sqlite3')),
+    app.config['RATE_LIMITS'], enabled=app.config['RATE_LIMIT_ENABLED'])
+admission = ConcurrencyLimit(app.config['MAX_CONCURRENT_REQUESTS'])
+# Never shed: static files and fingerprinted assets are cheap and pages need them
+ADMISSION_EXEMPT_ENDPOINTS = ('static', 'asset')
+
 # Hardcoded admin for simplicity
 ADMIN_EMAIL = 'admin@shop.com'
 ADMIN_PASSWORD = 'admin123'
@@ -40,24 +118,259 @@ def login_required(role='customer'):
         return wrapper
     return decorator
 
-def update_order_statuses():
-    """Automatically change 'Shipped' orders older than 3 days to 'Delivered'"""
+def login_account():
+    """The account a login form is trying, for its per-account bucket"""
+    return request.form.get('email', '').strip().lower() or None
+
+def customer_account():
+    return session.get('customer_user_id')
+
+def rate_limited(budget, account=None, methods=None):
+    """Spend from the route's per-IP and per-account buckets first (only if both have a token); 429 with
+    Retry-After once one is empty.
+
+    `account` returns the account key (None: IP only); `methods` limits which requests are counted.
+    """
+    def decorator(f):
+        def wrapper(*args, **kwargs):
+            if methods is None or request.method in methods:
+                retry_after = rate_limiter.check(f.__name__, budget, [
+                    ('ip', request.remote_addr),
+                    ('account', account() if account else None),
+                ])
+                if retry_after:
+                    return ('Too many requests, please try again in %d seconds.' % retry_after, 429,
+                            {'Retry-After': str(retry_after)})
+            return f(*args, **kwargs)
+        wrapper.__name__ = f.__name__
+        return wrapper
+    return decorator
+
+@app.before_request
+def admit_request():
+    """Shed load before any work once this process is at MAX_CONCURRENT_REQUESTS"""
+    if request.endpoint in ADMISSION_EXEMPT_ENDPOINTS:
+        return None
+    if not admission.try_enter():
+        return 'The shop is busy right now, please try again in a moment.', 503, {'Retry-After': '2'}
+    g.admitted = True
+
+@app.teardown_request
+def leave_request(exception):
+    if g.pop('admitted', False):
+        admission.leave()
+
+def update_order_statuses(batch_size=None):
+    """Automatically change 'Shipped' orders older than 3 days to 'Delivered'.
+
+    Runs from the auto-delivery job, never inside a page request. Orders are
+    updated in batches of AUTO_DELIVERY_BATCH_SIZE with a commit after each, and
+    a MySQL named lock makes sure only one worker process runs it at a time.
+    Returns the number of orders changed, or None if another worker holds the lock.
+    """
+    batch_size = batch_size or app.config['AUTO_DELIVERY_BATCH_SIZE']
     cur = mysql.connection.cursor()
-    three_days_ago = datetime.now() - timedelta(days=3)
+    cur.execute("SELECT GET_LOCK(%s, 0) as acquired", (AUTO_DELIVERY_LOCK,))
+    if not cur.fetchone()['acquired']:
+        cur.close()
+        return None
     
-    cur.execute("""
-        UPDATE orders 
-        SET status = 'Delivered' 
-        WHERE status = 'Shipped' 
-          AND order_date <= %s
-    """, (three_days_ago,))
+    # Shipped and Delivered both count as sales, so the rollups need no update here
+    rows_affected = 0
+    try:
+        three_days_ago = datetime.now() - timedelta(days=3)
+        while True:
+            cur.execute("""
+                UPDATE orders 
+                SET status = 'Delivered' 
+                WHERE status = 'Shipped' 
+                  AND order_date <= %s
+                ORDER BY id
+                LIMIT %s
+            """, (three_days_ago, batch_size))
+            batch_rows = cur.rowcount
+            mysql.connection.commit()
+            rows_affected += batch_rows
+            if batch_rows < batch_size:
+                break
+    finally:
+        cur.execute("SELECT RELEASE_LOCK(%s)", (AUTO_DELIVERY_LOCK,))
+        cur.close()
     
-    rows_affected = cur.rowcount
-    mysql.connection.commit()
-    cur.close()
+    return rows_affected
+
+def search_documents():
+    return (get_repositories().products.search_documents(),)
+
+def suggestion_documents():
+    return get_repositories().products.suggestion_documents(), get_categories()
+
+def get_search_index():
+    """Return the product search index, (re)building it from the DB when stale.
+
+    The search-index job normally rebuilds it first; if not (first use, after
+    invalidate()) one request rebuilds while the others search the old contents.
+    """
+    search_index.refresh(search_documents)
+    return search_index
+
+def get_suggestion_index():
+    """Return the typeahead index, (re)building it from the DB when stale (see get_search_index())"""
+    suggestion_index.refresh(suggestion_documents)
+    return suggestion_index
+
+def reindex_product(pid):
+    """Sync one product into the search indexes after it was added, edited or deleted"""
+    indexes = [index for index in (search_index, suggestion_index) if not index.is_stale]
+    if not indexes:
+        return  # the next search rebuilds everything anyway
+    product = get_repositories().products.search_document(pid)
+    for index in indexes:
+        if product and product.status == 'approved':
+            index.add(product)
+        else:
+            index.remove(pid)
+
+def get_categories():
+    """All categories, served from the process-wide cache"""
+    def load():
+        # Plain dicts: pages also pass them to |tojson
+        return tuple(category._asdict() for category in get_repositories().categories.all())
+    return category_cache.get(load)
+
+def save_upload(store, cur, file):
+    """Store an upload. A file this request wrote is purged again once the request is
+    over (remove_released_uploads) if the transaction that references it did not commit."""
+    new_files = []
+    filename = store.save(cur, file, new_files)
+    g.setdefault('new_uploads', []).extend((store, name) for name in new_files)
+    return filename
+
+def save_product_image(cur, file):
+    """Store an uploaded product image and queue its resized variants"""
+    filename = save_upload(product_images, cur, file)
+    if not image_pipeline.is_ready(filename):
+        image_pipeline.submit(filename)
+    return filename
+
+def release_upload(store, cur, filename):
+    """Drop a reference to a stored upload. A file nothing uses any more is only deleted
+    once the request is over (remove_released_uploads), after its transaction."""
+    if store.release(cur, filename):
+        g.setdefault('released_uploads', []).append((store, filename))
+
+def release_product_image(cur, filename):
+    """Drop a product's reference to its image; the file goes once nothing uses it"""
+    release_upload(product_images, cur, filename)
+
+def get_repositories():
+    """Request-scoped data access (see repositories.py) on the pooled connection"""
+    if 'repositories' not in g:
+        g.repositories = Repositories(mysql.connection)
+    return g.repositories
+
+def get_product_loader():
+    """Request-scoped product loader (one IN (...) query per batch, identity-mapped)"""
+    if 'product_loader' not in g:
+        g.product_loader = ProductLoader(get_repositories().products)
+    return g.product_loader
+
+@app.teardown_appcontext
+def drop_data_access(exception):
+    # Both hold the connection that is going back to the pool. A streamed response
+    # (stream_with_context) runs after this and must check out a connection of its own.
+    g.pop('repositories', None)
+    g.pop('product_loader', None)
+
+@app.teardown_appcontext
+def remove_released_uploads(exception):
+    # Runs before mysql's teardown hands the connection back. Whatever the request did not
+    # commit is rolled back first, so purge() sees the committed reference counts: released
+    # files nothing uses any more go, and so do new files whose save was rolled back.
+    released = g.pop('released_uploads', []) + g.pop('new_uploads', [])
+    conn = g.get('mysql_connection')
+    if not released or conn is None:
+        return
+    conn.rollback()
+    for store, filename in released:
+        try:
+            if store.purge(conn, filename) and store is product_images:
+                image_pipeline.remove(filename)
+        except Exception:
+            app.logger.exception('Could not remove released upload %s', filename)
+
+def current_cart_id():
+    """Id of the logged-in customer's server-side cart, remembered in the session"""
+    if 'cart_id' not in session:
+        session['cart_id'] = cart_store.cart_for_user(session['customer_user_id'])
+    return session['cart_id']
+
+def load_cart_products():
+    """Return [(product, quantity)] for the customer's cart, dropping products that were deleted"""
+    cart_id = current_cart_id()
+    cart = cart_store.items(cart_id)
+    products = get_product_loader().load_many(cart.keys())
+    missing = [pid for pid in cart if pid not in products]
+    if missing:
+        for pid in missing:
+            cart_store.set(cart_id, pid, 0)
+        mysql.connection.commit()
+        flash('Some items in your cart are no longer available and were removed.', 'warning')
+    return [(products[pid], qty) for pid, qty in cart.items() if pid in products]
+
+# Static files and uploads served under content-hash URLs with long-lived cache headers
+assets = AssetServer(app.static_folder)
+
+@app.template_global()
+def asset_url(filename):
+    """Fingerprinted URL for a file under static/ (plain static URL if it is missing)"""
+    fingerprint = assets.fingerprint(filename)
+    if fingerprint is None:
+        return url_for('static', filename=filename)
+    return url_for('asset', fingerprint=fingerprint, filename=filename)
+
+@app.route('/assets/<fingerprint>/<path:filename>')
+def asset(fingerprint, filename):
+    return assets.send(filename, fingerprint, request.accept_encodings)
+
+@app.context_processor
+def image_helpers():
+    def product_image_url(filename, size='thumb'):
+        """URL of the size-appropriate variant, or the original until variants exist"""
+        return asset_url('uploads/products/' + image_pipeline.url_path(filename, size))
+    
+    def product_image_srcset(filename):
+        return ', '.join('%s %dw' % (asset_url('uploads/products/' + path), width)
+                         for path, width in image_pipeline.srcset(filename))
     
-    if rows_affected > 0:
-        print(f"[Auto-Delivery] {rows_affected} order(s) marked as Delivered")
+    return dict(product_image_url=product_image_url, product_image_srcset=product_image_srcset)
+
+@app.context_processor
+def cart_helpers():
+    def cart_count():
+        """Distinct products in the cart, for the navbar badge"""
+        if not session.get('customer_logged_in'):
+            return 0
+        return cart_store.count(current_cart_id())
+    return dict(cart_count=cart_count)
+
+@app.errorhandler(UploadTooLarge)
+def upload_too_large(error):
+    flash(f'Upload rejected: {error}', 'danger')
+    return redirect(request.referrer or url_for('index'))
+
+@app.errorhandler(UnknownCart)
+def cart_expired(error):
+    # The memory cart store lost the cart the session points at; start a new one
+    session.pop('cart_id', None)
+    flash('Your cart has expired, please add the items again.', 'warning')
+    return redirect(url_for('catalog'))
+
+@app.errorhandler(PoolTimeout)
+def database_busy(error):
+    # The ASGI mode's aiomysql pool raises this too; report whichever pool ran dry
+    app.logger.warning('MySQL pool exhausted: %s (%s)', error, (error.pool or mysql.pool).stats())
+    return 'The shop is busy right now, please try again in a moment.', 503, {'Retry-After': '5'}
 
 # ====================== CUSTOMER ROUTES ======================
 
@@ -66,107 +379,173 @@ def index():
     return redirect(url_for('catalog'))
 
 @app.route('/register', methods=['GET', 'POST'])
+@rate_limited('register', methods=('POST',))
 def register():
     form = RegisterForm()
     if form.validate_on_submit():
-        cur = mysql.connection.cursor()
-        cur.execute("SELECT * FROM users WHERE email = %s", (form.email.data,))
-        if cur.fetchone():
+        users = get_repositories().users
+        if users.email_taken(form.email.data):
             flash('Email already registered', 'danger')
         else:
-            cur.execute("INSERT INTO users (fullname, email, password, status) VALUES (%s, %s, %s, 'active')",
-                        (form.fullname.data, form.email.data, form.password.data))
+            users.create(form.fullname.data, form.email.data, form.password.data)
             mysql.connection.commit()
             flash('Registration successful! Please login.', 'success')
             return redirect(url_for('customer_login'))
-        cur.close()
     return render_template('customer/register.html', form=form)
 
 @app.route('/customer/login', methods=['GET', 'POST'])
+@rate_limited('login', account=login_account, methods=('POST',))
 def customer_login():
     form = LoginForm()
     if form.validate_on_submit():
-        cur = mysql.connection.cursor()
-        cur.execute("SELECT * FROM users WHERE email = %s AND password = %s AND status = 'active'",
-                    (form.email.data, form.password.data))
-        user = cur.fetchone()
-        cur.close()
+        user = get_repositories().users.login(form.email.data, form.password.data)
         if user:
             session['customer_logged_in'] = True
             session['customer_role'] = 'customer'
-            session['customer_user_id'] = user['id']
-            session['customer_username'] = user['fullname']
+            session['customer_user_id'] = user.id
+            session['customer_username'] = user.fullname
+            session.pop('cart_id', None)  # looked up again for this user on first use
             flash('Customer login successful!', 'success')
             return redirect(url_for('catalog'))
         flash('Invalid credentials or account inactive', 'danger')
     return render_template('customer/login.html', form=form)
 
-@app.route('/catalog')
-def catalog():
-    search = request.args.get('search', '')
-    category_id = request.args.get('category', '')
-    price_filter = request.args.get('price', '')
-    stock_filter = request.args.get('stock', '')
-    
-    cur = mysql.connection.cursor()
-    
-    base_query = """
-        SELECT p.*, c.name as category_name 
-        FROM products p 
-        LEFT JOIN categories c ON p.category_id = c.id 
-        WHERE p.stock > 0 AND p.status = 'approved'
+# (query arg, value) -> (sort column, row key, direction)
+CATALOG_SORTS = {
+    ('price', 'low_high'): ('p.price', 'price', 'ASC'),
+    ('price', 'high_low'): ('p.price', 'price', 'DESC'),
+    ('stock', 'low_high'): ('p.stock', 'stock', 'ASC'),
+    ('stock', 'high_low'): ('p.stock', 'stock', 'DESC'),
+}
+
+# What a catalog request asks for once its args are parsed; `sort` is a CATALOG_SORTS key
+CatalogFilters = namedtuple('CatalogFilters', 'search category_id sort cursor per_page')
+
+def catalog_filters(args):
+    """Parse the catalog args, dropping any that do not validate (a category that is not
+    an id, an unknown sort, a cursor that cannot belong to this sort order)"""
+    sort = next((key for key in (('price', args.get('price', '')), ('stock', args.get('stock', '')))
+                 if key in CATALOG_SORTS), None)
+    cursor = decode_cursor(args.get('cursor'))
+    # Sorted pages resume after (sort value, id); the others after one int (an id or a search rank)
+    if cursor and not (len(cursor) == 2 if sort else len(cursor) == 1 and type(cursor[0]) is int):
+        cursor = None
+    return CatalogFilters(search=args.get('search', ''), category_id=args.get('category', type=int) or None,
+                          sort=sort, cursor=cursor, per_page=get_page_size(args))
+
+def catalog_page_plan(filters, product_ids=None):
+    """Generator behind fetch_catalog_page(): yields the ProductRepository.catalog() keyword
+    args for the page, is sent the rows and returns (products, next_cursor).
+
+    `filters` come from catalog_filters() and `product_ids` are the search hits in
+    relevance order (None when not searching). The ASGI mode (asgi.py) runs the
+    same plan on an async connection.
     """
+    per_page = filters.per_page
+    cursor = filters.cursor
+    category_id = filters.category_id
     
-    params = []
-    if search:
-        base_query += " AND (p.name LIKE %s OR p.description LIKE %s)"
-        params.extend([f'%{search}%', f'%{search}%'])
+    sort = CATALOG_SORTS.get(filters.sort)
     
-    if category_id:
-        base_query += " AND p.category_id = %s"
-        params.append(category_id)
+    if sort is None and product_ids:
+        # Relevance order comes from the search index. The candidate set is capped
+        # at SEARCH_RESULT_LIMIT primary-key lookups, so rank it here and use the
+        # rank of the last row shown as the cursor.
+        rank = {pid: i for i, pid in enumerate(product_ids)}
+        after = cursor[0] if cursor else -1
+        rows = yield dict(product_ids=product_ids, category_id=category_id)
+        products = sorted((p for p in rows if rank[p.id] > after), key=lambda p: rank[p.id])
+        if len(products) > per_page:
+            return products[:per_page], encode_cursor([rank[products[per_page - 1].id]])
+        return products, None
     
-    if price_filter == 'low_high':
-        base_query += " ORDER BY p.price ASC"
-    elif price_filter == 'high_low':
-        base_query += " ORDER BY p.price DESC"
-    
-    if stock_filter == 'low_high':
-        base_query += " ORDER BY p.stock ASC"
-    elif stock_filter == 'high_low':
-        base_query += " ORDER BY p.stock DESC"
+    # Keyset pagination: the id tie-breaker keeps the order stable for equal prices/stock
+    if sort:
+        column, key, direction = sort
+        columns, keys = [column, 'p.id'], [key, 'id']
+    else:
+        columns, keys, direction = ['p.id'], ['id'], 'DESC'
     
-    cur.execute(base_query, params)
-    products = cur.fetchall()
+    after = keyset_condition(columns, direction, cursor) if cursor else None
     
-    cur.execute("SELECT * FROM categories")
-    categories = cur.fetchall()
-    cur.close()
+    products = yield dict(product_ids=product_ids, category_id=category_id, order=(columns, direction),
+                          after=after, limit=per_page + 1)
+    if len(products) > per_page:
+        products = products[:per_page]
+        return products, encode_cursor([products[-1][k] for k in keys])
+    return products, None
+
+def fetch_catalog_page(filters):
+    """Load one page of the catalog for the given filters; returns (products, next_cursor)"""
+    product_ids = None
+    if filters.search:
+        product_ids = get_search_index().search(filters.search, limit=app.config['SEARCH_RESULT_LIMIT'])
+        if not product_ids:
+            return [], None
     
-    return render_template('customer/catalog.html', products=products, categories=categories)
+    plan = catalog_page_plan(filters, product_ids)
+    try:
+        plan.send(get_repositories().products.catalog(**next(plan)))
+    except StopIteration as done:
+        return done.value
+
+def catalog_cache_key():
+    """Cache key for the current catalog request, or None when the response is personal"""
+    if '_flashes' in session:
+        return None
+    if session.get('customer_logged_in'):
+        auth = 'customer'
+    elif session.get('admin_logged_in'):
+        auth = 'admin'
+    else:
+        auth = 'anonymous'
+    # The full page carries the customer's name and cart badge; the card partial does not
+    if request.endpoint == 'catalog' and auth != 'anonymous':
+        return None
+    # Keyed on the parsed filters, so ?per_page=024 or a tampered cursor is not a page of its own
+    filters = catalog_filters(request.args)
+    return request.endpoint, auth, filters._replace(cursor=filters.cursor and encode_cursor(filters.cursor))
+
+@app.route('/catalog')
+@catalog_pages.cached(catalog_cache_key)
+def catalog():
+    filters = catalog_filters(request.args)
+    products, next_cursor = fetch_catalog_page(filters)
+    return render_template('customer/catalog.html', products=products, categories=get_categories(),
+                           filters=filters, next_cursor=next_cursor,
+                           featured_count=app.config['CATALOG_FEATURED_COUNT'])
+
+@app.route('/catalog/page')
+@catalog_pages.cached(catalog_cache_key)
+def catalog_page():
+    """JSON "load more" endpoint: the next page of cards for the same filters"""
+    products, next_cursor = fetch_catalog_page(catalog_filters(request.args))
+    html = render_template('customer/_product_cards.html', products=products)
+    return jsonify(products=[p._asdict() for p in products], html=html, next_cursor=next_cursor)
+
+@app.route('/catalog/suggest')
+def catalog_suggest():
+    """Typeahead for the search box, answered from the in-memory prefix index"""
+    suggestions = get_suggestion_index().suggest(request.args.get('q', ''), limit=app.config['SUGGEST_LIMIT'])
+    return jsonify(suggestions=[
+        {'type': kind, 'id': item_id, 'name': name,
+         'url': url_for('catalog', category=item_id) if kind == 'category' else url_for('catalog', search=name)}
+        for kind, item_id, name in suggestions])
 
 @app.route('/add_to_cart/<int:product_id>')
 @login_required('customer')
+@rate_limited('mutation', account=customer_account)
 def add_to_cart(product_id):
-    if 'cart' not in session:
-        session['cart'] = {}
-    if str(product_id) in session['cart']:
-        session['cart'][str(product_id)] += 1
-    else:
-        session['cart'][str(product_id)] = 1
-    session.modified = True
+    cart_store.add(current_cart_id(), product_id, 1)
+    mysql.connection.commit()
     flash('Added to cart!', 'success')
     return redirect(url_for('catalog'))
 
 @app.route('/buy_now/<int:product_id>')
 @login_required('customer')
+@rate_limited('mutation', account=customer_account)
 def buy_now(product_id):
-    cur = mysql.connection.cursor()
-    cur.execute("SELECT * FROM products WHERE id = %s AND stock > 0 AND status = 'approved'", (product_id,))
-    product = cur.fetchone()
-    cur.close()
-    
-    if not product:
+    if not get_repositories().products.is_available(product_id):
         flash('Product not available', 'danger')
         return redirect(url_for('catalog'))
     
@@ -177,6 +556,7 @@ def buy_now(product_id):
 
 @app.route('/buy_now_checkout', methods=['GET', 'POST'])
 @login_required('customer')
+@rate_limited('mutation', account=customer_account, methods=('POST',))
 def buy_now_checkout():
     if 'buy_now_item' not in session:
         flash('No item selected for purchase', 'warning')
@@ -185,9 +565,7 @@ def buy_now_checkout():
     product_id = session['buy_now_item']['product_id']
     quantity = session['buy_now_item']['quantity']
     
-    cur = mysql.connection.cursor()
-    cur.execute("SELECT * FROM products WHERE id = %s", (product_id,))
-    product = cur.fetchone()
+    product = get_product_loader().load(product_id)
     
     if not product:
         flash('Product not found', 'danger')
@@ -198,18 +576,15 @@ def buy_now_checkout():
     
     if request.method == 'POST':
         payment_method = request.form['payment_method']
-        cur.execute("""
-            INSERT INTO orders (user_id, total_amount, payment_method, status) 
-            VALUES (%s, %s, %s, 'Pending')
-        """, (session['customer_user_id'], total, payment_method))
-        order_id = cur.lastrowid
-        
-        cur.execute("INSERT INTO order_items (order_id, product_id, quantity) VALUES (%s, %s, %s)",
-                    (order_id, product_id, quantity))
-        cur.execute("UPDATE products SET stock = stock - %s WHERE id = %s", (quantity, product_id))
-        
-        mysql.connection.commit()
-        cur.close()
+        try:
+            order_id = place_order(mysql.connection, session['customer_user_id'],
+                                   [(product, quantity)], payment_method)
+        except OutOfStock as e:
+            session.pop('buy_now_item', None)
+            flash(out_of_stock_message(e, {product['id']: product}), 'danger')
+            return redirect(url_for('catalog'))
+        if sold_out(get_repositories().products.stock_levels([product['id']])):
+            catalog_pages.invalidate()
         session.pop('buy_now_item', None)
         session.modified = True
         
@@ -218,68 +593,72 @@ def buy_now_checkout():
         flash('Order placed successfully!', 'success')
         return redirect(url_for('customer_orders'))
     
-    cur.close()
     return render_template('customer/checkout.html', total=total, product=product, is_buy_now=True)
 
+def sold_out(levels):
+    """Whether an order left any of these {product_id: stock} at zero.
+
+    The catalog lists in-stock products only, so its cached pages are dropped
+    when a product sells out; other stock changes show once the pages age out.
+    """
+    return 0 in levels.values()
+
+def out_of_stock_message(error, products):
+    """Flash text for an OutOfStock raised by place_order"""
+    parts = []
+    for product_id, requested, available in error.shortfalls:
+        name = products[product_id]['name'] if product_id in products else 'Product #%d' % product_id
+        parts.append('%s (%d requested, %d available)' % (name, requested, available))
+    return 'Some items are partially out of stock, no order was placed: ' + ', '.join(parts)
+
 @app.route('/cart')
 @login_required('customer')
 def cart():
     cart_items = []
     total = 0
-    if 'cart' in session and session['cart']:
-        cur = mysql.connection.cursor()
-        for pid, qty in session['cart'].items():
-            cur.execute("SELECT * FROM products WHERE id = %s", (pid,))
-            product = cur.fetchone()
-            if product:
-                subtotal = product['price'] * qty
-                total += subtotal
-                cart_items.append({'product': product, 'quantity': qty, 'subtotal': subtotal})
-        cur.close()
+    for product, qty in load_cart_products():
+        subtotal = product['price'] * qty
+        total += subtotal
+        cart_items.append({'product': product, 'quantity': qty, 'subtotal': subtotal})
     return render_template('customer/cart.html', cart_items=cart_items, total=total)
 
 @app.route('/update_cart/<int:product_id>', methods=['POST'])
 @login_required('customer')
+@rate_limited('mutation', account=customer_account)
 def update_cart(product_id):
     qty = int(request.form['quantity'])
-    if qty <= 0:
-        session['cart'].pop(str(product_id), None)
-    else:
-        session['cart'][str(product_id)] = qty
-    session.modified = True
+    cart_store.set(current_cart_id(), product_id, qty)
+    mysql.connection.commit()
     return redirect(url_for('cart'))
 
 @app.route('/checkout', methods=['GET', 'POST'])
 @login_required('customer')
+@rate_limited('mutation', account=customer_account, methods=('POST',))
 def checkout():
-    if 'cart' not in session or not session['cart']:
+    if not cart_store.count(current_cart_id()):
         flash('Your cart is empty', 'warning')
         return redirect(url_for('catalog'))
     
-    total = 0
-    cur = mysql.connection.cursor()
-    for pid, qty in session['cart'].items():
-        cur.execute("SELECT price FROM products WHERE id = %s", (pid,))
-        price = cur.fetchone()['price']
-        total += price * qty
+    items = load_cart_products()
+    if not items:
+        return redirect(url_for('cart'))
+    total = sum(product['price'] * qty for product, qty in items)
     
     if request.method == 'POST':
         payment_method = request.form['payment_method']
-        cur.execute("""
-            INSERT INTO orders (user_id, total_amount, payment_method, status) 
-            VALUES (%s, %s, %s, 'Pending')
-        """, (session['customer_user_id'], total, payment_method))
-        order_id = cur.lastrowid
-        
-        for pid, qty in session['cart'].items():
-            cur.execute("INSERT INTO order_items (order_id, product_id, quantity) VALUES (%s, %s, %s)",
-                        (order_id, pid, qty))
-            cur.execute("UPDATE products SET stock = stock - %s WHERE id = %s", (qty, pid))
-        
-        mysql.connection.commit()
-        cur.close()
-        session.pop('cart', None)
-        session.modified = True
+        # A cart in the database is emptied in the order's own transaction
+        cart_in_db = isinstance(cart_store, DbCartStore)
+        try:
+            order_id = place_order(mysql.connection, session['customer_user_id'], items, payment_method,
+                                   cart_clear_statements(current_cart_id()) if cart_in_db else ())
+        except OutOfStock as e:
+            # Nothing was ordered; send the customer back to adjust the cart
+            flash(out_of_stock_message(e, {product['id']: product for product, _ in items}), 'danger')
+            return redirect(url_for('cart'))
+        if sold_out(get_repositories().products.stock_levels([product['id'] for product, _ in items])):
+            catalog_pages.invalidate()
+        if not cart_in_db:
+            cart_store.clear(current_cart_id())
         
         if payment_method == 'online':
             return redirect(url_for('upload_payment', order_id=order_id))
@@ -290,16 +669,21 @@ def checkout():
 
 @app.route('/upload_payment/<int:order_id>', methods=['GET', 'POST'])
 @login_required('customer')
+@rate_limited('mutation', account=customer_account, methods=('POST',))
 def upload_payment(order_id):
     form = PaymentProofForm()
     if form.validate_on_submit():
-        file = form.proof.data
-        filename = f"proof_{order_id}_{file.filename}"
-        file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+        orders = get_repositories().orders
+        order = orders.proof(order_id, session['customer_user_id'])
+        if not order:
+            flash('Order not found', 'danger')
+            return redirect(url_for('customer_orders'))
         cur = mysql.connection.cursor()
-        cur.execute("UPDATE orders SET proof_image = %s WHERE id = %s", (filename, order_id))
-        mysql.connection.commit()
+        filename = save_upload(proof_store, cur, form.proof.data)
+        release_upload(proof_store, cur, order.proof_image)
         cur.close()
+        orders.set_proof(order_id, filename)
+        mysql.connection.commit()
         flash('Proof uploaded! Awaiting approval.', 'success')
         return redirect(url_for('customer_orders'))
     return render_template('customer/payment_upload.html', form=form, order_id=order_id)
@@ -307,96 +691,156 @@ def upload_payment(order_id):
 @app.route('/customer/orders')
 @login_required('customer')
 def customer_orders():
-    update_order_statuses()
-    cur = mysql.connection.cursor()
-    cur.execute("""
-        SELECT o.*, oi.product_id, p.name as product_name, p.image 
-        FROM orders o 
-        JOIN order_items oi ON o.id = oi.order_id 
-        JOIN products p ON oi.product_id = p.id 
-        WHERE o.user_id = %s
-        ORDER BY o.order_date DESC
-    """, (session['customer_user_id'],))
-    orders = cur.fetchall()
-    cur.close()
-    return render_template('customer/orders.html', orders=orders)
+    per_page = get_page_size(request.args, default=app.config['ORDER_HISTORY_PAGE_SIZE'], maximum=50)
+    cursor = decode_cursor(request.args.get('cursor'))
+    
+    after = None
+    if cursor and len(cursor) == 2:
+        after = keyset_condition(['o.order_date', 'o.id'], 'DESC', cursor)
+    
+    orders, has_more = get_repositories().orders.history(session['customer_user_id'], per_page, after=after)
+    next_cursor = encode_cursor([orders[-1].order_date, orders[-1].id]) if has_more else None
+    return render_template('customer/orders.html', orders=orders, next_cursor=next_cursor,
+                           is_first_page=cursor is None)
 
 @app.route('/cancel_order/<int:order_id>')
 @login_required('customer')
+@rate_limited('mutation', account=customer_account)
 def cancel_order(order_id):
-    cur = mysql.connection.cursor()
+    repos = get_repositories()
     
     # Check if order belongs to user and can be cancelled
-    cur.execute("SELECT * FROM orders WHERE id = %s AND user_id = %s", (order_id, session['customer_user_id']))
-    order = cur.fetchone()
+    order = repos.orders.of_user(order_id, session['customer_user_id'])
     
     if not order:
         flash('Order not found', 'danger')
         return redirect(url_for('customer_orders'))
     
-    if order['status'] not in ['Pending']:
+    if order.status not in ['Pending']:
         flash('Order cannot be cancelled', 'warning')
         return redirect(url_for('customer_orders'))
     
     # Restore product stock
-    cur.execute("""
-        SELECT oi.product_id, oi.quantity 
-        FROM order_items oi 
-        WHERE oi.order_id = %s
-    """, (order_id,))
-    order_items = cur.fetchall()
-    
-    for item in order_items:
-        cur.execute("UPDATE products SET stock = stock + %s WHERE id = %s", 
-                   (item['quantity'], item['product_id']))
+    items = repos.orders.items(order_id)
+    repos.products.restock(items)
+    # The restocked rows stay locked until commit, so stock equal to what came back was 0 before
+    levels = repos.products.stock_levels([item.product_id for item in items])
+    back_in_stock = any(levels.get(item.product_id) == item.quantity for item in items)
     
     # Update order status to Cancelled
-    cur.execute("UPDATE orders SET status = 'Cancelled' WHERE id = %s", (order_id,))
+    repos.orders.set_status(order, 'Cancelled')
     mysql.connection.commit()
-    cur.close()
+    if back_in_stock:
+        catalog_pages.invalidate()
     
     flash('Order cancelled successfully', 'success')
     return redirect(url_for('customer_orders'))
 
 # ====================== ADMIN ROUTES ======================
 
+# Server-side admin listings; each page queries and renders a single page of rows
+ORDER_STATUSES = ('Pending', 'Shipped', 'Delivered', 'Declined', 'Cancelled')
+ORDER_FILTERS = {
+    'status': ("o.status = %s", one_of(*ORDER_STATUSES)),
+    'date_from': ("o.order_date >= %s", parse_date),
+    'date_to': ("o.order_date < %s", parse_date_end),
+}
+USER_FILTERS = {
+    'q': ("(u.fullname LIKE %s OR u.email LIKE %s)", prefix_like),
+    'status': ("u.status = %s", one_of('active', 'inactive')),
+    'date_from': ("u.created_at >= %s", parse_date),
+    'date_to': ("u.created_at < %s", parse_date_end),
+}
+ORDER_SORTS = {'id': 'o.id', 'date': 'o.order_date', 'total': 'o.total_amount', 'status': 'o.status'}
+PRODUCT_SELECT = """p.id, p.name, p.image, p.price, p.stock, p.status, p.decline_reason, p.updated_at,
+    c.name AS category_name, u.fullname AS suggested_by_name"""
+PRODUCT_JOINS = """LEFT JOIN categories c ON p.category_id = c.id
+    LEFT JOIN users u ON p.suggested_by = u.id"""
+PRODUCT_SORTS = {'id': 'p.id', 'name': 'p.name', 'price': 'p.price', 'stock': 'p.stock', 'status': 'p.status'}
+
+ADMIN_TABLES = {table.name: table for table in (
+    AdminTable('dashboard_orders', 'admin_dashboard', 'admin/_dashboard_orders_table.html',
+               base='orders', alias='o',
+               select="""o.id, o.user_id, o.total_amount, o.status, u.fullname AS customer_name,
+                   DATEDIFF(CURDATE(), o.order_date) AS days_since""",
+               joins="JOIN users u ON o.user_id = u.id",
+               sorts=ORDER_SORTS, default_sort=('date', 'desc'), filters=ORDER_FILTERS, per_page=10),
+    AdminTable('orders', 'manage_orders', 'admin/_orders_table.html',
+               base='orders', alias='o',
+               select="""o.id, o.total_amount, o.payment_method, o.status, o.proof_image,
+                   u.fullname AS customer_name""",
+               joins="JOIN users u ON o.user_id = u.id",
+               sorts=ORDER_SORTS, default_sort=('date', 'desc'), filters=ORDER_FILTERS),
+    AdminTable('suggestions', 'manage_products', 'admin/_suggestions_table.html',
+               base='products', alias='p', select=PRODUCT_SELECT, joins=PRODUCT_JOINS,
+               where="p.status = 'pending'", sorts=PRODUCT_SORTS, default_sort=('id', 'desc'),
+               per_page=10, prefix='s_'),
+    AdminTable('products', 'manage_products', 'admin/_products_table.html',
+               base='products', alias='p', select=PRODUCT_SELECT, joins=PRODUCT_JOINS,
+               where="p.status <> 'pending'", sorts=PRODUCT_SORTS, default_sort=('id', 'desc'),
+               filters={
+                   'q': ("p.name LIKE %s", prefix_like),
+                   'status': ("p.status = %s", one_of('approved', 'declined')),
+                   'category': ("p.category_id = %s", parse_int),
+               }),
+    AdminTable('users', 'manage_users', 'admin/_users_table.html',
+               base='users', alias='u', select="u.id, u.fullname, u.email, u.status, u.created_at",
+               sorts={'id': 'u.id', 'name': 'u.fullname', 'email': 'u.email', 'status': 'u.status',
+                      'joined': 'u.created_at'},
+               default_sort=('id', 'asc'),
+               filters=USER_FILTERS),
+)}
+
+def fetch_admin_table(name):
+    cur = mysql.connection.cursor()
+    page = ADMIN_TABLES[name].fetch(cur, request.args)
+    cur.close()
+    return page
+
+@app.route('/admin/data/<name>')
+@login_required('admin')
+def admin_table_data(name):
+    """One page of an admin table as JSON, with the rendered table for the page to swap in"""
+    if name not in ADMIN_TABLES:
+        return jsonify({'error': 'Unknown table'}), 404
+    page = fetch_admin_table(name)
+    data = page.to_json()
+    data['html'] = render_template(page.table.template, page=page, categories=get_categories())
+    return jsonify(data)
+
 @app.route('/suggest_product', methods=['POST'])
 @login_required('customer')  # Only customers can suggest
+@rate_limited('mutation', account=customer_account)
 def suggest_product():
-    cur = mysql.connection.cursor()
-    
     filename = None
     if 'image' in request.files:
         file = request.files['image']
         if file and file.filename != '':
-            filename = f"prod_sugg_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{file.filename}"
-            file.save(os.path.join(app.config['PRODUCT_UPLOAD_FOLDER'], filename))
-    
-    cur.execute("""
-        INSERT INTO products 
-        (name, description, price, stock, category_id, status, suggested_by, image) 
-        VALUES (%s, %s, %s, %s, %s, 'pending', %s, %s)
-    """, (
+            cur = mysql.connection.cursor()
+            filename = save_product_image(cur, file)
+            cur.close()
+    
+    get_repositories().products.create(
         request.form['name'],
         request.form['description'],
         request.form['price'],
         request.form.get('stock', 0),
         request.form['category_id'],
-        session['customer_user_id'],
-        filename
-    ))
+        filename,
+        status='pending',
+        suggested_by=session['customer_user_id'],
+    )
     mysql.connection.commit()
-    cur.close()
     flash('Your product suggestion (with image) has been submitted for approval!', 'success')
     return redirect(url_for('my_suggestions'))
 
 @app.route('/admin/approve_product/<int:pid>')
 @login_required('admin')
 def approve_product(pid):
-    cur = mysql.connection.cursor()
-    cur.execute("UPDATE products SET status = 'approved', decline_reason = NULL WHERE id = %s", (pid,))
+    get_repositories().products.approve(pid)
     mysql.connection.commit()
-    cur.close()
+    reindex_product(pid)
+    catalog_pages.invalidate()
     flash('Product approved and now visible!', 'success')
     return redirect(url_for('manage_products'))
 
@@ -408,113 +852,94 @@ def decline_product(pid):
         flash('Please provide a reason for declining.', 'danger')
         return redirect(url_for('manage_products'))
     
-    cur = mysql.connection.cursor()
-    cur.execute("UPDATE products SET status = 'declined', decline_reason = %s WHERE id = %s", (reason, pid))
+    get_repositories().products.decline(pid, reason)
     mysql.connection.commit()
-    cur.close()
+    reindex_product(pid)
+    catalog_pages.invalidate()
     flash('Product declined with reason.', 'info')
     return redirect(url_for('manage_products'))
 
 @app.route('/my_suggestions')
 @login_required('customer')
 def my_suggestions():
-    cur = mysql.connection.cursor()
-    
     # Get user's suggestions
-    cur.execute("""
-        SELECT p.*, c.name as category_name 
-        FROM products p 
-        LEFT JOIN categories c ON p.category_id = c.id 
-        WHERE p.suggested_by = %s 
-        ORDER BY p.id DESC
-    """, (session['customer_user_id'],))
-    suggestions = cur.fetchall()
-    
-    # Get all categories for the modal form
-    cur.execute("SELECT * FROM categories")
-    categories = cur.fetchall()
+    suggestions = get_repositories().products.suggestions_by(session['customer_user_id'])
     
-    cur.close()
-    return render_template('customer/my_suggestions.html', suggestions=suggestions, categories=categories)
+    # Categories for the modal form
+    return render_template('customer/my_suggestions.html', suggestions=suggestions, categories=get_categories())
 
 @app.route('/edit_suggestion/<int:pid>', methods=['GET', 'POST'])
 @login_required('customer')
+@rate_limited('mutation', account=customer_account, methods=('POST',))
 def edit_suggestion(pid):
-    cur = mysql.connection.cursor()
+    products = get_repositories().products
     
     # Only check ownership — allow edit even if approved
-    cur.execute("SELECT * FROM products WHERE id = %s AND suggested_by = %s", (pid, session['customer_user_id']))
-    product = cur.fetchone()
+    product = products.suggestion_for_edit(pid, session['customer_user_id'])
     
     if not product:
         flash('Product not found or not yours.', 'danger')
-        cur.close()
         return redirect(url_for('my_suggestions'))
     
     if request.method == 'POST':
-        filename = product['image']
+        filename = product.image
         if 'image' in request.files:
             file = request.files['image']
             if file and file.filename != '':
-                if filename:
-                    old_path = os.path.join(app.config['PRODUCT_UPLOAD_FOLDER'], filename)
-                    if os.path.exists(old_path):
-                        os.remove(old_path)
-                filename = f"prod_sugg_edit_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{file.filename}"
-                file.save(os.path.join(app.config['PRODUCT_UPLOAD_FOLDER'], filename))
+                cur = mysql.connection.cursor()
+                new_filename = save_product_image(cur, file)
+                release_product_image(cur, filename)
+                cur.close()
+                filename = new_filename
         
         # Reset to pending when edited (so admin reviews changes)
-        cur.execute("""
-            UPDATE products 
-            SET name = %s, description = %s, price = %s, stock = %s, category_id = %s, status = 'pending', image = %s
-            WHERE id = %s
-        """, (
+        products.update(
+            pid,
             request.form['name'],
             request.form['description'],
             request.form['price'],
             request.form.get('stock', 0),
             request.form['category_id'],
             filename,
-            pid
-        ))
+            resubmit=True,
+        )
         mysql.connection.commit()
-        cur.close()
+        reindex_product(pid)
+        catalog_pages.invalidate()
         flash('Your product has been updated and sent back for review!', 'info')
         return redirect(url_for('my_suggestions'))
     
-    cur.execute("SELECT * FROM categories")
-    categories = cur.fetchall()
-    cur.close()
-    
-    return render_template('customer/edit_suggestion.html', product=product, categories=categories)
+    return render_template('customer/edit_suggestion.html', product=product, categories=get_categories())
 
 @app.route('/delete_suggestion/<int:pid>')
 @login_required('customer')
+@rate_limited('mutation', account=customer_account)
 def delete_suggestion(pid):
-    cur = mysql.connection.cursor()
+    products = get_repositories().products
     
     # Only check ownership — allow delete even if approved
-    cur.execute("SELECT image FROM products WHERE id = %s AND suggested_by = %s", (pid, session['customer_user_id']))
-    product = cur.fetchone()
+    product = products.image(pid, suggested_by=session['customer_user_id'])
     
     if not product:
         flash('Product not found or not yours.', 'danger')
     else:
-        # Delete image if exists
-        if product['image']:
-            image_path = os.path.join(app.config['PRODUCT_UPLOAD_FOLDER'], product['image'])
-            if os.path.exists(image_path):
-                os.remove(image_path)
+        # Delete image unless another product shares it
+        cur = mysql.connection.cursor()
+        release_product_image(cur, product.image)
+        cur.close()
         
-        cur.execute("DELETE FROM products WHERE id = %s", (pid,))
+        products.delete(pid)
         flash('Product deleted successfully.', 'success')
     
     mysql.connection.commit()
-    cur.close()
+    search_index.remove(pid)
+    suggestion_index.remove(pid)
+    catalog_pages.invalidate()
     return redirect(url_for('my_suggestions'))
 
 #===============
 @app.route('/admin/login', methods=['GET', 'POST'])
+@rate_limited('login', account=login_account, methods=('POST',))
 def admin_login():
     form = LoginForm()
     if form.validate_on_submit():
@@ -527,72 +952,53 @@ def admin_login():
         flash('Invalid admin credentials', 'danger')
     return render_template('admin/login.html', form=form)
 
-@app.route('/admin/dashboard')
-@login_required('admin')
-def admin_dashboard():
-    update_order_statuses()
+def dashboard_years(args):
+    """(year shown, last year in the dropdown) for the dashboard charts"""
     current_year = datetime.now().year
     default_year = max(2025, current_year)  # Ensure minimum year is 2025
-    year = request.args.get('year', default_year, type=int)
+    year = args.get('year', default_year, type=int)
     # Ensure year is at least 2025
     if year < 2025:
         year = 2025
-    cur = mysql.connection.cursor()
-    
-    # Top stats
-    cur.execute("SELECT COUNT(*) as total_users FROM users")
-    total_users = cur.fetchone()['total_users']
+    # Calculate year range for dropdown (2025 to current year + 5)
+    end_year = max(2030, current_year + 5)  # At least show up to 2030, or current year + 5 if later
+    return year, end_year
+
+def monthly_series(signups, sales):
+    """users_by_month and sales_by_month for the dashboard charts"""
+    users_by_month = [0] * 12
+    for row in signups:
+        if row.month and row.count:
+            users_by_month[row.month - 1] = int(row.count)
     
-    cur.execute("SELECT COUNT(*) as total_orders FROM orders")
-    total_orders = cur.fetchone()['total_orders']
+    sales_by_month = [0.0] * 12
+    for row in sales:
+        if row.month and row.sales is not None:
+            sales_by_month[row.month - 1] = float(row.sales)
+    return users_by_month, sales_by_month
+
+@app.route('/admin/dashboard')
+@login_required('admin')
+def admin_dashboard():
+    year, end_year = dashboard_years(request.args)
+    repos = get_repositories()
+    cur = mysql.connection.cursor()
     
-    cur.execute("SELECT SUM(total_amount) as total_sales FROM orders WHERE status IN ('Shipped', 'Delivered')")
-    total_sales = cur.fetchone()['total_sales'] or 0
+    # Top stats (maintained incrementally, see rollups.py)
+    counters = rollups.read_counters(cur)
+    cur.close()
+    total_users = counters['users']
+    total_orders = counters['orders']
+    total_sales = counters['sales']
+    total_products = counters['products']
     
-    cur.execute("SELECT COUNT(*) as total_products FROM products")
-    total_products = cur.fetchone()['total_products']
+    year_start, next_year_start = date(year, 1, 1), date(year + 1, 1, 1)
     
-    # Users by month
-    cur.execute("""
-        SELECT MONTH(created_at) as month, COUNT(*) as count 
-        FROM users 
-        WHERE YEAR(created_at) = %s 
-        GROUP BY MONTH(created_at)
-    """, (year,))
-    users_by_month_raw = cur.fetchall()
-    users_by_month = [0] * 12
-    for row in users_by_month_raw:
-        if row['month'] and row['count']:
-            users_by_month[row['month'] - 1] = int(row['count'])
-    
-    # Sales by month
-    cur.execute("""
-        SELECT MONTH(order_date) as month, SUM(total_amount) as sales 
-        FROM orders 
-        WHERE YEAR(order_date) = %s AND status IN ('Shipped', 'Delivered') 
-        GROUP BY MONTH(order_date)
-    """, (year,))
-    sales_by_month_raw = cur.fetchall()
-    sales_by_month = [0.0] * 12
-    for row in sales_by_month_raw:
-        if row['month'] and row['sales'] is not None:
-            sales_by_month[row['month'] - 1] = float(row['sales'])
-        else:
-            sales_by_month[row['month'] - 1] = 0.0
-    
-    # Orders for table
-    cur.execute("""
-        SELECT o.*, u.fullname as customer_name, u.id as user_id,
-        DATEDIFF(CURDATE(), o.order_date) as days_since
-        FROM orders o 
-        JOIN users u ON o.user_id = u.id 
-        ORDER BY o.order_date DESC
-    """)
-    orders = cur.fetchall()
+    # Users and sales by month
+    users_by_month, sales_by_month = monthly_series(repos.users.signups_by_month(year_start, next_year_start),
+                                                    repos.orders.sales_by_month(year_start, next_year_start))
     
-    cur.close()
-    # Calculate year range for dropdown (2025 to current year + 5)
-    end_year = max(2030, current_year + 5)  # At least show up to 2030, or current year + 5 if later
+    orders = fetch_admin_table('dashboard_orders')
     return render_template('admin/dashboard.html', total_users=total_users, total_orders=total_orders, 
                            total_sales=total_sales, total_products=total_products, 
                            users_by_month=users_by_month, sales_by_month=sales_by_month, 
@@ -602,87 +1008,143 @@ def admin_dashboard():
 @login_required('admin')
 def manage_products():
     form = ProductForm()
-    cur = mysql.connection.cursor()
-    cur.execute("SELECT * FROM categories")
-    categories = cur.fetchall()
-    form.category_id.choices = [(c['id'], c['name']) for c in categories]
+    form.category_id.choices = [(c['id'], c['name']) for c in get_categories()]
+    products = get_repositories().products
 
     if form.validate_on_submit():
+        cur = mysql.connection.cursor()
         # === HANDLE IMAGE UPLOAD ===
         filename = None
         if 'image' in request.files:
             file = request.files['image']
             if file and file.filename != '':
-                filename = f"prod_admin_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{file.filename}"
-                file.save(os.path.join(app.config['PRODUCT_UPLOAD_FOLDER'], filename))
+                filename = save_product_image(cur, file)
 
         if request.args.get('id'):
             # EDIT EXISTING PRODUCT
             product_id = request.args.get('id')
-            cur.execute("SELECT image FROM products WHERE id = %s", (product_id,))
-            old_image = cur.fetchone()['image']
+            old_image = products.image(product_id).image
             final_image = filename or old_image
 
-            # Delete old image if replaced
+            # Delete old image if replaced (and nothing else uses it)
             if filename and old_image:
-                old_path = os.path.join(app.config['PRODUCT_UPLOAD_FOLDER'], old_image)
-                if os.path.exists(old_path):
-                    os.remove(old_path)
+                release_product_image(cur, old_image)
 
-            cur.execute("""
-                UPDATE products 
-                SET name=%s, description=%s, price=%s, stock=%s, category_id=%s, image=%s
-                WHERE id=%s
-            """, (form.name.data, form.description.data, form.price.data, form.stock.data,
-                  form.category_id.data, final_image, product_id))
+            products.update(product_id, form.name.data, form.description.data, form.price.data, form.stock.data,
+                            form.category_id.data, final_image)
             flash('Product updated successfully!', 'success')
 
         else:
             # ADD NEW PRODUCT
-            cur.execute("""
-                INSERT INTO products 
-                (name, description, price, stock, category_id, image, status) 
-                VALUES (%s, %s, %s, %s, %s, %s, 'approved')
-            """, (form.name.data, form.description.data, form.price.data, form.stock.data,
-                  form.category_id.data, filename))
+            product_id = products.create(form.name.data, form.description.data, form.price.data, form.stock.data,
+                                         form.category_id.data, filename)
             flash('Product added successfully!', 'success')
 
         mysql.connection.commit()
         cur.close()
+        reindex_product(product_id)
+        catalog_pages.invalidate()
         return redirect(url_for('manage_products'))
 
     # Load product for editing
+    product = None
     product_id = request.args.get('id')
     if product_id:
-        cur.execute("SELECT * FROM products WHERE id = %s", (product_id,))
-        product = cur.fetchone()
+        product = products.for_edit(product_id)
         if product:
-            form.name.data = product['name']
-            form.description.data = product['description'] or ''
-            form.price.data = product['price']
-            form.stock.data = product['stock']
-            form.category_id.data = product['category_id']
-
-    # Load all products for table
-    cur.execute("""
-        SELECT p.*, c.name as category_name, u.fullname as suggested_by_name 
-        FROM products p 
-        LEFT JOIN categories c ON p.category_id = c.id 
-        LEFT JOIN users u ON p.suggested_by = u.id
-        ORDER BY p.id DESC
-    """)
-    products = cur.fetchall()
-    cur.close()
+            form.name.data = product.name
+            form.description.data = product.description or ''
+            form.price.data = product.price
+            form.stock.data = product.stock
+            form.category_id.data = product.category_id
+
+    return render_template('admin/manage_products.html', form=form, product=product,
+                           suggestions=fetch_admin_table('suggestions'), products=fetch_admin_table('products'),
+                           categories=get_categories())
+
+def product_importer(images=None, create_categories=False):
+    return ProductImporter(mysql.connection, get_repositories(), save_product_image, release_product_image,
+                           images=images, batch_size=app.config['IMPORT_BATCH_SIZE'],
+                           create_categories=create_categories)
+
+def detach_upload(file):
+    """Copy an uploaded file into an anonymous temp file the caller owns"""
+    copy = tempfile.TemporaryFile()
+    shutil.copyfileobj(file.stream, copy)
+    copy.seek(0)
+    return copy
 
-    return render_template('admin/manage_products.html', form=form, products=products)
+def finish_import(report):
+    """Drop the cached views of products once an import has changed some"""
+    if report.categories_created:
+        category_cache.invalidate()
+    if report.inserted or report.updated:
+        search_index.invalidate()
+        suggestion_index.invalidate()
+        catalog_pages.invalidate()
+
+@app.route('/admin/products/import', methods=['POST'])
+@login_required('admin')
+def import_products():
+    """Bulk import from an uploaded CSV/JSONL feed (plus an optional zip of images); streams progress as text"""
+    request.max_content_length = app.config['MAX_IMPORT_SIZE']
+    feed = request.files.get('feed')
+    fmt = feed_format(feed.filename) if feed else None
+    if fmt is None:
+        flash('Choose a .csv or .jsonl file to import', 'danger')
+        return redirect(url_for('manage_products'))
+    # The request closes its uploads once this view returns, before the response is streamed
+    uploads = [detach_upload(feed)]
+    images = None
+    archive = request.files.get('images')
+    if archive and archive.filename:
+        uploads.append(detach_upload(archive))
+        try:
+            images = ImageSource(uploads[-1])
+        except zipfile.BadZipFile:
+            for upload in uploads:
+                upload.close()
+            flash('Product images must be uploaded as a .zip file', 'danger')
+            return redirect(url_for('manage_products'))
+    create_categories = bool(request.form.get('create_categories'))
+    
+    def progress():
+        importer = product_importer(images, create_categories)
+        shown = 0
+        try:
+            for report in importer.run(uploads[0], fmt):
+                yield report.summary() + '\n'
+                for line, message in report.errors[shown:]:
+                    yield '  line %d: %s\n' % (line, message)
+                shown = len(report.errors)
+        except Exception as error:
+            app.logger.exception('Product import failed')
+            yield 'Import stopped, later rows were not imported: %s\n' % error
+        finally:
+            finish_import(importer.report)
+            if images:
+                images.close()
+            for upload in uploads:
+                upload.close()
+        if importer.report.categories_created:
+            yield '%d categories created\n' % importer.report.categories_created
+    
+    return app.response_class(stream_with_context(progress()), mimetype='text/plain')
 
 @app.route('/admin/delete_product/<int:pid>')
 @login_required('admin')
 def delete_product(pid):
-    cur = mysql.connection.cursor()
-    cur.execute("DELETE FROM products WHERE id = %s", (pid,))
+    products = get_repositories().products
+    product = products.image(pid)
+    products.delete(pid)
+    if product:
+        cur = mysql.connection.cursor()
+        release_product_image(cur, product.image)
+        cur.close()
     mysql.connection.commit()
-    cur.close()
+    search_index.remove(pid)
+    suggestion_index.remove(pid)
+    catalog_pages.invalidate()
     flash('Product deleted', 'success')
     return redirect(url_for('manage_products'))
 
@@ -691,33 +1153,20 @@ def delete_product(pid):
 def manage_categories():
     form = CategoryForm()
     if form.validate_on_submit():
-        cur = mysql.connection.cursor()
-        cur.execute("INSERT INTO categories (name) VALUES (%s)", (form.name.data,))
+        category_id = get_repositories().categories.create(form.name.data)
         mysql.connection.commit()
-        cur.close()
+        category_cache.invalidate()
+        suggestion_index.add_category({'id': category_id, 'name': form.name.data})
+        catalog_pages.invalidate()
         flash('Category added', 'success')
         return redirect(url_for('manage_categories'))
     
-    cur = mysql.connection.cursor()
-    cur.execute("SELECT * FROM categories")
-    categories = cur.fetchall()
-    cur.close()
-    return render_template('admin/manage_categories.html', form=form, categories=categories)
+    return render_template('admin/manage_categories.html', form=form, categories=get_categories())
 
 @app.route('/admin/orders')
 @login_required('admin')
 def manage_orders():
-    update_order_statuses()
-    cur = mysql.connection.cursor()
-    cur.execute("""
-        SELECT o.*, u.fullname as customer_name 
-        FROM orders o 
-        JOIN users u ON o.user_id = u.id 
-        ORDER BY o.order_date DESC
-    """)
-    orders = cur.fetchall()
-    cur.close()
-    return render_template('admin/manage_orders.html', orders=orders)
+    return render_template('admin/manage_orders.html', orders=fetch_admin_table('orders'))
 
 @app.route('/admin/process_order/<int:order_id>', methods=['POST'])
 @login_required('admin')
@@ -725,11 +1174,13 @@ def process_order(order_id):
     action = request.form['action']
     reason = request.form.get('reason', '')
     status = 'Shipped' if action == 'approve' else 'Declined'
-    cur = mysql.connection.cursor()
-    cur.execute("UPDATE orders SET status = %s, admin_note = %s WHERE id = %s",
-                (status, reason, order_id))
+    orders = get_repositories().orders
+    order = orders.lock(order_id)
+    if not order:
+        flash('Order not found', 'danger')
+        return redirect(url_for('manage_orders'))
+    orders.set_status(order, status, note=reason)
     mysql.connection.commit()
-    cur.close()
     flash(f'Order {status.lower()}', 'success')
     return redirect(url_for('manage_orders'))
 
@@ -737,60 +1188,152 @@ def process_order(order_id):
 @login_required('admin')
 def sales_report():
     period = request.args.get('period', 'daily')
-    cur = mysql.connection.cursor()
-    if period == 'daily':
-        cur.execute("SELECT DATE(order_date) as date, SUM(total_amount) as sales FROM orders WHERE status IN ('Shipped', 'Delivered') GROUP BY DATE(order_date)")
-    elif period == 'weekly':
-        cur.execute("SELECT WEEK(order_date) as week, SUM(total_amount) as sales FROM orders WHERE status IN ('Shipped', 'Delivered') GROUP BY WEEK(order_date)")
-    else:  # monthly
-        cur.execute("SELECT MONTH(order_date) as month, SUM(total_amount) as sales FROM orders WHERE status IN ('Shipped', 'Delivered') GROUP BY MONTH(order_date)")
-    report = cur.fetchall()
-    cur.close()
+    report = get_repositories().orders.sales_report(period)
     return render_template('admin/sales_report.html', report=report, period=period)
 
+# Streamed downloads for finance tooling; the filter args match the admin tables
+SALES_FILTERS = {
+    'date_from': ("day >= %s", parse_date),
+    'date_to': ("day < %s", parse_date_end),
+}
+
+def stream_export(name, fmt, columns, filters, query, item_fields=None):
+    """A CSV/JSONL download of the `columns` rows that `query(repositories, conditions, params)` streams.
+
+    The query runs inside the response generator, on a connection of its own
+    (the view's goes back to the pool when it returns), and its server-side
+    cursor is read a chunk at a time as the client takes the response.
+    """
+    conditions, params, _ = apply_filters(filters, request.args)
+
+    def generate():
+        rows = query(get_repositories(), conditions, params)
+        try:
+            yield from export_chunks(fmt, columns, rows, item_fields)
+        finally:
+            rows.close()
+
+    response = app.response_class(stream_with_context(generate()), mimetype=EXPORT_FORMATS[fmt])
+    response.headers['Content-Disposition'] = 'attachment; filename="%s-%s.%s"' % (name, date.today(), fmt)
+    return response
+
+@app.route('/admin/export/orders.<any(csv, jsonl):fmt>')
+@login_required('admin')
+def export_orders(fmt):
+    """Orders with their items; ?status=&date_from=&date_to= as on the orders table"""
+    return stream_export('orders', fmt, OrderExport._fields, ORDER_FILTERS,
+                         lambda repositories, conditions, params: repositories.orders.export(conditions, params),
+                         item_fields=ORDER_EXPORT_ITEM_FIELDS)
+
+@app.route('/admin/export/sales.<any(csv, jsonl):fmt>')
+@login_required('admin')
+def export_sales(fmt):
+    """Sales per ?period=daily|weekly|monthly from the daily rollup, within ?date_from=&date_to="""
+    period = request.args.get('period', 'daily')
+    if period not in SALES_EXPORTS:
+        period = 'daily'
+    return stream_export('sales-' + period, fmt, SALES_EXPORTS[period][0]._fields, SALES_FILTERS,
+                         lambda repositories, conditions, params:
+                             repositories.orders.sales_export(period, conditions, params))
+
+@app.route('/admin/export/users.<any(csv, jsonl):fmt>')
+@login_required('admin')
+def export_users(fmt):
+    """Users without their passwords; ?q=&status=&date_from=&date_to= as on the users table"""
+    return stream_export('users', fmt, UserExport._fields, USER_FILTERS,
+                         lambda repositories, conditions, params: repositories.users.export(conditions, params))
+
+@app.route('/admin/db_pool')
+@login_required('admin')
+def db_pool_stats():
+    """Connection pool counters for this worker process (for sizing MYSQL_POOL_*)"""
+    return jsonify(mysql.pool.stats())
+
+@request_metrics.add_gauges
+def process_gauges():
+    pool = mysql.pool.stats()
+    return [
+        ('db_pool_connections', 'Pooled MySQL connections by state',
+         {(('state', 'in_use'),): pool['in_use'], (('state', 'idle'),): pool['idle']}),
+        ('db_pool_size', 'Open pooled MySQL connections', {(): pool['size']}),
+        ('auto_delivery_last_duration_seconds', 'Duration of the last auto-delivery run',
+         {(): auto_delivery_job.stats['last_duration']}),
+        ('requests_in_flight', 'Requests this process is working on', {(): admission.in_flight}),
+    ]
+
+@request_metrics.add_counters
+def process_counters():
+    pool = mysql.pool.stats()
+    job = auto_delivery_job.stats
+    fragments = app.jinja_env.fragment_cache.stats()
+    return [
+        ('db_pool_connections_created_total', 'MySQL connections the pool opened', {(): pool['created']}),
+        ('db_pool_connections_closed_total', 'MySQL connections the pool closed', {(): pool['closed']}),
+        ('db_pool_acquired_total', 'Connections handed out by the pool', {(): pool['acquired']}),
+        ('db_pool_waits_total', 'Times a request had to wait for a connection', {(): pool['waits']}),
+        ('db_pool_wait_seconds_total', 'Time requests spent waiting for a connection', {(): pool['wait_seconds']}),
+        ('db_pool_timeouts_total', 'Times no connection freed up in time', {(): pool['timeouts']}),
+        ('db_pool_ping_failures_total', 'Idle connections dropped after a failed ping', {(): pool['ping_failures']}),
+        ('auto_delivery_runs_total', 'Auto-delivery job runs in this process', {(): job['runs']}),
+        ('auto_delivery_failures_total', 'Auto-delivery job runs that raised', {(): job['failures']}),
+        ('auto_delivery_rows_total', 'Orders marked delivered by this process', {(): job['rows_total']}),
+        ('page_cache_lookups_total', 'Catalog page cache lookups by result',
+         {(('result', name),): value for name, value in catalog_pages.stats.items()}),
+        ('fragment_cache_lookups_total', 'Product card fragment cache lookups by result',
+         {(('result', 'hit'),): fragments['hits'], (('result', 'miss'),): fragments['misses']}),
+        ('requests_shed_total', 'Requests turned away at MAX_CONCURRENT_REQUESTS', {(): admission.shed}),
+        ('rate_limited_requests_total', 'Requests refused by a rate limit, by budget and bucket',
+         {(('budget', budget), ('key', kind)): value for (budget, kind), value in dict(rate_limiter.rejected).items()}),
+        ('rate_limit_store_errors_total', 'Rate limit checks skipped because the store failed',
+         {(): rate_limiter.errors}),
+    ]
+
+@app.route('/admin/metrics')
+@login_required('admin')
+def metrics():
+    """Prometheus text format metrics for this worker process"""
+    return app.response_class(request_metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/admin/cache_stats')
+@login_required('admin')
+def cache_stats():
+    """Hit/miss counters of the catalog page cache and the product card fragment cache"""
+    return jsonify(catalog_pages=catalog_pages.stats, fragments=app.jinja_env.fragment_cache.stats())
+
 @app.route('/admin/users')
 @login_required('admin')
 def manage_users():
-    cur = mysql.connection.cursor()
-    cur.execute("SELECT * FROM users")
-    users = cur.fetchall()
-    cur.close()
-    return render_template('admin/manage_users.html', users=users)
+    return render_template('admin/manage_users.html', users=fetch_admin_table('users'))
 
 @app.route('/admin/toggle_user/<int:user_id>')
 @login_required('admin')
 def toggle_user(user_id):
-    cur = mysql.connection.cursor()
-    cur.execute("UPDATE users SET status = IF(status='active', 'inactive', 'active') WHERE id = %s", (user_id,))
+    get_repositories().users.toggle_status(user_id)
     mysql.connection.commit()
-    cur.close()
     flash('User status updated', 'success')
     return redirect(url_for('manage_users'))
 
 @app.route('/admin/reset_password/<int:user_id>')
 @login_required('admin')
 def reset_user_password(user_id):
-    cur = mysql.connection.cursor()
+    users = get_repositories().users
     # Check if user exists
-    cur.execute("SELECT * FROM users WHERE id = %s", (user_id,))
-    user = cur.fetchone()
+    user = users.name(user_id)
     if not user:
         flash('User not found', 'danger')
-        cur.close()
         return redirect(url_for('manage_users'))
     
     # Reset password to default
     default_password = 'password123'
-    cur.execute("UPDATE users SET password = %s WHERE id = %s", (default_password, user_id))
+    users.set_password(user_id, default_password)
     mysql.connection.commit()
-    cur.close()
-    flash(f'Password reset successfully for {user["fullname"]}. New password: {default_password}', 'success')
+    flash(f'Password reset successfully for {user.fullname}. New password: {default_password}', 'success')
     return redirect(url_for('manage_users'))
 
 @app.route('/customer/logout')
 def customer_logout():
     # Only clear customer session keys
-    keys = ['customer_logged_in', 'customer_role', 'customer_user_id', 'customer_username', 'cart', 'buy_now_item']
+    keys = ['customer_logged_in', 'customer_role', 'customer_user_id', 'customer_username', 'cart_id', 'buy_now_item']
     for key in keys:
         session.pop(key, None)
     
@@ -818,6 +1361,128 @@ def logout():
     # If neither is logged in, redirect to index
     return redirect(url_for('index'))
 
+# ====================== BACKGROUND JOBS ======================
+
+def run_auto_delivery():
+    with app.app_context():
+        return update_order_statuses()
+
+auto_delivery_job = PeriodicJob('auto-delivery', run_auto_delivery, interval=app.config['AUTO_DELIVERY_INTERVAL'])
+
+def rebuild_search_indexes():
+    """Rebuild this process's search and typeahead indexes ahead of their TTL"""
+    with app.app_context():
+        search_index.refresh(search_documents, force=True)
+        suggestion_index.refresh(suggestion_documents, force=True)
+    return len(search_index)
+
+# Keeps the rebuild out of the request that would have found the indexes stale
+search_index_job = PeriodicJob('search-index', rebuild_search_indexes, interval=app.config['SEARCH_INDEX_TTL'])
+
+# Opens MYSQL_POOL_MIN_SIZE connections ahead of the requests that need them, and again after
+# connections were retired or failed their ping
+pool_warmup_job = PeriodicJob('mysql-pool', mysql.pool.fill, interval=app.config['MYSQL_POOL_IDLE_TIMEOUT'])
+
+@app.before_request
+def start_background_jobs():
+    """Start this worker process's jobs; auto-delivery runs here unless a separate
+    `flask auto-deliver --loop` handles it.
+
+    Started by the first request each worker process serves, not at import: CLI
+    commands, scripts that import the app and a `gunicorn --preload` master
+    (whose threads do not survive the fork) never start them.
+    """
+    pool_warmup_job.start()
+    search_index_job.start()
+    if app.config['AUTO_DELIVERY_IN_PROCESS']:
+        auto_delivery_job.start()
+
+@app.cli.command('auto-deliver')
+@click.option('--loop', is_flag=True, help='Keep running every AUTO_DELIVERY_INTERVAL seconds.')
+def auto_deliver_command(loop):
+    """Mark shipped orders older than 3 days as delivered."""
+    if not loop:
+        rows = auto_delivery_job.run_once()
+        click.echo('Another worker is running auto-delivery' if rows is None else f'{rows} order(s) marked as Delivered')
+        return
+    click.echo(f'Auto-delivery running every {auto_delivery_job.interval}s (Ctrl+C to stop)')
+    auto_delivery_job.run_forever()
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """Create the dashboard rollup tables and recompute them from orders/users/products."""
+    with app.app_context():
+        cur = mysql.connection.cursor()
+        rollups.rebuild(cur)
+        mysql.connection.commit()
+        cur.close()
+    click.echo('Rollups rebuilt')
+
+@app.cli.command('migrate')
+def migrate_command():
+    """Apply pending schema migrations (tables and indexes)."""
+    with app.app_context():
+        applied = migrations.upgrade(mysql.connection)
+    click.echo('\n'.join(f'Applied {name}' for name in applied) or 'Schema is up to date')
+
+@app.cli.command('check-queries')
+@click.option('--min-rows', default=0, help='Ignore full scans of tables estimated below this many rows.')
+def check_queries_command(min_rows):
+    """EXPLAIN the hot queries and fail if any of them needs a full table scan."""
+    with app.app_context():
+        cur = mysql.connection.cursor()
+        problems = check_hot_queries(cur, min_rows=min_rows)
+        cur.close()
+    for name, table, rows in problems:
+        click.echo(f'FULL SCAN  {name}: table {table} (~{rows} rows)')
+    if problems:
+        raise SystemExit(1)
+    click.echo(f'All {len(HOT_QUERIES)} hot queries use an index')
+
+@app.cli.command('import-products')
+@click.argument('feed', type=click.Path(exists=True, dir_okay=False))
+@click.option('--images', type=click.Path(exists=True), help='Directory or .zip with the files named in the image column.')
+@click.option('--create-categories', is_flag=True, help='Add categories the feed names that do not exist yet.')
+def import_products_command(feed, images, create_categories):
+    """Bulk import products from a CSV or JSONL feed, upserting on sku."""
+    fmt = feed_format(feed)
+    if fmt is None:
+        raise click.ClickException('The feed must be a .csv or .jsonl file')
+    try:
+        source = ImageSource(images) if images else None
+    except zipfile.BadZipFile:
+        raise click.ClickException('--images must be a directory or a .zip file')
+    with app.app_context():
+        importer = product_importer(source, create_categories)
+        try:
+            with open(feed, 'rb') as stream:
+                for report in importer.run(stream, fmt):
+                    click.echo(report.summary())
+        finally:
+            finish_import(importer.report)
+            if source:
+                source.close()
+    for line, message in importer.report.errors:
+        click.echo(f'line {line}: {message}', err=True)
+    if importer.report.categories_created:
+        click.echo(f'{importer.report.categories_created} categories created')
+
+@app.cli.command('build-image-variants')
+def build_image_variants_command():
+    """Generate missing WebP variants for every product image."""
+    if not image_pipeline.enabled:
+        raise click.ClickException('Pillow is not installed')
+    with app.app_context():
+        filenames = {row.image for row in get_repositories().products.images()}
+    jobs = [image_pipeline.submit(name) for name in filenames if not image_pipeline.is_ready(name)]
+    built = sum(1 for job in jobs if job.result())
+    click.echo(f'Built variants for {built} of {len(jobs)} image(s)')
+
+@app.cli.command('compress-assets')
+def compress_assets_command():
+    """Precompress text files under static/ (.gz, plus .br if brotli is installed)."""
+    click.echo(f'Compressed {assets.compress_all()} file(s)')
+
 #=========================================
 
 if __name__ == '__main__':
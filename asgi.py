@@ -0,0 +1,446 @@
+"""Optional ASGI entry point: `uvicorn asgi:application` (needs aiomysql, aiofiles and a2wsgi).
+
+The hot routes (catalog, cart, checkout, customer orders, payment proof
+upload and the admin dashboard) run here as coroutines on an aiomysql pool
+(asyncdb.py), so a request waiting on MySQL or on disk no longer ties up a
+thread. Every other route is the unchanged Flask view, run on a2wsgi's
+thread pool.
+
+A native view runs inside an ordinary Flask request context built from the
+ASGI request: sessions, flash messages, forms and CSRF, the before/after
+request hooks (admission control, metrics), login_required, rate_limited
+and the templates are all the WSGI app's own.
+"""
+import sys
+import asyncio
+import inspect
+import tempfile
+from datetime import date
+
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:  # a2wsgi is optional; only the ASGI mode needs it
+    WSGIMiddleware = None
+
+from flask import render_template, redirect, url_for, flash, request, session, jsonify, g
+from werkzeug.exceptions import HTTPException, RequestEntityTooLarge
+
+import app as shop
+from app import app, login_required, rate_limited, customer_account
+from asyncdb import AsyncMySQLPool, AsyncDataAccess, AsyncDbCartStore, InlineCartStore, place_order
+from carts import DbCartStore, cart_clear_statements
+from forms import PaymentProofForm
+from ordering import OutOfStock
+from pagination import get_page_size, encode_cursor, decode_cursor, keyset_condition
+
+async_pool = AsyncMySQLPool(app.config)
+
+
+@shop.request_metrics.add_gauges
+def async_pool_gauges():
+    pool = async_pool.stats()
+    return [
+        ('async_db_pool_connections', 'aiomysql pool connections by state',
+         {(('state', 'in_use'),): pool['in_use'], (('state', 'idle'),): pool['idle']}),
+        ('async_db_pool_size', 'Open aiomysql pool connections', {(): pool['size']}),
+    ]
+
+
+@shop.request_metrics.add_counters
+def async_pool_counters():
+    pool = async_pool.stats()
+    return [
+        ('async_db_pool_acquired_total', 'Connections handed out by the aiomysql pool', {(): pool['acquired']}),
+        ('async_db_pool_timeouts_total', 'Times no async connection freed up in time', {(): pool['timeouts']}),
+    ]
+
+
+def async_carts(data):
+    """The cart store on the request's async connection"""
+    if isinstance(shop.cart_store, DbCartStore):
+        return AsyncDbCartStore(data)
+    return InlineCartStore(shop.cart_store)
+
+
+async def current_cart_id():
+    if 'cart_id' not in session:
+        session['cart_id'] = await g.carts.cart_for_user(session['customer_user_id'])
+    return session['cart_id']
+
+
+async def remove_rolled_back_uploads():
+    """shop.remove_released_uploads() for proofs save_async() wrote: once the request's
+    transaction is rolled back, a proof that did not get committed has no reference left"""
+    new_proofs = g.pop('new_proofs', None)
+    if not new_proofs:
+        return
+    conn = await g.data.connection()
+    await conn.rollback()
+    for filename in new_proofs:
+        try:
+            await shop.proof_store.purge_async(conn, filename)
+        except Exception:
+            app.logger.exception('Could not remove rolled back upload %s', filename)
+
+
+async def render_in_thread(template, **context):
+    """render_template() on a worker thread: templates call asset_url(), which stats the static
+    files and hashes any it has not seen yet. The request context goes along (to_thread copies it)."""
+    return await asyncio.to_thread(render_template, template, **context)
+
+
+async def render(template, **context):
+    """render_template() for customer pages, with the navbar's cart badge counted beforehand
+    (the cart_helpers context processor would query MySQL from inside the template)"""
+    count = 0
+    if session.get('customer_logged_in'):
+        count = await g.carts.count(await current_cart_id())
+    return await render_in_thread(template, cart_count=lambda: count, **context)
+
+
+async def get_categories():
+    async def load():
+        return tuple(category._asdict() for category in await g.data.categories.all())
+    return await shop.category_cache.get_async(load)
+
+
+def rebuild_search_index():
+    with app.app_context():
+        shop.get_search_index()
+
+
+async def get_search_index():
+    if shop.search_index.is_stale:
+        # The rebuild streams every product; run it on a thread with a blocking connection of its own.
+        # If another thread is already rebuilding, this returns at once and the old contents are used.
+        await asyncio.to_thread(rebuild_search_index)
+    return shop.search_index
+
+
+async def load_cart_products():
+    cart_id = await current_cart_id()
+    cart = await g.carts.items(cart_id)
+    products = {product.id: product for product in await g.data.products.by_ids(list(cart))}
+    missing = [pid for pid in cart if pid not in products]
+    if missing:
+        for pid in missing:
+            await g.carts.set(cart_id, pid, 0)
+        await g.data.commit()
+        flash('Some items in your cart are no longer available and were removed.', 'warning')
+    return [(products[pid], qty) for pid, qty in cart.items() if pid in products]
+
+
+async def fetch_catalog_page(filters):
+    product_ids = None
+    if filters.search:
+        product_ids = (await get_search_index()).search(filters.search, limit=app.config['SEARCH_RESULT_LIMIT'])
+        if not product_ids:
+            return [], None
+
+    plan = shop.catalog_page_plan(filters, product_ids)
+    try:
+        plan.send(await g.data.products.catalog(**next(plan)))
+    except StopIteration as done:
+        return done.value
+
+
+async def cached_page(view, sync_view):
+    """catalog_pages.cached() for a coroutine view; stale pages are refreshed by the blocking `sync_view`.
+
+    Lookups read the version stamp file (and the PAGE_CACHE_DIR tier), so they run on a worker thread.
+    """
+    key = shop.catalog_cache_key()
+    if key is None:
+        return await view()
+    response = await asyncio.to_thread(shop.catalog_pages.hit, key, sync_view)
+    if response is None:
+        version = await asyncio.to_thread(shop.catalog_pages.miss)
+        response = app.make_response(await view())
+        response = await asyncio.to_thread(shop.catalog_pages.store, key, response, version)
+    return response
+
+# ====================== NATIVE ROUTES ======================
+
+async def catalog():
+    async def view():
+        filters = shop.catalog_filters(request.args)
+        products, next_cursor = await fetch_catalog_page(filters)
+        return await render('customer/catalog.html', products=products, categories=await get_categories(),
+                            filters=filters, next_cursor=next_cursor,
+                            featured_count=app.config['CATALOG_FEATURED_COUNT'])
+    return await cached_page(view, shop.catalog.__wrapped__)
+
+
+async def catalog_page():
+    async def view():
+        products, next_cursor = await fetch_catalog_page(shop.catalog_filters(request.args))
+        html = await render_in_thread('customer/_product_cards.html', products=products)
+        return jsonify(products=[p._asdict() for p in products], html=html, next_cursor=next_cursor)
+    return await cached_page(view, shop.catalog_page.__wrapped__)
+
+
+@login_required('customer')
+async def cart():
+    cart_items = []
+    total = 0
+    for product, qty in await load_cart_products():
+        subtotal = product['price'] * qty
+        total += subtotal
+        cart_items.append({'product': product, 'quantity': qty, 'subtotal': subtotal})
+    return await render('customer/cart.html', cart_items=cart_items, total=total)
+
+
+@login_required('customer')
+@rate_limited('mutation', account=customer_account, methods=('POST',))
+async def checkout():
+    if not await g.carts.count(await current_cart_id()):
+        flash('Your cart is empty', 'warning')
+        return redirect(url_for('catalog'))
+
+    items = await load_cart_products()
+    if not items:
+        return redirect(url_for('cart'))
+    total = sum(product['price'] * qty for product, qty in items)
+
+    if request.method == 'POST':
+        payment_method = request.form['payment_method']
+        # A cart in the database is emptied in the order's own transaction
+        cart_in_db = isinstance(shop.cart_store, DbCartStore)
+        try:
+            order_id = await place_order(g.data, session['customer_user_id'], items, payment_method,
+                                         cart_clear_statements(await current_cart_id()) if cart_in_db else ())
+        except OutOfStock as e:
+            # Nothing was ordered; send the customer back to adjust the cart
+            flash(shop.out_of_stock_message(e, {product['id']: product for product, _ in items}), 'danger')
+            return redirect(url_for('cart'))
+        if shop.sold_out(await g.data.products.stock_levels([product['id'] for product, _ in items])):
+            await asyncio.to_thread(shop.catalog_pages.invalidate)
+        if not cart_in_db:
+            await g.carts.clear(await current_cart_id())
+
+        if payment_method == 'online':
+            return redirect(url_for('upload_payment', order_id=order_id))
+        flash('Order placed successfully!', 'success')
+        return redirect(url_for('customer_orders'))
+
+    return await render('customer/checkout.html', total=total, is_buy_now=False)
+
+
+@login_required('customer')
+@rate_limited('mutation', account=customer_account, methods=('POST',))
+async def upload_payment(order_id):
+    form = PaymentProofForm()
+    if form.validate_on_submit():
+        orders = g.data.orders
+        order = await orders.proof(order_id, session['customer_user_id'])
+        if not order:
+            flash('Order not found', 'danger')
+            return redirect(url_for('customer_orders'))
+        conn = await g.data.connection()
+        async with conn.cursor() as cur:
+            filename = await shop.proof_store.save_async(cur, form.proof.data, g.setdefault('new_proofs', []))
+            released = await shop.proof_store.release_async(cur, order.proof_image)
+        await orders.set_proof(order_id, filename)
+        await conn.commit()
+        if released:
+            try:
+                await shop.proof_store.purge_async(conn, order.proof_image)
+            except Exception:
+                app.logger.exception('Could not remove released upload %s', order.proof_image)
+        flash('Proof uploaded! Awaiting approval.', 'success')
+        return redirect(url_for('customer_orders'))
+    return await render('customer/payment_upload.html', form=form, order_id=order_id)
+
+
+@login_required('customer')
+async def customer_orders():
+    per_page = get_page_size(request.args, default=app.config['ORDER_HISTORY_PAGE_SIZE'], maximum=50)
+    cursor = decode_cursor(request.args.get('cursor'))
+
+    after = None
+    if cursor and len(cursor) == 2:
+        after = keyset_condition(['o.order_date', 'o.id'], 'DESC', cursor)
+
+    orders, has_more = await g.data.orders.history(session['customer_user_id'], per_page, after=after)
+    next_cursor = encode_cursor([orders[-1].order_date, orders[-1].id]) if has_more else None
+    return await render('customer/orders.html', orders=orders, next_cursor=next_cursor,
+                        is_first_page=cursor is None)
+
+
+@login_required('admin')
+async def admin_dashboard():
+    year, end_year = shop.dashboard_years(request.args)
+    repos = g.data
+
+    # Top stats (maintained incrementally, see rollups.py)
+    counters = await repos.orders.counters()
+
+    year_start, next_year_start = date(year, 1, 1), date(year + 1, 1, 1)
+    users_by_month, sales_by_month = shop.monthly_series(
+        await repos.users.signups_by_month(year_start, next_year_start),
+        await repos.orders.sales_by_month(year_start, next_year_start))
+
+    orders = await repos.run(shop.ADMIN_TABLES['dashboard_orders'].queries(request.args))
+    return await render_in_thread('admin/dashboard.html', total_users=counters['users'],
+                                  total_orders=counters['orders'], total_sales=counters['sales'],
+                                  total_products=counters['products'], users_by_month=users_by_month,
+                                  sales_by_month=sales_by_month, year=year, orders=orders, end_year=end_year)
+
+
+# Endpoint -> coroutine view; the URL rules are the Flask app's
+ASYNC_VIEWS = {view.__name__: view for view in (
+    catalog, catalog_page, cart, checkout, upload_payment, customer_orders, admin_dashboard)}
+
+# ====================== ASGI ======================
+
+def build_environ(scope, body):
+    """A WSGI environ for an ASGI http scope whose request body is the file `body`"""
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1] or 80),
+        'SERVER_PROTOCOL': 'HTTP/%s' % scope['http_version'],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.input_terminated': True,  # the whole body is buffered, chunked or not
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'], environ['REMOTE_PORT'] = scope['client'][0], str(scope['client'][1])
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        value = value.decode('latin-1')
+        environ[name] = environ[name] + ',' + value if name in environ else value
+    return environ
+
+
+class ShopASGI:
+    """Routes native endpoints (ASYNC_VIEWS) to their coroutines and everything else to the Flask app"""
+
+    def __init__(self, app, views):
+        if WSGIMiddleware is None:
+            raise RuntimeError('The ASGI mode needs a2wsgi, aiomysql and aiofiles installed')
+        self.app = app
+        self.views = views
+        self.urls = app.url_map.bind('localhost')
+        self.wsgi = WSGIMiddleware(app, workers=app.config['ASGI_WSGI_WORKERS'])
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        view = self.views.get(self.endpoint(scope)) if scope['type'] == 'http' else None
+        if view is None:
+            await self.wsgi(scope, receive, send)
+            return
+        try:
+            body = await self.read_body(receive)
+        except RequestEntityTooLarge as error:
+            await self.send_response(error.get_response(), scope, send)
+            return
+        if body is None:
+            return  # the client went away
+        try:
+            await self.send_response(await self.dispatch(build_environ(scope, body), view), scope, send)
+        finally:
+            body.close()
+
+    def endpoint(self, scope):
+        path = scope['path']
+        root_path = scope.get('root_path', '')
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path):]
+        try:
+            return self.urls.match(path, scope['method'])[0]
+        except HTTPException:
+            return None  # 404s, 405s and slash redirects are the Flask app's to answer
+
+    async def read_body(self, receive):
+        """The request body as a file, or None if the client disconnected.
+
+        Raises RequestEntityTooLarge as soon as the body outgrows MAX_CONTENT_LENGTH.
+        """
+        limit = self.app.config['MAX_CONTENT_LENGTH']
+        body = tempfile.SpooledTemporaryFile(max_size=self.app.config['ASGI_BODY_SPOOL_SIZE'])
+        size = 0
+        more = True
+        while more:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return None
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if limit is not None and size > limit:
+                body.close()
+                raise RequestEntityTooLarge()
+            body.write(chunk)
+            more = message.get('more_body', False)
+        body.seek(0)
+        return body
+
+    async def dispatch(self, environ, view):
+        """Flask's full_dispatch_request() for a coroutine view, in a request context of its own"""
+        app = self.app
+        ctx = app.request_context(environ)
+        error = None
+        ctx.push()
+        try:
+            g.data = AsyncDataAccess(async_pool)
+            g.carts = async_carts(g.data)
+            try:
+                try:
+                    rv = app.preprocess_request()
+                    if rv is None:
+                        rv = view(**request.view_args)
+                        if inspect.isawaitable(rv):
+                            rv = await rv
+                except Exception as e:
+                    rv = app.handle_user_exception(e)
+                return app.finalize_request(rv)
+            except Exception as e:
+                error = e
+                return app.handle_exception(e)
+            finally:
+                await remove_rolled_back_uploads()
+                await g.data.close()
+        finally:
+            ctx.pop(error)
+
+    async def send_response(self, response, scope, send):
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                        for name, value in response.headers.items()],
+        })
+        try:
+            if scope['method'] != 'HEAD':
+                for chunk in response.iter_encoded():
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        finally:
+            response.close()
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await async_pool.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+application = ShopASGI(app, ASYNC_VIEWS)
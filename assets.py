@@ -0,0 +1,116 @@
+import os
+import re
+import gzip
+import hashlib
+import mimetypes
+import threading
+
+from flask import send_file, abort
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip variants are always available
+    brotli = None
+
+# Files stored by BlobStore are already named by their sha256
+CONTENT_HASH_RE = re.compile(r'^[0-9a-f]{64}$')
+
+# Only these are worth precompressing; images are already compressed
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.txt', '.html', '.map')
+
+# (Accept-Encoding token, file suffix), best first
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+ONE_YEAR = 365 * 24 * 3600
+
+
+class AssetServer:
+    """Serves files from the static folder under content-fingerprinted URLs.
+
+    A fingerprinted URL never changes meaning, so responses are cached for a
+    year as immutable with a strong ETag. Precompressed .br/.gz siblings are
+    served when the client accepts them, and Range requests are answered by
+    werkzeug's send_file straight from disk.
+    """
+
+    def __init__(self, static_folder, hash_length=16):
+        self.static_folder = static_folder
+        self.hash_length = hash_length
+        self._lock = threading.Lock()
+        self._digests = {}  # path -> (mtime_ns, size, sha256)
+
+    def digest(self, filename):
+        """sha256 of a static file, cached until the file changes; None if missing"""
+        stem = os.path.splitext(os.path.basename(filename))[0]
+        if CONTENT_HASH_RE.match(stem):
+            return stem
+
+        path = safe_join(self.static_folder, filename)
+        try:
+            stat = os.stat(path)
+        except (OSError, TypeError):
+            return None
+        cached = self._digests.get(path)
+        if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(64 * 1024), b''):
+                sha.update(chunk)
+        with self._lock:
+            self._digests[path] = (stat.st_mtime_ns, stat.st_size, sha.hexdigest())
+        return sha.hexdigest()
+
+    def fingerprint(self, filename):
+        digest = self.digest(filename)
+        return digest[:self.hash_length] if digest else None
+
+    def send(self, filename, fingerprint, accept_encodings=None):
+        """Response for a fingerprinted asset; `accept_encodings` is the request's parsed
+        Accept-Encoding (request.accept_encodings), so q-values such as br;q=0 are honoured"""
+        path = safe_join(self.static_folder, filename)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+        digest = self.digest(filename)
+        current = fingerprint == digest[:self.hash_length]
+
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        encoding = None
+        if filename.endswith(COMPRESSIBLE) and accept_encodings is not None:
+            for token, suffix in ENCODINGS:
+                if accept_encodings[token] > 0 and os.path.isfile(path + suffix):
+                    path, encoding = path + suffix, token
+                    break
+
+        etag = digest + ('-' + encoding if encoding else '')
+        # An outdated fingerprint still gets the current file, just not cached for long
+        response = send_file(path, mimetype=mimetype, conditional=True, etag=etag,
+                             max_age=ONE_YEAR if current else 60)
+        response.cache_control.public = True
+        if current:
+            response.cache_control.immutable = True
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        if filename.endswith(COMPRESSIBLE):
+            response.vary.add('Accept-Encoding')
+        return response
+
+    def compress_all(self):
+        """Write .gz (and .br when brotli is installed) next to every text asset; returns the count"""
+        written = 0
+        for root, _, files in os.walk(self.static_folder):
+            for name in files:
+                if not name.endswith(COMPRESSIBLE):
+                    continue
+                path = os.path.join(root, name)
+                with open(path, 'rb') as f:
+                    data = f.read()
+                with open(path + '.gz', 'wb') as f:
+                    f.write(gzip.compress(data, 9))
+                if brotli is not None:
+                    with open(path + '.br', 'wb') as f:
+                        f.write(brotli.compress(data))
+                written += 1
+        return written
@@ -0,0 +1,308 @@
+"""Async MySQL access for the ASGI mode (asgi.py), on aiomysql.
+
+Mirrors the blocking stack for the hot routes only: AsyncMySQLPool is the
+ConnectionPool, AsyncDataAccess the per-request mysql.connection plus
+get_repositories(), and the repositories, cart store and place_order() run
+the very statements of repositories.py, carts.py and ordering.py, so both
+modes read and write the same rows the same way.
+"""
+import random
+import asyncio
+
+try:
+    import aiomysql
+except ImportError:  # aiomysql is optional; only the ASGI mode needs it
+    aiomysql = None
+
+import rollups
+from db import PoolTimeout
+from metrics import instrument_async_cursor_class
+from carts import CART_FOR_USER, CART_ITEMS, CART_ADD, CART_RECOUNT, CART_COUNT, cart_set_statements, \
+    cart_clear_statements
+from ordering import RETRYABLE_ERRORS, ORDER_INSERT, ORDER_ITEM_INSERT, order_quantities, stock_update, \
+    stock_check, out_of_stock, OutOfStock
+from repositories import placeholders, catalog_query, order_history_query, OrderHistoryPage, Category, \
+    CatalogProduct, CartProduct, ProductStock, MonthlySignups, MonthlySales, OrderProof, CATEGORIES_ALL, \
+    PRODUCTS_BY_IDS, PRODUCT_STOCK, SIGNUPS_BY_MONTH, SALES_BY_MONTH, ORDER_PROOF, ORDER_SET_PROOF
+
+if aiomysql is not None:
+    # Timed into the request's stats like the blocking cursors
+    DictCursor = instrument_async_cursor_class(aiomysql.DictCursor)
+    TupleCursor = instrument_async_cursor_class(aiomysql.Cursor)
+
+
+class AsyncMySQLPool:
+    """aiomysql pool built from the same MYSQL_* settings as MySQLPool.
+
+    Created on first use, inside the event loop. acquire() gives up with
+    PoolTimeout after MYSQL_POOL_WAIT_TIMEOUT seconds, and release() rolls
+    back whatever the request left open.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.pool = None
+        self._lock = asyncio.Lock()
+        self._stats = {'acquired': 0, 'timeouts': 0}
+
+    async def _create(self):
+        config = self.config
+        return await aiomysql.create_pool(
+            host=config['MYSQL_HOST'],
+            user=config['MYSQL_USER'],
+            password=config['MYSQL_PASSWORD'],
+            db=config['MYSQL_DB'],
+            port=config.get('MYSQL_PORT', 3306),
+            charset=config.get('MYSQL_CHARSET', 'utf8mb4'),
+            cursorclass=DictCursor,
+            autocommit=False,
+            minsize=config['MYSQL_POOL_MIN_SIZE'],
+            maxsize=config['ASYNC_MYSQL_POOL_MAX_SIZE'],
+            pool_recycle=config['MYSQL_POOL_MAX_LIFETIME'],
+        )
+
+    async def acquire(self):
+        if self.pool is None:
+            async with self._lock:
+                if self.pool is None:
+                    self.pool = await self._create()
+        try:
+            conn = await asyncio.wait_for(self.pool.acquire(), self.config['MYSQL_POOL_WAIT_TIMEOUT'])
+        except asyncio.TimeoutError:
+            self._stats['timeouts'] += 1
+            raise PoolTimeout('No async MySQL connection became available within %ss (max_size=%d)'
+                              % (self.config['MYSQL_POOL_WAIT_TIMEOUT'], self.pool.maxsize), self) from None
+        self._stats['acquired'] += 1
+        return conn
+
+    async def release(self, conn):
+        # Never hand a half-finished transaction to the next request
+        try:
+            await conn.rollback()
+        except aiomysql.Error:
+            conn.close()
+        await self.pool.release(conn)
+
+    async def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            await self.pool.wait_closed()
+            self.pool = None
+
+    def stats(self):
+        stats = dict(self._stats, size=0, idle=0, max_size=self.config['ASYNC_MYSQL_POOL_MAX_SIZE'])
+        if self.pool is not None:
+            stats.update(size=self.pool.size, idle=self.pool.freesize)
+        stats['in_use'] = stats['size'] - stats['idle']
+        return stats
+
+
+class AsyncRepository:
+    def __init__(self, data):
+        self.data = data
+
+    async def _one(self, row, sql, params=None):
+        rows = await self.data.fetch(TupleCursor, sql, params)
+        return row._make(rows[0]) if rows else None
+
+    async def _all(self, row, sql, params=None):
+        return [row._make(values) for values in await self.data.fetch(TupleCursor, sql, params)]
+
+    async def _write(self, sql, params=None):
+        conn = await self.data.connection()
+        async with conn.cursor(TupleCursor) as cur:
+            await cur.execute(sql, params)
+            return cur.rowcount, cur.lastrowid
+
+
+class AsyncCategoryRepository(AsyncRepository):
+    async def all(self):
+        return await self._all(Category, CATEGORIES_ALL)
+
+
+class AsyncUserRepository(AsyncRepository):
+    async def signups_by_month(self, start, end):
+        return await self._all(MonthlySignups, SIGNUPS_BY_MONTH, (start, end))
+
+
+class AsyncProductRepository(AsyncRepository):
+    async def by_ids(self, product_ids):
+        if not product_ids:
+            return []
+        return await self._all(CartProduct, PRODUCTS_BY_IDS % placeholders(product_ids), list(product_ids))
+
+    async def catalog(self, product_ids=None, category_id=None, order=None, after=None, limit=None):
+        return await self._all(CatalogProduct, *catalog_query(product_ids, category_id, order, after, limit))
+
+    async def stock_levels(self, product_ids):
+        if not product_ids:
+            return {}
+        product_ids = list(product_ids)
+        rows = await self._all(ProductStock, PRODUCT_STOCK % placeholders(product_ids), product_ids)
+        return {row.id: row.stock for row in rows}
+
+
+class AsyncOrderRepository(AsyncRepository):
+    async def history(self, user_id, per_page, after=None):
+        """OrderRepository.history(): (orders, has_more)"""
+        page = OrderHistoryPage(await self.data.fetch(TupleCursor, *order_history_query(user_id, per_page, after)),
+                                per_page)
+        if page.order_ids:
+            page.add_items(await self.data.fetch(TupleCursor, *page.items_query()))
+        return page.result()
+
+    async def proof(self, order_id, user_id):
+        return await self._one(OrderProof, ORDER_PROOF, (order_id, user_id))
+
+    async def set_proof(self, order_id, filename):
+        return (await self._write(ORDER_SET_PROOF, (filename, order_id)))[0]
+
+    async def sales_by_month(self, start, end):
+        return await self._all(MonthlySales, SALES_BY_MONTH, (start, end))
+
+    async def counters(self):
+        return rollups.counters_from_rows(await self.data.fetch(DictCursor, rollups.COUNTERS_SELECT))
+
+
+class AsyncDataAccess:
+    """One request's async data access: checks a connection out of the pool on first use
+    and back in on close(), like mysql.connection does for an app context"""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self._connection = None
+        self.categories = AsyncCategoryRepository(self)
+        self.users = AsyncUserRepository(self)
+        self.products = AsyncProductRepository(self)
+        self.orders = AsyncOrderRepository(self)
+
+    async def connection(self):
+        if self._connection is None:
+            self._connection = await self.pool.acquire()
+        return self._connection
+
+    async def fetch(self, cursorclass, sql, params=None):
+        """Run one statement and return all its rows"""
+        conn = await self.connection()
+        async with conn.cursor(cursorclass) as cur:
+            await cur.execute(sql, params)
+            return await cur.fetchall()
+
+    async def commit(self):
+        """Commit the request's transaction, if it has checked out a connection"""
+        if self._connection is not None:
+            await self._connection.commit()
+
+    async def run(self, steps):
+        """Drive a generator of (sql, params) statements that is sent each one's rows as dicts,
+        such as AdminTable.queries(); returns its result"""
+        try:
+            sql, params = next(steps)
+            while True:
+                sql, params = steps.send(await self.fetch(DictCursor, sql, params))
+        except StopIteration as done:
+            return done.value
+
+    async def close(self):
+        conn, self._connection = self._connection, None
+        if conn is not None:
+            await self.pool.release(conn)
+
+
+class AsyncDbCartStore:
+    """DbCartStore's operations as coroutines. Writes are committed by the route
+    (AsyncDataAccess.commit()), except cart_for_user() on a connection of its own"""
+
+    def __init__(self, data):
+        self.data = data
+
+    async def _run(self, *statements):
+        conn = await self.data.connection()
+        async with conn.cursor() as cur:
+            for sql, params in statements:
+                await cur.execute(sql, params)
+
+    async def cart_for_user(self, user_id):
+        conn = await self.data.pool.acquire()
+        try:
+            async with conn.cursor() as cur:
+                await cur.execute(CART_FOR_USER, (user_id,))
+                cart_id = cur.lastrowid
+            await conn.commit()
+        finally:
+            await self.data.pool.release(conn)
+        return cart_id
+
+    async def items(self, cart_id):
+        return {row['product_id']: row['quantity'] for row in await self.data.fetch(DictCursor, CART_ITEMS, (cart_id,))}
+
+    async def add(self, cart_id, product_id, quantity=1):
+        await self._run((CART_ADD, (cart_id, product_id, quantity)), (CART_RECOUNT, (cart_id, cart_id)))
+
+    async def set(self, cart_id, product_id, quantity):
+        await self._run(*cart_set_statements(cart_id, product_id, quantity))
+
+    async def clear(self, cart_id):
+        await self._run(*cart_clear_statements(cart_id))
+
+    async def count(self, cart_id):
+        rows = await self.data.fetch(DictCursor, CART_COUNT, (cart_id,))
+        return rows[0]['item_count'] if rows else 0
+
+
+class InlineCartStore:
+    """Coroutine face for a cart store that never blocks (MemoryCartStore)"""
+
+    def __init__(self, store):
+        self.store = store
+
+    async def cart_for_user(self, user_id):
+        return self.store.cart_for_user(user_id)
+
+    async def items(self, cart_id):
+        return self.store.items(cart_id)
+
+    async def add(self, cart_id, product_id, quantity=1):
+        self.store.add(cart_id, product_id, quantity)
+
+    async def set(self, cart_id, product_id, quantity):
+        self.store.set(cart_id, product_id, quantity)
+
+    async def clear(self, cart_id):
+        self.store.clear(cart_id)
+
+    async def count(self, cart_id):
+        return self.store.count(cart_id)
+
+
+async def place_order(data, user_id, items, payment_method, statements=(), retries=3, backoff=0.05):
+    """ordering.place_order() on the request's async connection; same guarantees and retries"""
+    conn = await data.connection()
+    for attempt in range(retries + 1):
+        try:
+            return await _place_order(conn, user_id, items, payment_method, statements)
+        except OutOfStock:
+            await conn.rollback()
+            raise
+        except aiomysql.OperationalError as error:
+            await conn.rollback()
+            if error.args[0] not in RETRYABLE_ERRORS or attempt == retries:
+                raise
+            await asyncio.sleep(backoff * (2 ** attempt) * (1 + random.random()))
+
+
+async def _place_order(conn, user_id, items, payment_method, statements):
+    quantities, total = order_quantities(items)
+    async with conn.cursor() as cur:
+        await cur.execute(*stock_update(quantities))
+        if cur.rowcount != len(quantities):
+            await cur.execute(*stock_check(quantities))
+            raise out_of_stock(quantities, await cur.fetchall())
+
+        await cur.execute(ORDER_INSERT, (user_id, total, payment_method))
+        order_id = cur.lastrowid
+        await cur.executemany(ORDER_ITEM_INSERT, [(order_id, pid, qty) for pid, qty in sorted(quantities.items())])
+        for sql, params in rollups.order_placed_statements(order_id) + list(statements):
+            await cur.execute(sql, params)
+        await conn.commit()
+        return order_id
@@ -0,0 +1,9 @@
+"""Load testing and benchmarks.
+
+    python -m benchmark seed --products 100000 --users 50000 --orders 1000000
+    python -m benchmark run --save baseline
+    python -m benchmark run --compare baseline
+
+See benchmark/__main__.py for every option. Seeding writes to the database
+configured in config.py, so point it at a scratch schema.
+"""
@@ -0,0 +1,82 @@
+import sys
+
+import click
+
+from benchmark import report
+from benchmark.clients import TestClient, HttpClient
+from benchmark.driver import run_scenario
+from benchmark.scenarios import SCENARIOS, load_context
+from benchmark.seed import seed as seed_data
+
+
+@click.group()
+def cli():
+    """Seed synthetic data and measure the hot routes."""
+
+
+@cli.command()
+@click.option('--categories', default=50, show_default=True)
+@click.option('--products', default=100000, show_default=True)
+@click.option('--users', default=50000, show_default=True)
+@click.option('--orders', default=1000000, show_default=True)
+@click.option('--days', default=730, show_default=True, help='Spread order dates over this many past days.')
+@click.option('--batch-size', default=5000, show_default=True)
+@click.option('--seed', 'random_seed', default=42, show_default=True, help='Same seed, same data.')
+def seed(categories, products, users, orders, days, batch_size, random_seed):
+    """Insert synthetic categories, products, users and orders."""
+    from app import app, mysql
+    with app.app_context():
+        seed_data(mysql.connection, categories=categories, products=products, users=users, orders=orders,
+                  days=days, batch_size=batch_size, random_seed=random_seed, progress=click.echo)
+
+
+@cli.command()
+@click.option('--requests', 'request_count', default=200, show_default=True, help='Timed requests per scenario.')
+@click.option('--concurrency', default=4, show_default=True)
+@click.option('--warmup', default=5, show_default=True, help='Untimed requests per client first.')
+@click.option('--scenario', 'only', multiple=True, help='Only scenarios whose name contains this (repeatable).')
+@click.option('--base-url', default=None,
+              help='Benchmark a running server over HTTP (start it with SERVER_TIMING_HEADER = True '
+                   'to get query counts) instead of the in-process test client.')
+@click.option('--save', default=None, help='Save the results as benchmark/baselines/NAME.json.')
+@click.option('--compare', default=None, help='Compare against a saved baseline; exit 1 on regressions.')
+@click.option('--tolerance', default=0.2, show_default=True, help='Allowed p95 slowdown before it counts.')
+def run(request_count, concurrency, warmup, only, base_url, save, compare, tolerance):
+    """Run the scenarios and print latency percentiles."""
+    import app as shop
+    app = shop.app
+    if base_url:
+        make_client = lambda: HttpClient(base_url)
+    else:
+        shop.request_metrics.server_timing = True
+        app.config['AUTO_DELIVERY_IN_PROCESS'] = False  # keep the job's thread out of the timings
+        shop.rate_limiter.enabled = False  # every test client logs in from the same address
+        make_client = lambda: TestClient(app)
+    with app.app_context():
+        ctx = load_context(shop.mysql.connection)
+
+    scenarios = [s for s in SCENARIOS if not only or any(o.lower() in s.name for o in only)]
+    summaries = {}
+    for scenario in scenarios:
+        click.echo('Running %s...' % scenario.name, err=True)
+        results, wall = run_scenario(scenario, make_client, ctx, (shop.ADMIN_EMAIL, shop.ADMIN_PASSWORD),
+                                     requests=request_count, concurrency=concurrency, warmup=warmup)
+        summaries[scenario.name] = report.summarize(results, wall)
+
+    baseline = report.load_baseline(compare) if compare else None
+    click.echo(report.format_table(summaries, baseline and baseline['scenarios']))
+    if save:
+        settings = {'requests': request_count, 'concurrency': concurrency, 'warmup': warmup,
+                    'target': base_url or 'test_client'}
+        click.echo('Saved %s' % report.save_baseline(save, summaries, settings))
+    if baseline:
+        found = report.regressions(summaries, baseline, tolerance)
+        for name, message in found:
+            click.echo('REGRESSION %s: %s' % (name, message))
+        if found:
+            sys.exit(1)
+        click.echo('No regressions against %s' % compare)
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,90 @@
+"""The two ways the driver talks to the app: in-process test client or real HTTP"""
+import re
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.cookiejar import CookieJar
+
+CSRF_RE = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"')
+QUERIES_RE = re.compile(r'desc="(\d+) queries"')
+
+
+def queries_from(server_timing):
+    """Query count from the Server-Timing header added with SERVER_TIMING_HEADER; None if absent"""
+    match = QUERIES_RE.search(server_timing or '')
+    return int(match.group(1)) if match else None
+
+
+class Result:
+    __slots__ = ('status', 'seconds', 'queries', 'size')
+
+    def __init__(self, status, seconds, queries, size):
+        self.status = status
+        self.seconds = seconds
+        self.queries = queries
+        self.size = size
+
+    @property
+    def ok(self):
+        return self.status < 400
+
+
+class BaseClient:
+    def login(self, role, email, password):
+        path = '/admin/login' if role == 'admin' else '/customer/login'
+        page = self.fetch('GET', path)
+        match = CSRF_RE.search(page)
+        data = {'email': email, 'password': password, 'csrf_token': match.group(1) if match else ''}
+        result = self.request('POST', path, data)
+        if result.status != 302:
+            raise RuntimeError('Could not log in as %s %s (HTTP %d)' % (role, email, result.status))
+
+
+class TestClient(BaseClient):
+    """Requests through app.test_client(): no network, server timings only"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def fetch(self, method, path, data=None):
+        return self.client.open(path, method=method, data=data).get_data(as_text=True)
+
+    def request(self, method, path, data=None):
+        start = time.perf_counter()
+        response = self.client.open(path, method=method, data=data)
+        body = response.get_data()
+        seconds = time.perf_counter() - start
+        return Result(response.status_code, seconds, queries_from(response.headers.get('Server-Timing')), len(body))
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None  # a redirect is a result to record, not something to follow
+
+
+class HttpClient(BaseClient):
+    """Requests over HTTP to a running server, keeping cookies like a browser"""
+
+    def __init__(self, base_url, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()), _NoRedirect)
+
+    def _open(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        req = urllib.request.Request(self.base_url + path, data=body, method=method)
+        try:
+            response = self.opener.open(req, timeout=self.timeout)
+        except urllib.error.HTTPError as error:
+            response = error  # 3xx/4xx/5xx still carry a status and body
+        return response, response.read()
+
+    def fetch(self, method, path, data=None):
+        return self._open(method, path, data)[1].decode('utf-8', 'replace')
+
+    def request(self, method, path, data=None):
+        start = time.perf_counter()
+        response, body = self._open(method, path, data)
+        seconds = time.perf_counter() - start
+        return Result(response.status, seconds, queries_from(response.headers.get('Server-Timing')), len(body))
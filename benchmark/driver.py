@@ -0,0 +1,71 @@
+"""Runs scenarios from several concurrent clients and collects per-request results"""
+import time
+import random
+import threading
+
+from benchmark.seed import BENCH_PASSWORD
+
+
+def run_scenario(scenario, make_client, ctx, admin_credentials, requests=200, concurrency=4,
+                 warmup=5, random_seed=1):
+    """Issue `requests` timed requests split over `concurrency` logged-in clients.
+
+    Returns (results, wall seconds). Each client first sends `warmup`
+    untimed requests so connection setup and cold caches are not measured.
+    """
+    clients = []
+    for n in range(concurrency):
+        client = make_client()
+        if scenario.role == 'customer':
+            client.login('customer', ctx['customers'][n % len(ctx['customers'])], BENCH_PASSWORD)
+        elif scenario.role == 'admin':
+            client.login('admin', *admin_credentials)
+        clients.append(client)
+
+    results = []
+    lock = threading.Lock()
+    errors = []
+    # Everyone finishes warming up before the clock starts
+    ready = threading.Barrier(concurrency + 1)
+
+    def send(client, rng):
+        if scenario.before:
+            scenario.before(client, ctx, rng)
+        return client.request(scenario.method, scenario.path(ctx, rng), scenario.data)
+
+    def work(client, count, rng):
+        try:
+            for _ in range(warmup):
+                send(client, rng)
+        except Exception as error:  # reported with the scenario instead of killing the run
+            errors.append(error)
+            ready.abort()
+            return
+        try:
+            ready.wait()
+        except threading.BrokenBarrierError:
+            return  # another client failed
+        try:
+            for _ in range(count):
+                result = send(client, rng)
+                with lock:
+                    results.append(result)
+        except Exception as error:
+            errors.append(error)
+
+    shares = [requests // concurrency + (1 if n < requests % concurrency else 0) for n in range(concurrency)]
+    threads = [threading.Thread(target=work, args=(client, share, random.Random(random_seed + n)))
+               for n, (client, share) in enumerate(zip(clients, shares))]
+    for thread in threads:
+        thread.start()
+    try:
+        ready.wait()
+    except threading.BrokenBarrierError:
+        pass  # a client failed during warmup; its error is raised below
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+    if errors:
+        raise errors[0]
+    return results, wall
@@ -0,0 +1,90 @@
+"""Latency percentiles, text tables and saved baselines"""
+import os
+import json
+import platform
+from datetime import datetime
+
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), 'baselines')
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(results, wall):
+    latencies = sorted(r.seconds * 1000 for r in results)
+    queries = [r.queries for r in results if r.queries is not None]
+    return {
+        'requests': len(results),
+        'errors': sum(1 for r in results if not r.ok),
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'mean_ms': sum(latencies) / len(latencies) if latencies else None,
+        'throughput_rps': len(results) / wall if wall else None,
+        'queries_per_request': sum(queries) / len(queries) if queries else None,
+        'bytes_per_request': sum(r.size for r in results) / len(results) if results else None,
+    }
+
+
+def _fmt(value, spec='%.1f'):
+    return '-' if value is None else spec % value
+
+
+def format_table(summaries, baseline=None):
+    header = '%-28s %7s %6s %9s %9s %9s %9s %8s' % ('scenario', 'reqs', 'errors', 'p50 ms', 'p95 ms',
+                                                   'p99 ms', 'req/s', 'queries')
+    lines = [header, '-' * len(header)]
+    for name, s in summaries.items():
+        line = '%-28s %7d %6d %9s %9s %9s %9s %8s' % (
+            name[:28], s['requests'], s['errors'], _fmt(s['p50_ms']), _fmt(s['p95_ms']), _fmt(s['p99_ms']),
+            _fmt(s['throughput_rps']), _fmt(s['queries_per_request']))
+        base = (baseline or {}).get(name)
+        if base and base.get('p95_ms') and s['p95_ms'] is not None:
+            line += '  p95 %+.0f%%' % ((s['p95_ms'] / base['p95_ms'] - 1) * 100)
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def baseline_path(name):
+    return name if name.endswith('.json') else os.path.join(BASELINE_DIR, name + '.json')
+
+
+def save_baseline(name, summaries, settings):
+    path = baseline_path(name)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'settings': settings,
+            'scenarios': summaries,
+        }, f, indent=2, sort_keys=True)
+    return path
+
+
+def load_baseline(name):
+    with open(baseline_path(name)) as f:
+        return json.load(f)
+
+
+def regressions(summaries, baseline, tolerance=0.2):
+    """[(scenario, message)] for scenarios slower, chattier or less reliable than the baseline"""
+    found = []
+    for name, s in summaries.items():
+        base = baseline['scenarios'].get(name)
+        if not base:
+            continue
+        if base['p95_ms'] and s['p95_ms'] and s['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            found.append((name, 'p95 %.1fms vs %.1fms baseline' % (s['p95_ms'], base['p95_ms'])))
+        if base['queries_per_request'] is not None and s['queries_per_request'] is not None \
+                and s['queries_per_request'] > base['queries_per_request'] + 0.5:
+            found.append((name, '%.1f queries/request vs %.1f baseline'
+                          % (s['queries_per_request'], base['queries_per_request'])))
+        if s['errors'] > base['errors']:
+            found.append((name, '%d errors vs %d baseline' % (s['errors'], base['errors'])))
+    return found
@@ -0,0 +1,86 @@
+"""The request mixes the benchmark drives, one scenario per hot route and variant"""
+import urllib.parse
+
+from benchmark.seed import WORDS, NOUNS
+
+
+class Scenario:
+    """One route to measure.
+
+    `path(ctx, rng)` builds each request's path; `before(client, ctx, rng)`
+    runs untimed before every request (e.g. to refill the cart before a
+    checkout). `role` is None, 'customer' or 'admin'.
+    """
+
+    def __init__(self, name, path, role='customer', method='GET', data=None, before=None):
+        self.name = name
+        self.path = path
+        self.role = role
+        self.method = method
+        self.data = data
+        self.before = before
+
+
+def fixed(path):
+    return lambda ctx, rng: path
+
+
+def add_random_product(client, ctx, rng):
+    client.request('GET', '/add_to_cart/%d' % rng.choice(ctx['product_ids']))
+
+
+def ensure_cart(client, ctx, rng):
+    # Keep a realistic five-item cart without letting it grow without bound
+    if not getattr(client, 'cart_filled', False):
+        for product_id in rng.sample(ctx['product_ids'], min(5, len(ctx['product_ids']))):
+            client.request('GET', '/add_to_cart/%d' % product_id)
+        client.cart_filled = True
+
+
+def search_path(ctx, rng):
+    return '/catalog?' + urllib.parse.urlencode({'search': rng.choice(WORDS + NOUNS)})
+
+
+def category_path(ctx, rng):
+    return '/catalog?category=%d' % rng.choice(ctx['category_ids'])
+
+
+SCENARIOS = [
+    # Logged-in customers bypass the full-page cache, so these measure the real work
+    Scenario('catalog', fixed('/catalog')),
+    Scenario('catalog search', search_path),
+    Scenario('catalog category', category_path),
+    Scenario('catalog price low-high', fixed('/catalog?price=low_high')),
+    Scenario('catalog price high-low', fixed('/catalog?price=high_low')),
+    Scenario('catalog stock low-high', fixed('/catalog?stock=low_high')),
+    Scenario('catalog stock high-low', fixed('/catalog?stock=high_low')),
+    Scenario('catalog anonymous', fixed('/catalog'), role=None),
+    Scenario('cart', fixed('/cart'), before=ensure_cart),
+    Scenario('checkout', fixed('/checkout'), method='POST', data={'payment_method': 'cod'},
+             before=add_random_product),
+    Scenario('customer orders', fixed('/customer/orders')),
+    Scenario('admin dashboard', fixed('/admin/dashboard'), role='admin'),
+    Scenario('sales report daily', fixed('/admin/sales_report?period=daily'), role='admin'),
+    Scenario('sales report weekly', fixed('/admin/sales_report?period=weekly'), role='admin'),
+    Scenario('sales report monthly', fixed('/admin/sales_report?period=monthly'), role='admin'),
+    Scenario('manage orders', fixed('/admin/orders'), role='admin'),
+    Scenario('manage orders pending', fixed('/admin/orders?status=Pending'), role='admin'),
+    Scenario('manage orders page 200', fixed('/admin/orders?page=200'), role='admin'),
+]
+
+
+def load_context(connection, sample=500):
+    """Ids the scenarios pick from: bench customers, in-stock products and categories"""
+    cur = connection.cursor()
+    cur.execute("SELECT id, email FROM users WHERE email LIKE %s AND status = 'active' ORDER BY id LIMIT %s",
+                ('bench-user-%', sample))
+    customers = [row['email'] for row in cur.fetchall()]
+    cur.execute("SELECT id FROM products WHERE status = 'approved' AND stock > 1000 ORDER BY id LIMIT %s",
+                (sample,))
+    product_ids = [row['id'] for row in cur.fetchall()]
+    cur.execute("SELECT id FROM categories ORDER BY id LIMIT %s", (sample,))
+    category_ids = [row['id'] for row in cur.fetchall()]
+    cur.close()
+    if not (customers and product_ids and category_ids):
+        raise RuntimeError('No benchmark data found; run `python -m benchmark seed` first')
+    return {'customers': customers, 'product_ids': product_ids, 'category_ids': category_ids}
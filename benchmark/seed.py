@@ -0,0 +1,127 @@
+"""Synthetic catalog, customers and order history for benchmarks"""
+import time
+import random
+from datetime import datetime, timedelta
+
+import rollups
+
+BENCH_PASSWORD = 'bench-password'
+WORDS = ('red blue green black white small large classic premium organic wireless smart portable '
+         'cotton leather steel wooden vintage modern compact deluxe mini ultra eco travel kids').split()
+NOUNS = ('shirt mug lamp chair bag shoe watch phone case bottle speaker cable desk pillow jacket '
+         'notebook pen toy blanket backpack charger headset camera kettle mirror').split()
+ORDER_STATUSES = [('Delivered', 60), ('Shipped', 10), ('Pending', 15), ('Cancelled', 8), ('Declined', 7)]
+
+
+def bench_email(n):
+    return 'bench-user-%d@example.com' % n
+
+
+def _insert_batches(cur, connection, sql, rows, batch_size, progress=None, label=''):
+    batch = []
+    done = 0
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            cur.executemany(sql, batch)
+            connection.commit()
+            done += len(batch)
+            batch = []
+            if progress:
+                progress('%s: %d' % (label, done))
+    if batch:
+        cur.executemany(sql, batch)
+        connection.commit()
+        done += len(batch)
+    if progress:
+        progress('%s: %d done' % (label, done))
+    return done
+
+
+def _next_id(cur, table):
+    cur.execute("SELECT COALESCE(MAX(id), 0) AS last_id FROM %s" % table)
+    return cur.fetchone()['last_id'] + 1
+
+
+def seed(connection, categories=50, products=100000, users=50000, orders=1000000,
+         max_items=4, days=730, batch_size=5000, random_seed=42, progress=None):
+    """Append synthetic rows to every table, then rebuild the dashboard rollups.
+
+    The same random_seed produces the same data. Customers log in as
+    bench_email(n) / BENCH_PASSWORD; product stock is large enough that
+    checkout benchmarks do not run dry.
+    """
+    rng = random.Random(random_seed)
+    now = datetime.now().replace(microsecond=0)
+    cur = connection.cursor()
+    started = time.time()
+
+    first_category = _next_id(cur, 'categories')
+    _insert_batches(cur, connection, "INSERT INTO categories (name) VALUES (%s)",
+                    (('Bench category %d' % n,) for n in range(categories)), batch_size, progress, 'categories')
+    category_ids = range(first_category, first_category + categories)
+
+    first_product = _next_id(cur, 'products')
+    prices = [round(rng.uniform(1, 5000), 2) for _ in range(products)]
+
+    def product_rows():
+        for n, price in enumerate(prices):
+            name = '%s %s %s %d' % (rng.choice(WORDS).title(), rng.choice(WORDS), rng.choice(NOUNS), n)
+            description = ' '.join(rng.choice(WORDS + NOUNS) for _ in range(rng.randint(8, 40)))
+            status = 'approved' if rng.random() < 0.95 else rng.choice(['pending', 'declined'])
+            yield (name, description, price, rng.randint(0, 100000), rng.choice(category_ids), status)
+
+    _insert_batches(cur, connection, """
+        INSERT INTO products (name, description, price, stock, category_id, status)
+        VALUES (%s, %s, %s, %s, %s, %s)
+    """, product_rows(), batch_size, progress, 'products')
+
+    first_user = _next_id(cur, 'users')
+
+    def user_rows():
+        for n in range(users):
+            joined = now - timedelta(seconds=rng.randint(0, days * 86400))
+            yield ('Bench User %d' % n, bench_email(first_user + n), BENCH_PASSWORD, 'active', joined)
+
+    _insert_batches(cur, connection, """
+        INSERT INTO users (fullname, email, password, status, created_at) VALUES (%s, %s, %s, %s, %s)
+    """, user_rows(), batch_size, progress, 'users')
+
+    # Orders get explicit ids so their items can be generated in the same pass
+    first_order = _next_id(cur, 'orders')
+    statuses = [status for status, weight in ORDER_STATUSES for _ in range(weight)]
+    items = []
+
+    def order_rows():
+        for n in range(orders):
+            order_id = first_order + n
+            total = 0
+            for _ in range(rng.randint(1, max_items)):
+                product = rng.randrange(products)
+                quantity = rng.randint(1, 3)
+                total += prices[product] * quantity
+                items.append((order_id, first_product + product, quantity))
+            placed = now - timedelta(seconds=rng.randint(0, days * 86400))
+            yield (order_id, first_user + rng.randrange(users), round(total, 2),
+                   rng.choice(['cod', 'online']), rng.choice(statuses), placed)
+            if len(items) >= batch_size:
+                flush_items()
+
+    def flush_items():
+        cur.executemany("INSERT INTO order_items (order_id, product_id, quantity) VALUES (%s, %s, %s)", items)
+        del items[:]
+
+    _insert_batches(cur, connection, """
+        INSERT INTO orders (id, user_id, total_amount, payment_method, status, order_date)
+        VALUES (%s, %s, %s, %s, %s, %s)
+    """, order_rows(), batch_size, progress, 'orders')
+    if items:
+        flush_items()
+    connection.commit()
+
+    rollups.rebuild(cur)
+    connection.commit()
+    cur.close()
+    if progress:
+        progress('Seeded in %.1fs' % (time.time() - started))
+    return {'first_user': first_user, 'first_product': first_product, 'category_ids': list(category_ids)}
@@ -0,0 +1,76 @@
+import os
+import time
+import asyncio
+import threading
+
+
+class VersionedCache:
+    """Process-wide cache for one small, rarely changing value (e.g. the category list).
+
+    The value is reloaded after `ttl` seconds. invalidate() drops it right away
+    in this process and bumps a version stamp file, so every other worker
+    process sees a new version on its next read and reloads too.
+    """
+
+    def __init__(self, name, ttl=300, stamp_dir='instance'):
+        self.name = name
+        self.ttl = ttl
+        self.stamp_path = os.path.join(stamp_dir, '%s.version' % name)
+        self._lock = threading.Lock()
+        self._value = None
+        self._loaded_at = None
+        self._version = None
+        os.makedirs(stamp_dir, exist_ok=True)
+
+    @property
+    def version(self):
+        """Current version stamp shared by all processes; changes on every invalidate()"""
+        try:
+            with open(self.stamp_path) as f:
+                return int(f.read() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def _is_fresh(self, version):
+        # Called with the lock held
+        return (self._loaded_at is not None
+                and time.time() - self._loaded_at < self.ttl
+                and self._version == version)
+
+    def get(self, loader):
+        """Return the cached value, calling loader() when missing, expired or outdated"""
+        version = self.version
+        with self._lock:
+            if not self._is_fresh(version):
+                self._value = loader()
+                self._loaded_at = time.time()
+                self._version = version
+            return self._value
+
+    async def get_async(self, loader):
+        """get() for coroutines: awaits loader() when needed, outside the lock.
+
+        Two requests may both reload an expired value; the last one to finish wins.
+        """
+        # The version stamp is a file read; keep it off the event loop
+        version = await asyncio.get_running_loop().run_in_executor(None, lambda: self.version)
+        with self._lock:
+            if self._is_fresh(version):
+                return self._value
+        value = await loader()
+        with self._lock:
+            self._value = value
+            self._loaded_at = time.time()
+            self._version = version
+        return value
+
+    def invalidate(self):
+        # A fresh token rather than version + 1: two processes invalidating at
+        # once would both write the same incremented number and one bump would
+        # be lost. Versions are only ever compared for equality.
+        with self._lock:
+            self._loaded_at = None
+            tmp_path = '%s.%d.tmp' % (self.stamp_path, os.getpid())
+            with open(tmp_path, 'w') as f:
+                f.write(str(time.time_ns()))
+            os.replace(tmp_path, self.stamp_path)
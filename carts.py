@@ -0,0 +1,170 @@
+import uuid
+import threading
+from collections import OrderedDict
+
+
+class UnknownCart(KeyError):
+    """Raised for a cart id the store does not hold (evicted, or issued before a restart)"""
+
+
+class MemoryCartStore:
+    """Carts kept in process memory, evicting the least recently used beyond max_carts.
+
+    Meant for tests and single-process development; carts vanish on restart.
+    Cart ids are random, so an id remembered in a session from an earlier
+    process (or another worker) never names somebody else's cart: it is
+    unknown here and every operation on it raises UnknownCart.
+    """
+
+    def __init__(self, max_carts=10000):
+        self.max_carts = max_carts
+        self._lock = threading.Lock()
+        self._carts = OrderedDict()  # cart_id -> {product_id: quantity}
+        self._owners = {}            # user_id -> cart_id
+
+    def cart_for_user(self, user_id):
+        with self._lock:
+            cart_id = self._owners.get(user_id)
+            if cart_id is None or cart_id not in self._carts:
+                cart_id = uuid.uuid4().hex
+                self._owners[user_id] = cart_id
+                self._carts[cart_id] = {}
+                while len(self._carts) > self.max_carts:
+                    evicted, _ = self._carts.popitem(last=False)
+                    self._owners = {u: c for u, c in self._owners.items() if c != evicted}
+            return cart_id
+
+    def _cart(self, cart_id):
+        # Called with the lock held
+        cart = self._carts.get(cart_id)
+        if cart is None:
+            raise UnknownCart(cart_id)
+        self._carts.move_to_end(cart_id)
+        return cart
+
+    def items(self, cart_id):
+        with self._lock:
+            return dict(self._cart(cart_id))
+
+    def add(self, cart_id, product_id, quantity=1):
+        with self._lock:
+            cart = self._cart(cart_id)
+            cart[product_id] = cart.get(product_id, 0) + quantity
+
+    def set(self, cart_id, product_id, quantity):
+        with self._lock:
+            cart = self._cart(cart_id)
+            if quantity <= 0:
+                cart.pop(product_id, None)
+            else:
+                cart[product_id] = quantity
+
+    def clear(self, cart_id):
+        with self._lock:
+            self._cart(cart_id).clear()
+
+    def count(self, cart_id):
+        with self._lock:
+            return len(self._cart(cart_id))
+
+
+# DbCartStore statements, shared with the ASGI mode's async store (asyncdb.py)
+CART_FOR_USER = """
+    INSERT INTO carts (user_id) VALUES (%s)
+    ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id)
+"""
+CART_ITEMS = "SELECT product_id, quantity FROM cart_items WHERE cart_id = %s ORDER BY added_at, product_id"
+CART_ADD = """
+    INSERT INTO cart_items (cart_id, product_id, quantity) VALUES (%s, %s, %s)
+    ON DUPLICATE KEY UPDATE quantity = quantity + VALUES(quantity)
+"""
+CART_SET = """
+    INSERT INTO cart_items (cart_id, product_id, quantity) VALUES (%s, %s, %s)
+    ON DUPLICATE KEY UPDATE quantity = VALUES(quantity)
+"""
+CART_REMOVE = "DELETE FROM cart_items WHERE cart_id = %s AND product_id = %s"
+CART_RECOUNT = """
+    UPDATE carts SET item_count = (SELECT COUNT(*) FROM cart_items WHERE cart_id = %s)
+    WHERE id = %s
+"""
+CART_EMPTY = "DELETE FROM cart_items WHERE cart_id = %s"
+CART_ZERO_COUNT = "UPDATE carts SET item_count = 0 WHERE id = %s"
+CART_COUNT = "SELECT item_count FROM carts WHERE id = %s"
+
+
+def cart_set_statements(cart_id, product_id, quantity):
+    """[(sql, params)] that set one product's quantity, removing it at 0"""
+    if quantity <= 0:
+        statement = (CART_REMOVE, (cart_id, product_id))
+    else:
+        statement = (CART_SET, (cart_id, product_id, quantity))
+    return [statement, (CART_RECOUNT, (cart_id, cart_id))]
+
+
+def cart_clear_statements(cart_id):
+    return [(CART_EMPTY, (cart_id,)), (CART_ZERO_COUNT, (cart_id,))]
+
+
+class DbCartStore:
+    """Carts in the carts / cart_items tables, shared by all workers and devices.
+
+    carts.item_count is kept in step with cart_items so the navbar badge is
+    a primary-key lookup. add(), set() and clear() write on the request's
+    connection and leave the commit to the route. cart_for_user() is also
+    reached from templates (through the navbar badge), so it commits its one
+    row on a connection of its own from `pool` instead.
+    """
+
+    def __init__(self, get_connection, pool):
+        self.get_connection = get_connection
+        self.pool = pool
+
+    def _run(self, *statements):
+        cur = self.get_connection().cursor()
+        for sql, params in statements:
+            cur.execute(sql, params)
+        cur.close()
+
+    def cart_for_user(self, user_id):
+        conn = self.pool.acquire()
+        try:
+            cur = conn.cursor()
+            cur.execute(CART_FOR_USER, (user_id,))
+            cart_id = cur.lastrowid
+            cur.close()
+            conn.commit()
+        finally:
+            self.pool.release(conn)
+        return cart_id
+
+    def items(self, cart_id):
+        cur = self.get_connection().cursor()
+        cur.execute(CART_ITEMS, (cart_id,))
+        items = {row['product_id']: row['quantity'] for row in cur.fetchall()}
+        cur.close()
+        return items
+
+    def add(self, cart_id, product_id, quantity=1):
+        self._run((CART_ADD, (cart_id, product_id, quantity)), (CART_RECOUNT, (cart_id, cart_id)))
+
+    def set(self, cart_id, product_id, quantity):
+        self._run(*cart_set_statements(cart_id, product_id, quantity))
+
+    def clear(self, cart_id):
+        self._run(*cart_clear_statements(cart_id))
+
+    def count(self, cart_id):
+        cur = self.get_connection().cursor()
+        cur.execute(CART_COUNT, (cart_id,))
+        row = cur.fetchone()
+        cur.close()
+        return row['item_count'] if row else 0
+
+
+def create_cart_store(backend, get_connection=None, pool=None, max_carts=10000):
+    """Build the cart store named by config CART_BACKEND ('db' or 'memory')"""
+    if backend == 'memory':
+        return MemoryCartStore(max_carts=max_carts)
+    if backend == 'db':
+        return DbCartStore(get_connection, pool)
+    raise ValueError('Unknown CART_BACKEND %r' % backend)
@@ -4,4 +4,94 @@ class Config:
     MYSQL_USER = 'root'
     MYSQL_PASSWORD = ''  # change if you have a password
     MYSQL_DB = 'py_etr'  # ← Changed from 'ecommerce_db' to 'py_etr'
-    MYSQL_CURSORCLASS = 'DictCursor'
\ No newline at end of file
+    MYSQL_CURSORCLASS = 'DictCursor'
+    MYSQL_PORT = 3306
+
+    # Connection pool (per worker process)
+    MYSQL_POOL_MIN_SIZE = 1         # connections each worker keeps open, even when idle
+    MYSQL_POOL_MAX_SIZE = 10
+    MYSQL_POOL_IDLE_TIMEOUT = 300   # close idle connections after this many seconds
+    MYSQL_POOL_MAX_LIFETIME = 3600  # recycle connections older than this
+    MYSQL_POOL_WAIT_TIMEOUT = 5     # seconds to wait for a free connection before failing
+    MYSQL_POOL_PING = True          # ping connections before handing them out
+
+    # Catalog search: full index rebuild interval (seconds) and max hits per query
+    SEARCH_INDEX_TTL = 300
+    SEARCH_RESULT_LIMIT = 500
+    # Search-box typeahead: suggestions per keystroke (the prefix index shares SEARCH_INDEX_TTL)
+    SUGGEST_LIMIT = 8
+
+    # Customer catalog: products in the top carousel
+    CATALOG_FEATURED_COUNT = 5
+
+    # Customer order history: orders per page
+    ORDER_HISTORY_PAGE_SIZE = 10
+
+    # Seconds before the in-memory category list is reloaded (inserts invalidate it immediately)
+    CATEGORY_CACHE_TTL = 600
+
+    # Auto-delivery of shipped orders (see update_order_statuses)
+    AUTO_DELIVERY_IN_PROCESS = True  # set False when running `flask auto-deliver --loop` separately
+    AUTO_DELIVERY_INTERVAL = 300     # seconds between runs
+    AUTO_DELIVERY_BATCH_SIZE = 500   # orders updated per commit
+
+    # Background threads that build resized product image variants
+    IMAGE_WORKERS = 2
+
+    # Upload limits (bytes)
+    MAX_CONTENT_LENGTH = 16 * 1024 * 1024
+    MAX_PRODUCT_IMAGE_SIZE = 8 * 1024 * 1024
+    MAX_PROOF_SIZE = 10 * 1024 * 1024
+    MAX_IMPORT_SIZE = 512 * 1024 * 1024  # bulk product import: feed plus zip of images
+
+    # Cart storage: 'db' (carts/cart_items tables) or 'memory' (per-process LRU, for tests)
+    CART_BACKEND = 'db'
+    CART_MEMORY_MAX_CARTS = 10000
+
+    # Full-page cache for the public catalog: seconds fresh, extra seconds served stale while
+    # refreshing, pages kept in memory, and an optional directory shared by all workers
+    PAGE_CACHE_TTL = 60
+    PAGE_CACHE_STALE_TTL = 300
+    PAGE_CACHE_MAX_ENTRIES = 500
+    PAGE_CACHE_DIR = None
+
+    # Rendered product cards kept by the {% cache %} template tag (see fragments.py)
+    FRAGMENT_CACHE_MAX_ENTRIES = 2000
+
+    # Request instrumentation (see /admin/metrics): log a warning above either threshold
+    SLOW_REQUEST_SECONDS = 1.0
+    MAX_QUERIES_PER_REQUEST = 20
+    SERVER_TIMING_HEADER = False  # add a Server-Timing header (DB time, query count); the benchmark reads it
+
+    # Bulk product import (admin upload and `flask import-products`): rows per INSERT and commit
+    IMPORT_BATCH_SIZE = 500
+
+    # Admission control (see ratelimit.py). Budgets are (requests, per seconds) per client IP and
+    # per account, with a bucket for every route; an endpoint name as key overrides its budget.
+    # RATE_LIMIT_BACKEND: 'memory' (per process), 'local' (SQLite file shared by this host's
+    # workers, RATE_LIMIT_LOCAL_PATH or instance/rate_limits.sqlite3) or 'db' (rate_limits table)
+    RATE_LIMIT_ENABLED = True
+    RATE_LIMIT_BACKEND = 'memory'
+    RATE_LIMIT_LOCAL_PATH = None
+    RATE_LIMITS = {
+        'login': {'ip': (20, 60), 'account': (5, 300)},
+        'register': {'ip': (5, 600)},
+        'mutation': {'ip': (120, 60), 'account': (60, 60)},
+    }
+    # Reverse proxies in front of the app that append to X-Forwarded-For. The per-IP rate limits key on
+    # the client address, so behind nginx or a load balancer set this to the number of proxies, or every
+    # client shares the proxy's buckets. 0 trusts no header. Under uvicorn (asgi.py) leave it at 0 and
+    # run uvicorn with --proxy-headers --forwarded-allow-ips=<proxy address> instead.
+    PROXY_FIX_X_FOR = 0
+    # Requests a worker process handles at once; more are answered 503 straight away (None: no cap)
+    MAX_CONCURRENT_REQUESTS = 64
+
+    # Optional ASGI mode (`uvicorn asgi:application`, needs aiomysql, aiofiles and a2wsgi): the hot
+    # routes run as coroutines on an aiomysql pool of up to ASYNC_MYSQL_POOL_MAX_SIZE connections,
+    # every other route runs the Flask view on a pool of ASGI_WSGI_WORKERS threads. One process then
+    # holds far more requests at once than threads, so raise MAX_CONCURRENT_REQUESTS to match, and keep
+    # RATE_LIMIT_BACKEND at 'memory' or 'local' ('db' takes a blocking connection on every check)
+    ASYNC_MYSQL_POOL_MAX_SIZE = 20
+    ASGI_WSGI_WORKERS = 10
+    # Request bodies of native routes are kept in memory up to this size, then spooled to disk
+    ASGI_BODY_SPOOL_SIZE = 1024 * 1024
@@ -0,0 +1,244 @@
+import time
+import threading
+from collections import deque
+
+import MySQLdb
+import MySQLdb.cursors
+from flask import g
+
+from metrics import instrument_cursor_class
+
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection frees up within the wait timeout; `pool` is the pool that ran dry"""
+
+    def __init__(self, message, pool=None):
+        super().__init__(message)
+        self.pool = pool
+
+
+class ConnectionPool:
+    """Thread-safe pool of MySQLdb connections.
+
+    Idle connections are pinged before being handed out, closed once they
+    have been idle for `idle_timeout` seconds (down to `min_size`), and
+    retired after `max_lifetime` seconds regardless; fill() opens connections
+    back up to `min_size`. When all `max_size` connections are busy, acquire()
+    waits up to `wait_timeout` seconds and then raises PoolTimeout.
+    """
+
+    def __init__(self, connect, min_size=1, max_size=10, idle_timeout=300,
+                 max_lifetime=3600, wait_timeout=5, ping=True):
+        self.connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.wait_timeout = wait_timeout
+        self.ping = ping
+        self._cond = threading.Condition()
+        self._idle = deque()   # (connection, created_at, last_used)
+        self._created_at = {}  # id(connection) -> created_at, for checked-out connections
+        self._size = 0
+        self._stats = {'created': 0, 'closed': 0, 'acquired': 0, 'waits': 0,
+                       'timeouts': 0, 'ping_failures': 0, 'wait_seconds': 0.0}
+
+    def acquire(self):
+        deadline = time.time() + self.wait_timeout
+        while True:
+            conn, created_at = self._reserve(deadline)
+            if conn is None or not self.ping or self._is_alive(conn):
+                break
+            # A dead idle connection; try the next one within the same deadline
+            self._discard(conn)
+        if conn is None:
+            conn = self._open()
+            created_at = time.time()
+
+        with self._cond:
+            self._created_at[id(conn)] = created_at
+            self._stats['acquired'] += 1
+        return conn
+
+    def fill(self):
+        """Open connections until the pool holds min_size; returns how many were opened.
+
+        Run by the app's pool warm-up job, so the first requests of a worker
+        process (and those after connections were retired) find them open.
+        """
+        opened = 0
+        while True:
+            with self._cond:
+                if self._size >= self.min_size:
+                    return opened
+                self._size += 1
+            conn = self._open()
+            with self._cond:
+                self._idle.append((conn, time.time(), time.time()))
+                self._cond.notify()
+            opened += 1
+
+    def _reserve(self, deadline):
+        """An idle (connection, created_at), or (None, None) with a slot reserved for a new
+        connection; waits for one to be released until `deadline`, then raises PoolTimeout"""
+        wait_started = None
+        with self._cond:
+            while True:
+                conn, created_at = self._take_idle()
+                if conn is not None:
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeout('No MySQL connection became available within %ss (max_size=%d)'
+                                      % (self.wait_timeout, self.max_size), self)
+                if wait_started is None:
+                    wait_started = time.time()
+                    self._stats['waits'] += 1
+                self._cond.wait(remaining)
+            if wait_started is not None:
+                self._stats['wait_seconds'] += time.time() - wait_started
+        return conn, created_at
+
+    def _open(self):
+        # Called with a slot reserved in _size; gives it back if the connection fails
+        try:
+            conn = self.connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._stats['created'] += 1
+        return conn
+
+    def release(self, conn):
+        # Never hand a half-finished transaction to the next request
+        try:
+            conn.rollback()
+        except MySQLdb.Error:
+            self._discard(conn)
+            return
+        now = time.time()
+        with self._cond:
+            created_at = self._created_at.pop(id(conn), now)
+            if now - created_at >= self.max_lifetime:
+                self._size -= 1
+                self._stats['closed'] += 1
+                self._cond.notify()
+            else:
+                self._idle.append((conn, created_at, now))
+                self._cond.notify()
+                return
+        self._close(conn)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update(size=self._size, idle=len(self._idle), in_use=self._size - len(self._idle),
+                         min_size=self.min_size, max_size=self.max_size)
+        return stats
+
+    def close_all(self):
+        with self._cond:
+            idle, self._idle = list(self._idle), deque()
+            self._size -= len(idle)
+            self._stats['closed'] += len(idle)
+        for conn, _, _ in idle:
+            self._close(conn)
+
+    def _take_idle(self):
+        # Called with the lock held; most recently used first so extra connections go idle
+        now = time.time()
+        while self._idle:
+            conn, created_at, last_used = self._idle.pop()
+            expired = now - created_at >= self.max_lifetime
+            if expired:
+                self._size -= 1
+                self._stats['closed'] += 1
+                self._close(conn)
+                continue
+            self._prune_idle(now)
+            return conn, created_at
+        return None, None
+
+    def _prune_idle(self, now):
+        # The oldest idle connections sit at the left end
+        while self._idle and self._size > self.min_size and now - self._idle[0][2] >= self.idle_timeout:
+            conn, _, _ = self._idle.popleft()
+            self._size -= 1
+            self._stats['closed'] += 1
+            self._close(conn)
+
+    def _is_alive(self, conn):
+        try:
+            conn.ping()
+            return True
+        except MySQLdb.Error:
+            with self._cond:
+                self._stats['ping_failures'] += 1
+            return False
+
+    def _discard(self, conn):
+        with self._cond:
+            self._created_at.pop(id(conn), None)
+            self._size -= 1
+            self._stats['closed'] += 1
+            self._cond.notify()
+        self._close(conn)
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except MySQLdb.Error:
+            pass
+
+
+class MySQLPool:
+    """Drop-in for flask_mysqldb.MySQL backed by a ConnectionPool.
+
+    `mysql.connection` checks a connection out of the pool the first time it
+    is used in an app context and returns it when the context tears down.
+    """
+
+    def __init__(self, app=None):
+        self.pool = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        self.pool = ConnectionPool(
+            lambda: MySQLdb.connect(
+                host=config['MYSQL_HOST'],
+                user=config['MYSQL_USER'],
+                passwd=config['MYSQL_PASSWORD'],
+                db=config['MYSQL_DB'],
+                port=config.get('MYSQL_PORT', 3306),
+                charset=config.get('MYSQL_CHARSET', 'utf8mb4'),
+                cursorclass=instrument_cursor_class(getattr(MySQLdb.cursors, config['MYSQL_CURSORCLASS'])),
+            ),
+            min_size=config['MYSQL_POOL_MIN_SIZE'],
+            max_size=config['MYSQL_POOL_MAX_SIZE'],
+            idle_timeout=config['MYSQL_POOL_IDLE_TIMEOUT'],
+            max_lifetime=config['MYSQL_POOL_MAX_LIFETIME'],
+            wait_timeout=config['MYSQL_POOL_WAIT_TIMEOUT'],
+            ping=config['MYSQL_POOL_PING'],
+        )
+        app.teardown_appcontext(self.teardown)
+
+    @property
+    def connection(self):
+        if 'mysql_connection' not in g:
+            g.mysql_connection = self.pool.acquire()
+        return g.mysql_connection
+
+    def teardown(self, exception):
+        conn = g.pop('mysql_connection', None)
+        if conn is not None:
+            self.pool.release(conn)
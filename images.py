@@ -0,0 +1,129 @@
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it templates keep serving the originals
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Variant name -> target width in pixels
+VARIANTS = {'thumb': 320, 'medium': 640}
+
+
+class ImagePipeline:
+    """Generates resized WebP variants of uploaded product images off the request thread.
+
+    Variants are written next to the original as `<name>.<width>w.webp`.
+    Until a variant exists, url() and srcset() fall back to the original file.
+    Images found without variants are not looked for again for `recheck_after`
+    seconds (another worker process may build them in the meantime).
+    """
+
+    def __init__(self, folder, variants=VARIANTS, workers=2, quality=80, recheck_after=60):
+        self.folder = folder
+        self.variants = variants
+        self.quality = quality
+        self.recheck_after = recheck_after
+        self.enabled = Image is not None
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image-variants')
+        self._ready = set()  # filenames whose variants are known to exist
+        self._missing = {}   # filename -> when its variants were last found missing (or failed to build)
+        self._pending = {}   # filename -> future of a queued/running build
+        self._lock = threading.Lock()
+
+    def variant_name(self, filename, width):
+        return '%s.%dw.webp' % (os.path.splitext(filename)[0], width)
+
+    def submit(self, filename):
+        """Queue variant generation for a freshly saved upload"""
+        if not (self.enabled and filename):
+            return None
+        with self._lock:
+            if filename not in self._pending:
+                self._ready.discard(filename)
+                self._pending[filename] = self._executor.submit(self._generate, filename)
+            return self._pending[filename]
+
+    def remove(self, filename):
+        """Delete the variants of an image that is being replaced or deleted"""
+        if not filename:
+            return
+        with self._lock:
+            self._ready.discard(filename)
+            self._missing.pop(filename, None)
+        for width in self.variants.values():
+            path = os.path.join(self.folder, self.variant_name(filename, width))
+            if os.path.exists(path):
+                os.remove(path)
+
+    def is_ready(self, filename):
+        if not self.enabled:
+            return False
+        now = time.time()
+        with self._lock:
+            if filename in self._ready:
+                return True
+            if filename in self._pending or now - self._missing.get(filename, 0) < self.recheck_after:
+                return False
+        ready = all(os.path.exists(os.path.join(self.folder, self.variant_name(filename, width)))
+                    for width in self.variants.values())
+        with self._lock:
+            if ready:
+                self._ready.add(filename)
+                self._missing.pop(filename, None)
+            else:
+                self._missing[filename] = now
+        return ready
+
+    def url_path(self, filename, size):
+        """Path (relative to the upload folder) of the best file for `size`"""
+        if filename and size in self.variants and self.is_ready(filename):
+            return self.variant_name(filename, self.variants[size])
+        return filename
+
+    def srcset(self, filename):
+        """[(variant path, width)] for a srcset attribute; empty until variants are ready"""
+        if not filename or not self.is_ready(filename):
+            return []
+        return [(self.variant_name(filename, width), width) for width in sorted(self.variants.values())]
+
+    def _generate(self, filename):
+        try:
+            return self._build(filename)
+        finally:
+            with self._lock:
+                self._pending.pop(filename, None)
+
+    def _build(self, filename):
+        source = os.path.join(self.folder, filename)
+        try:
+            with Image.open(source) as original:
+                image = ImageOps.exif_transpose(original)
+                if image.mode not in ('RGB', 'RGBA'):
+                    image = image.convert('RGBA')
+                for width in self.variants.values():
+                    resized = image.copy()
+                    if resized.width > width:
+                        resized.thumbnail((width, resized.height))
+                    target = os.path.join(self.folder, self.variant_name(filename, width))
+                    tmp = '%s.%d.tmp' % (target, threading.get_ident())
+                    resized.save(tmp, 'WEBP', quality=self.quality, method=4)
+                    os.replace(tmp, target)
+        except (OSError, ValueError):
+            logger.exception('Could not build image variants for %s', filename)
+            with self._lock:
+                self._missing[filename] = time.time()
+            return False
+        if not os.path.exists(source):
+            # The original was deleted while we were resizing it
+            self.remove(filename)
+            return False
+        with self._lock:
+            self._ready.add(filename)
+            self._missing.pop(filename, None)
+        return True
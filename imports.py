@@ -0,0 +1,226 @@
+"""Bulk product import from a CSV or JSONL supplier feed.
+
+The feed is read one row at a time, each row is checked with ProductForm's
+rules, and rows are written in batches: one multi-row INSERT ... ON DUPLICATE
+KEY UPDATE per batch (keyed on products.sku) followed by a commit. Memory use
+stays flat however large the feed is, and batches committed before a failure
+stay imported.
+
+Columns: sku, name, description, price, stock, category (by name) and image
+(a file name looked up in an ImageSource). Rows without a sku are always added.
+"""
+import io
+import os
+import csv
+import json
+import zipfile
+
+from werkzeug.datastructures import FileStorage, MultiDict
+from werkzeug.utils import safe_join
+
+from forms import ProductForm
+
+CSV_EXTENSIONS = ('.csv',)
+JSONL_EXTENSIONS = ('.jsonl', '.ndjson')
+SKU_MAX_LENGTH = 64
+# Errors kept for the report; later ones are only counted
+MAX_REPORTED_ERRORS = 1000
+
+
+def feed_format(filename):
+    """'csv', 'jsonl' or None for an unsupported file name"""
+    ext = os.path.splitext(filename or '')[1].lower()
+    if ext in CSV_EXTENSIONS:
+        return 'csv'
+    if ext in JSONL_EXTENSIONS:
+        return 'jsonl'
+    return None
+
+
+def read_rows(stream, fmt):
+    """Yield (line number, row dict or None, parse error or None) from a binary feed stream"""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        for row in reader:
+            # Header names are matched case-insensitively
+            yield reader.line_num, {(k or '').strip().lower(): v for k, v in row.items()}, None
+        return
+    for number, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as error:
+            yield number, None, 'Invalid JSON: %s' % error
+            continue
+        if not isinstance(row, dict):
+            yield number, None, 'Expected a JSON object'
+            continue
+        yield number, {str(k).lower(): v for k, v in row.items()}, None
+
+
+class ImageSource:
+    """Finds a feed row's image by file name in a local directory or a zip archive"""
+
+    def __init__(self, source):
+        self.folder = None
+        self.archive = None
+        if isinstance(source, str) and os.path.isdir(source):
+            self.folder = source
+        else:
+            self.archive = zipfile.ZipFile(source)  # a path or a seekable file; raises BadZipFile
+            self._members = {info.filename: info for info in self.archive.infolist() if not info.is_dir()}
+
+    def open(self, name):
+        """A FileStorage for the named image, or None if there is no such file"""
+        name = name.strip().replace('\\', '/')
+        if self.folder is not None:
+            path = safe_join(self.folder, name)
+            if path is None or not os.path.isfile(path):
+                return None
+            return FileStorage(open(path, 'rb'), filename=os.path.basename(path))
+        info = self._members.get(name)
+        if info is None:
+            return None
+        return FileStorage(self.archive.open(info), filename=os.path.basename(info.filename))
+
+    def close(self):
+        if self.archive is not None:
+            self.archive.close()
+
+
+class ImportReport:
+    """Running totals of an import; errors are (line number, message)"""
+
+    def __init__(self):
+        self.rows = 0
+        self.inserted = 0
+        self.updated = 0
+        self.rejected = 0
+        self.categories_created = 0
+        self.errors = []
+
+    def error(self, line, message):
+        self.rejected += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+    def summary(self):
+        return '%d rows: %d added, %d updated, %d rejected' % (self.rows, self.inserted, self.updated, self.rejected)
+
+
+class ProductImporter:
+    """Validates and upserts feed rows in batches of `batch_size`, committing after each.
+
+    `save_image(cur, file)` / `release_image(cur, filename)` store and drop
+    product images (the app's BlobStore plus variant pipeline). Unknown
+    category names reject the row unless `create_categories` is set.
+    """
+
+    def __init__(self, connection, repositories, save_image, release_image, images=None, batch_size=500,
+                 create_categories=False):
+        self.connection = connection
+        self.products = repositories.products
+        self.categories = repositories.categories
+        self.save_image = save_image
+        self.release_image = release_image
+        self.images = images
+        self.batch_size = batch_size
+        self.create_categories = create_categories
+        self.report = ImportReport()
+        self._category_ids = {c.name.strip().lower(): c.id for c in self.categories.all()}
+        self._choices = [(cid, name) for name, cid in self._category_ids.items()]
+
+    def run(self, stream, fmt):
+        """Import the feed, yielding the report after every committed batch"""
+        batch = []
+        reported_rows = None
+        for line, raw, error in read_rows(stream, fmt):
+            self.report.rows += 1
+            values, error = (None, error) if error else self.validate(raw)
+            if error:
+                self.report.error(line, error)
+                continue
+            batch.append((line, values))
+            if len(batch) >= self.batch_size:
+                self._write(batch)
+                batch = []
+                reported_rows = self.report.rows
+                yield self.report
+        if batch:
+            self._write(batch)
+        self.connection.commit()  # categories created for rows that were all rejected
+        if self.report.rows != reported_rows:
+            yield self.report
+
+    def validate(self, raw):
+        """(values, None) for a valid row, (None, message) otherwise"""
+        category = str(raw.get('category') or '').strip()
+        category_id = self._category_id(category) if category else None
+        if category and category_id is None:
+            return None, 'Unknown category %r' % category
+        form = ProductForm(formdata=MultiDict({
+            'name': _text(raw.get('name')),
+            'description': _text(raw.get('description')),
+            'price': _text(raw.get('price')),
+            'stock': _text(raw.get('stock')),
+            'category_id': '' if category_id is None else str(category_id),
+        }), meta={'csrf': False})
+        form.category_id.choices = self._choices
+        if not form.validate():
+            return None, '; '.join('%s: %s' % (field, ' '.join(messages)) for field, messages in form.errors.items())
+        sku = _text(raw.get('sku')).strip() or None
+        if sku and len(sku) > SKU_MAX_LENGTH:
+            return None, 'sku: longer than %d characters' % SKU_MAX_LENGTH
+        return (sku, form.name.data, form.description.data, form.price.data, form.stock.data,
+                form.category_id.data, _text(raw.get('image')).strip() or None), None
+
+    def _category_id(self, name):
+        key = name.lower()
+        if key not in self._category_ids and self.create_categories:
+            self._category_ids[key] = self.categories.create(name)
+            self._choices.append((self._category_ids[key], name))
+            self.report.categories_created += 1
+        return self._category_ids.get(key)
+
+    def _write(self, batch):
+        # What the batch's SKUs hold now: decides added vs updated and which images get replaced
+        current = self.products.images_by_sku({values[0] for _, values in batch if values[0]})
+        cur = self.connection.cursor()
+        rows = []
+        created = updated = 0
+        try:
+            for line, (sku, name, description, price, stock, category_id, image_name) in batch:
+                image = None
+                if image_name:
+                    file = self.images.open(image_name) if self.images else None
+                    if file is None:
+                        self.report.error(line, 'image: %s not found' % image_name)
+                        continue
+                    try:
+                        image = self.save_image(cur, file)
+                    finally:
+                        file.close()
+                if sku and sku in current:
+                    if image and current[sku]:
+                        self.release_image(cur, current[sku])
+                    updated += 1
+                else:
+                    created += 1
+                if sku:
+                    current[sku] = image or current.get(sku)
+                rows.append((sku, name, description, price, stock, category_id, image))
+            self.products.upsert_many(rows, created)
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            raise
+        finally:
+            cur.close()
+        self.report.inserted += created
+        self.report.updated += updated
+
+
+def _text(value):
+    return '' if value is None else str(value)
@@ -0,0 +1,30 @@
+class ProductLoader:
+    """Batch-loads products by id and keeps them for the rest of the request.
+
+    Ids are fetched with one `IN (...)` query (ProductRepository.by_ids) and
+    remembered in an identity map, so asking for the same product twice never
+    hits MySQL again. Ids that no longer exist are remembered as missing too.
+    """
+
+    def __init__(self, products):
+        self.products = products
+        self._products = {}
+
+    def load_many(self, product_ids):
+        """Return {id: product} for the ids that still exist"""
+        ids = [int(pid) for pid in product_ids]
+        missing = [pid for pid in dict.fromkeys(ids) if pid not in self._products]
+        if missing:
+            for product in self.products.by_ids(missing):
+                self._products[product.id] = product
+            for pid in missing:
+                self._products.setdefault(pid, None)
+        return {pid: self._products[pid] for pid in ids if self._products[pid] is not None}
+
+    def load(self, product_id):
+        return self.load_many([product_id]).get(int(product_id))
+
+    def forget(self, product_ids):
+        """Drop cached rows, e.g. after their stock was changed in this request"""
+        for pid in product_ids:
+            self._products.pop(int(pid), None)
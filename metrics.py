@@ -0,0 +1,272 @@
+import time
+import bisect
+import logging
+import threading
+
+from flask import g, has_app_context, request, template_rendered, before_render_template
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (le) of the histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def instrument_cursor_class(base, streaming=False):
+    """Subclass a MySQLdb cursor class so every statement is timed into the current request's stats.
+
+    Arguments go to MySQLdb untouched: a query run without args (such as the
+    DATE_FORMAT '%x-W%v' reports) must not be %-formatted. An unbuffered
+    (`streaming`) cursor such as SSCursor does not know its rowcount after
+    execute(), so its rows are counted as they are fetched instead.
+    """
+
+    class InstrumentedCursor(base):
+        _batch = False
+        _streaming = False
+
+        def execute(self, query, args=None):
+            if self._batch:
+                return super().execute(query, args)
+            start = time.perf_counter()
+            try:
+                return super().execute(query, args)
+            finally:
+                record_query(query, time.perf_counter() - start, self)
+
+        def executemany(self, query, args):
+            # MySQLdb runs some executemany() calls as a loop of execute(); count them once
+            self._batch = True
+            start = time.perf_counter()
+            try:
+                return super().executemany(query, args)
+            finally:
+                self._batch = False
+                record_query(query, time.perf_counter() - start, self)
+
+    if streaming:
+        class InstrumentedCursor(InstrumentedCursor):
+            _streaming = True
+
+            def fetchone(self):
+                values = super().fetchone()
+                if values is not None:
+                    record_rows(1)
+                return values
+
+            def fetchmany(self, size=None):
+                rows = super().fetchmany(size)
+                record_rows(len(rows))
+                return rows
+
+            def fetchall(self):
+                rows = super().fetchall()
+                record_rows(len(rows))
+                return rows
+
+    InstrumentedCursor.__name__ = 'Instrumented' + base.__name__
+    return InstrumentedCursor
+
+
+def instrument_async_cursor_class(base):
+    """instrument_cursor_class() for aiomysql cursors (the ASGI mode, see asyncdb.py)"""
+
+    class InstrumentedCursor(base):
+        _batch = False
+        _streaming = False
+
+        async def execute(self, query, args=None):
+            if self._batch:
+                return await super().execute(query, args)
+            start = time.perf_counter()
+            try:
+                return await super().execute(query, args)
+            finally:
+                record_query(query, time.perf_counter() - start, self)
+
+        async def executemany(self, query, args):
+            # Like MySQLdb, aiomysql runs executemany() through execute(); count it once
+            self._batch = True
+            start = time.perf_counter()
+            try:
+                return await super().executemany(query, args)
+            finally:
+                self._batch = False
+                record_query(query, time.perf_counter() - start, self)
+
+    InstrumentedCursor.__name__ = 'Instrumented' + base.__name__
+    return InstrumentedCursor
+
+
+def record_query(query, seconds, cursor):
+    if not has_app_context():
+        return
+    stats = g.get('request_stats')
+    if stats is None:
+        return  # background jobs and CLI commands are not tracked
+    stats['queries'] += 1
+    stats['db_time'] += seconds
+    if not cursor._streaming and cursor.description is not None and cursor.rowcount > 0:
+        stats['rows'] += cursor.rowcount
+    if seconds > stats['slowest'][0]:
+        stats['slowest'] = (seconds, ' '.join(query.split()))
+
+
+def record_rows(count):
+    """Add rows fetched from a streaming cursor to the current request's stats"""
+    if not has_app_context():
+        return
+    stats = g.get('request_stats')
+    if stats is not None:
+        stats['rows'] += count
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class RequestMetrics:
+    """Per-endpoint request, database and template metrics for this process.
+
+    Requests that take longer than `slow_seconds` or issue more than
+    `max_queries` statements are logged as warnings with their slowest query.
+    """
+
+    HISTOGRAMS = [
+        # (name, help, buckets, request_stats key)
+        ('http_request_duration_seconds', 'Time spent handling the request', LATENCY_BUCKETS, 'duration'),
+        ('db_queries_per_request', 'SQL statements issued per request', QUERY_COUNT_BUCKETS, 'queries'),
+        ('db_time_seconds', 'Time spent in SQL statements per request', LATENCY_BUCKETS, 'db_time'),
+        ('template_render_seconds', 'Time spent rendering templates per request', LATENCY_BUCKETS, 'render_time'),
+        ('http_response_bytes', 'Response body size', SIZE_BUCKETS, 'size'),
+    ]
+
+    def __init__(self, app=None, prefix='py_etr_', slow_seconds=1.0, max_queries=20, server_timing=False):
+        self.prefix = prefix
+        self.slow_seconds = slow_seconds
+        self.max_queries = max_queries
+        self.server_timing = server_timing  # per-response Server-Timing header, for benchmarks and devtools
+        self.gauges = []    # callables returning [(name, help, {labels: value})]
+        self.counters = []  # the same, for values that only ever go up
+        self._lock = threading.Lock()
+        self._histograms = {}  # (name, endpoint) -> Histogram
+        self._requests = {}    # (endpoint, method, status) -> count
+        self._rows = {}        # endpoint -> rows fetched
+        self._slowest = {}     # endpoint -> slowest single statement, seconds
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.slow_seconds = app.config.get('SLOW_REQUEST_SECONDS', self.slow_seconds)
+        self.max_queries = app.config.get('MAX_QUERIES_PER_REQUEST', self.max_queries)
+        self.server_timing = app.config.get('SERVER_TIMING_HEADER', self.server_timing)
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        before_render_template.connect(self._render_started, app)
+        template_rendered.connect(self._render_finished, app)
+
+    def add_gauges(self, func):
+        """Register func() -> [(name, help, {label tuple or (): value})], sampled on every scrape"""
+        self.gauges.append(func)
+        return func
+
+    def add_counters(self, func):
+        """add_gauges() for running totals; exported as counters, their names end in _total"""
+        self.counters.append(func)
+        return func
+
+    def _start(self):
+        g.request_started = time.perf_counter()
+        g.request_stats = {'queries': 0, 'db_time': 0.0, 'rows': 0, 'slowest': (0.0, None),
+                           'render_time': 0.0}
+
+    def _render_started(self, sender, template, context, **extra):
+        g.render_started = time.perf_counter()
+
+    def _render_finished(self, sender, template, context, **extra):
+        started = g.pop('render_started', None)
+        stats = g.get('request_stats')
+        if started is not None and stats is not None:
+            stats['render_time'] += time.perf_counter() - started
+
+    def _finish(self, response):
+        stats = g.get('request_stats')
+        if stats is None:
+            return response
+        stats['duration'] = time.perf_counter() - g.request_started
+        stats['size'] = response.content_length or 0
+        endpoint = request.endpoint or 'unmatched'
+
+        with self._lock:
+            for name, _, buckets, key in self.HISTOGRAMS:
+                histogram = self._histograms.get((name, endpoint))
+                if histogram is None:
+                    histogram = self._histograms[(name, endpoint)] = Histogram(buckets)
+                histogram.observe(stats[key])
+            status_key = (endpoint, request.method, response.status_code)
+            self._requests[status_key] = self._requests.get(status_key, 0) + 1
+            self._rows[endpoint] = self._rows.get(endpoint, 0) + stats['rows']
+            self._slowest[endpoint] = max(self._slowest.get(endpoint, 0.0), stats['slowest'][0])
+
+        if self.server_timing:
+            response.headers['Server-Timing'] = 'db;dur=%.2f;desc="%d queries", render;dur=%.2f, app;dur=%.2f' % (
+                stats['db_time'] * 1000, stats['queries'], stats['render_time'] * 1000, stats['duration'] * 1000)
+        if stats['duration'] > self.slow_seconds or stats['queries'] > self.max_queries:
+            logger.warning('%s %s took %.3fs with %d queries (%.3fs in DB, %.3fs rendering); slowest %.3fs: %s',
+                           request.method, request.path, stats['duration'], stats['queries'],
+                           stats['db_time'], stats['render_time'], stats['slowest'][0], stats['slowest'][1])
+        return response
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for name, help_text, buckets, _ in self.HISTOGRAMS:
+                full_name = self.prefix + name
+                lines += ['# HELP %s %s' % (full_name, help_text), '# TYPE %s histogram' % full_name]
+                for (histogram_name, endpoint), histogram in sorted(self._histograms.items()):
+                    if histogram_name != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(list(buckets) + ['+Inf'], histogram.counts):
+                        cumulative += count
+                        lines.append('%s_bucket{endpoint="%s",le="%s"} %d' % (full_name, endpoint, bound, cumulative))
+                    lines.append('%s_sum{endpoint="%s"} %s' % (full_name, endpoint, repr(float(histogram.sum))))
+                    lines.append('%s_count{endpoint="%s"} %d' % (full_name, endpoint, histogram.count))
+
+            full_name = self.prefix + 'http_requests_total'
+            lines += ['# HELP %s Requests handled' % full_name, '# TYPE %s counter' % full_name]
+            for (endpoint, method, status), count in sorted(self._requests.items()):
+                lines.append('%s{endpoint="%s",method="%s",status="%d"} %d'
+                             % (full_name, endpoint, method, status, count))
+
+            full_name = self.prefix + 'db_rows_total'
+            lines += ['# HELP %s Rows returned by SELECT statements' % full_name, '# TYPE %s counter' % full_name]
+            for endpoint, rows in sorted(self._rows.items()):
+                lines.append('%s{endpoint="%s"} %d' % (full_name, endpoint, rows))
+
+            full_name = self.prefix + 'db_slowest_query_seconds'
+            lines += ['# HELP %s Slowest single statement seen' % full_name, '# TYPE %s gauge' % full_name]
+            for endpoint, seconds in sorted(self._slowest.items()):
+                lines.append('%s{endpoint="%s"} %s' % (full_name, endpoint, repr(float(seconds))))
+
+        for kind, funcs in (('gauge', self.gauges), ('counter', self.counters)):
+            for func in funcs:
+                for name, help_text, samples in func():
+                    full_name = self.prefix + name
+                    lines += ['# HELP %s %s' % (full_name, help_text), '# TYPE %s %s' % (full_name, kind)]
+                    for labels, value in samples.items():
+                        label_text = ','.join('%s="%s"' % pair for pair in labels)
+                        lines.append('%s%s %s' % (full_name, '{%s}' % label_text if label_text else '',
+                                                  repr(float(value or 0))))
+        return '\n'.join(lines) + '\n'
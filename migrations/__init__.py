@@ -0,0 +1,74 @@
+"""Versioned schema migrations.
+
+Each module named mNNNN_<description>.py defines upgrade(cur). Applied versions
+are recorded in the schema_migrations table, so running upgrade() again only
+applies what is new.
+"""
+import re
+import pkgutil
+import importlib
+
+MODULE_RE = re.compile(r'^m(\d{4})_\w+$')
+
+
+def discover():
+    """Return [(version, name, module)] for every migration, oldest first"""
+    migrations = []
+    for info in pkgutil.iter_modules(__path__):
+        match = MODULE_RE.match(info.name)
+        if match:
+            module = importlib.import_module('%s.%s' % (__name__, info.name))
+            migrations.append((int(match.group(1)), info.name, module))
+    return sorted(migrations, key=lambda m: m[0])
+
+
+def applied_versions(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT NOT NULL PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            applied_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cur.execute("SELECT version FROM schema_migrations")
+    return {row['version'] for row in cur.fetchall()}
+
+
+def upgrade(connection):
+    """Apply every pending migration; returns the names that were applied"""
+    cur = connection.cursor()
+    done = applied_versions(cur)
+    applied = []
+    for version, name, module in discover():
+        if version in done:
+            continue
+        module.upgrade(cur)
+        cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+        connection.commit()
+        applied.append(name)
+    cur.close()
+    return applied
+
+
+def add_index(cur, table, name, columns, unique=False):
+    """Create an index unless one with that name already exists (MySQL has no IF NOT EXISTS here)"""
+    cur.execute("""
+        SELECT 1 FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+        LIMIT 1
+    """, (table, name))
+    if cur.fetchone():
+        return
+    cur.execute("CREATE %sINDEX %s ON %s (%s)" % ('UNIQUE ' if unique else '', name, table, ', '.join(columns)))
+
+
+def add_column(cur, table, name, definition):
+    """Add a column unless it already exists"""
+    cur.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+        LIMIT 1
+    """, (table, name))
+    if cur.fetchone():
+        return
+    cur.execute("ALTER TABLE %s ADD COLUMN %s %s" % (table, name, definition))
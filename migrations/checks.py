@@ -0,0 +1,69 @@
+"""EXPLAIN checks for the queries on the app's hot paths.
+
+Each entry mirrors a query issued by a route in app.py, with representative
+parameters. check_hot_queries() reports any table MySQL would read with a
+full scan (EXPLAIN type = ALL).
+"""
+from datetime import datetime, timedelta, date
+
+CATALOG_FROM = """
+    FROM products p
+    LEFT JOIN categories c ON p.category_id = c.id
+    WHERE p.stock > 0 AND p.status = 'approved'
+"""
+
+HOT_QUERIES = [
+    ('catalog newest first',
+     "SELECT p.id, p.name, p.price " + CATALOG_FROM + " ORDER BY p.id DESC LIMIT 25", ()),
+    ('catalog price low to high',
+     "SELECT p.id, p.name, p.price " + CATALOG_FROM + " ORDER BY p.price ASC, p.id ASC LIMIT 25", ()),
+    ('catalog stock high to low',
+     "SELECT p.id, p.name, p.price " + CATALOG_FROM + " ORDER BY p.stock DESC, p.id DESC LIMIT 25", ()),
+    ('catalog category filter',
+     "SELECT p.id, p.name, p.price " + CATALOG_FROM + " AND p.category_id = %s ORDER BY p.id DESC LIMIT 25", (1,)),
+    ('cart product loader',
+     "SELECT id, name, price FROM products WHERE id IN (%s, %s, %s)", (1, 2, 3)),
+    ('customer login',
+     "SELECT id, fullname FROM users WHERE email = %s AND password = %s AND status = 'active'", ('a@b.c', 'x')),
+    ('customer orders',
+     """SELECT o.id, o.order_date FROM orders o
+        WHERE o.user_id = %s ORDER BY o.order_date DESC LIMIT 20""", (1,)),
+    ('customer order items',
+     """SELECT oi.order_id, oi.quantity, p.name FROM order_items oi
+        LEFT JOIN products p ON oi.product_id = p.id WHERE oi.order_id IN (%s, %s, %s)""", (1, 2, 3)),
+    ('my suggestions',
+     "SELECT p.id, p.name FROM products p WHERE p.suggested_by = %s ORDER BY p.id DESC", (1,)),
+    ('auto-delivery',
+     """UPDATE orders SET status = 'Delivered'
+        WHERE status = 'Shipped' AND order_date <= %s ORDER BY id LIMIT 500""",
+     (datetime.now() - timedelta(days=3),)),
+    ('admin orders page',
+     """SELECT o.id FROM orders o WHERE o.status = %s
+        ORDER BY o.order_date DESC, o.id DESC LIMIT 20 OFFSET 0""", ('Pending',)),
+    ('admin products page',
+     """SELECT p.id FROM products p WHERE p.status <> 'pending' AND p.name LIKE %s
+        ORDER BY p.name ASC, p.id ASC LIMIT 20 OFFSET 0""", ('a%',)),
+    ('admin users page',
+     "SELECT u.id FROM users u ORDER BY u.fullname ASC, u.id ASC LIMIT 20 OFFSET 0", ()),
+    ('dashboard sales by month',
+     "SELECT MONTH(day), SUM(sales) FROM sales_daily WHERE day >= %s AND day < %s GROUP BY MONTH(day)",
+     (date(2025, 1, 1), date(2026, 1, 1))),
+    ('dashboard users by month',
+     "SELECT MONTH(day), SUM(signups) FROM signups_daily WHERE day >= %s AND day < %s GROUP BY MONTH(day)",
+     (date(2025, 1, 1), date(2026, 1, 1))),
+]
+
+
+def check_hot_queries(cur, min_rows=0):
+    """EXPLAIN every hot query; returns [(query name, table, estimated rows)] for full scans.
+
+    Scans of tables estimated at fewer than `min_rows` rows are ignored, since
+    MySQL legitimately prefers a scan for tiny tables.
+    """
+    problems = []
+    for name, sql, params in HOT_QUERIES:
+        cur.execute("EXPLAIN " + sql, params)
+        for row in cur.fetchall():
+            if row.get('type') == 'ALL' and (row.get('rows') or 0) >= min_rows:
+                problems.append((name, row.get('table'), row.get('rows')))
+    return problems
@@ -0,0 +1,54 @@
+# Tables the app was originally deployed with; IF NOT EXISTS keeps existing installs untouched
+
+
+def upgrade(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            fullname VARCHAR(100) NOT NULL,
+            email VARCHAR(255) NOT NULL,
+            password VARCHAR(255) NOT NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'active',
+            created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS categories (
+            id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(100) NOT NULL
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS products (
+            id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            description TEXT,
+            price DECIMAL(10, 2) NOT NULL,
+            stock INT NOT NULL DEFAULT 0,
+            category_id INT NULL,
+            image VARCHAR(255) NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'approved',
+            suggested_by INT NULL,
+            decline_reason TEXT NULL
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS orders (
+            id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            user_id INT NOT NULL,
+            total_amount DECIMAL(12, 2) NOT NULL,
+            payment_method VARCHAR(20) NOT NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'Pending',
+            proof_image VARCHAR(255) NULL,
+            admin_note TEXT NULL,
+            order_date DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS order_items (
+            id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            order_id INT NOT NULL,
+            product_id INT NOT NULL,
+            quantity INT NOT NULL
+        )
+    """)
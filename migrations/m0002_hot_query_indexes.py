@@ -0,0 +1,25 @@
+# Composite indexes behind the catalog, order history, suggestions and admin queries
+from migrations import add_index
+
+INDEXES = [
+    # catalog: status = 'approved' AND stock > 0, ordered by price / stock
+    ('products', 'idx_products_status_stock', ['status', 'stock']),
+    ('products', 'idx_products_status_price', ['status', 'price']),
+    ('products', 'idx_products_category', ['category_id']),
+    # my_suggestions / edit_suggestion ownership checks
+    ('products', 'idx_products_suggested_by', ['suggested_by']),
+    # customer order history, admin order lists, auto-delivery
+    ('orders', 'idx_orders_user_date', ['user_id', 'order_date']),
+    ('orders', 'idx_orders_status_date', ['status', 'order_date']),
+    ('orders', 'idx_orders_date', ['order_date']),
+    ('order_items', 'idx_order_items_order', ['order_id']),
+    ('order_items', 'idx_order_items_product', ['product_id']),
+    # login / register lookups
+    ('users', 'idx_users_email', ['email']),
+    ('users', 'idx_users_created_at', ['created_at']),
+]
+
+
+def upgrade(cur):
+    for table, name, columns in INDEXES:
+        add_index(cur, table, name, columns)
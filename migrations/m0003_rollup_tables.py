@@ -0,0 +1,6 @@
+# Dashboard rollup tables, backfilled from existing orders and users
+import rollups
+
+
+def upgrade(cur):
+    rollups.rebuild(cur)
@@ -0,0 +1,25 @@
+# Reference counts for content-addressed uploads (see storage.BlobStore)
+
+
+def upgrade(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS file_refs (
+            path VARCHAR(191) NOT NULL PRIMARY KEY,
+            refcount INT NOT NULL DEFAULT 0
+        )
+    """)
+    # Count the files already referenced by existing rows
+    cur.execute("""
+        INSERT INTO file_refs (path, refcount)
+        SELECT CONCAT('products/', image), COUNT(*) FROM products
+        WHERE image IS NOT NULL AND image <> ''
+        GROUP BY image
+        ON DUPLICATE KEY UPDATE refcount = VALUES(refcount)
+    """)
+    cur.execute("""
+        INSERT INTO file_refs (path, refcount)
+        SELECT CONCAT('proofs/', proof_image), COUNT(*) FROM orders
+        WHERE proof_image IS NOT NULL AND proof_image <> ''
+        GROUP BY proof_image
+        ON DUPLICATE KEY UPDATE refcount = VALUES(refcount)
+    """)
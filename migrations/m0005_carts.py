@@ -0,0 +1,22 @@
+# Server-side carts (see carts.DbCartStore); one cart per customer
+
+
+def upgrade(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS carts (
+            id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            user_id INT NOT NULL,
+            item_count INT NOT NULL DEFAULT 0,
+            updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            UNIQUE KEY uq_carts_user (user_id)
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS cart_items (
+            cart_id INT NOT NULL,
+            product_id INT NOT NULL,
+            quantity INT NOT NULL,
+            added_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (cart_id, product_id)
+        )
+    """)
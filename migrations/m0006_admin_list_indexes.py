@@ -0,0 +1,16 @@
+# Indexes for the sortable / filterable admin tables (see admin_tables.py)
+from migrations import add_index
+
+INDEXES = [
+    # products: status filter + newest first, name sort and starts-with search
+    ('products', 'idx_products_status_id', ['status', 'id']),
+    ('products', 'idx_products_name', ['name']),
+    # users: name sort / search, status filter ordered by join date
+    ('users', 'idx_users_fullname', ['fullname']),
+    ('users', 'idx_users_status_created', ['status', 'created_at']),
+]
+
+
+def upgrade(cur):
+    for table, name, columns in INDEXES:
+        add_index(cur, table, name, columns)
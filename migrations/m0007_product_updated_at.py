@@ -0,0 +1,8 @@
+# products.updated_at versions cached product fragments (see fragments.py); microseconds so
+# two changes within the same second still get different stamps
+from migrations import add_column
+
+
+def upgrade(cur):
+    add_column(cur, 'products', 'updated_at',
+               'DATETIME(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6)')
@@ -0,0 +1,8 @@
+# Supplier SKU that bulk imports upsert on (see imports.py); NULL for products added by hand,
+# and a UNIQUE index allows any number of NULLs
+from migrations import add_column, add_index
+
+
+def upgrade(cur):
+    add_column(cur, 'products', 'sku', 'VARCHAR(64) NULL')
+    add_index(cur, 'products', 'uq_products_sku', ['sku'], unique=True)
@@ -0,0 +1,14 @@
+# Token buckets for RATE_LIMIT_BACKEND = 'db' (see ratelimit.DbBucketStore); updated_at is a Unix
+# timestamp from the app servers, indexed for pruning idle buckets
+from migrations import add_index
+
+
+def upgrade(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS rate_limits (
+            bucket VARCHAR(191) NOT NULL PRIMARY KEY,
+            tokens DOUBLE NOT NULL,
+            updated_at DOUBLE NOT NULL
+        )
+    """)
+    add_index(cur, 'rate_limits', 'idx_rate_limits_updated', ['updated_at'])
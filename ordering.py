@@ -0,0 +1,110 @@
+import time
+import random
+
+import MySQLdb
+
+import rollups
+from repositories import placeholders
+
+# MySQL error codes worth retrying: deadlock found, lock wait timeout exceeded
+RETRYABLE_ERRORS = (1213, 1205)
+
+
+class OutOfStock(Exception):
+    """Raised when some items no longer have enough stock; nothing was written"""
+
+    def __init__(self, shortfalls):
+        super().__init__('Insufficient stock for product(s) %s' % ', '.join(str(pid) for pid, _, _ in shortfalls))
+        self.shortfalls = shortfalls  # [(product_id, requested, available)]
+
+
+def place_order(connection, user_id, items, payment_method, statements=(), retries=3, backoff=0.05):
+    """Create an order for [(product, quantity)] in one transaction; returns the order id.
+
+    Stock is decremented for all items with a single conditional UPDATE
+    (stock >= quantity), so concurrent buyers can never oversell: if any row
+    falls short the whole transaction is rolled back and OutOfStock lists
+    the shortfalls. Deadlocks and lock wait timeouts are retried with jittered
+    exponential backoff. `statements` are further [(sql, params)] to commit
+    with the order, such as cart_clear_statements() for the ordered cart.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return _place_order(connection, user_id, items, payment_method, statements)
+        except OutOfStock:
+            connection.rollback()
+            raise
+        except MySQLdb.OperationalError as error:
+            connection.rollback()
+            if error.args[0] not in RETRYABLE_ERRORS or attempt == retries:
+                raise
+            time.sleep(backoff * (2 ** attempt) * (1 + random.random()))
+
+
+# Statements of _place_order(), shared with the ASGI mode (asyncdb.place_order_async)
+ORDER_INSERT = """
+    INSERT INTO orders (user_id, total_amount, payment_method, status)
+    VALUES (%s, %s, %s, 'Pending')
+"""
+# MySQLdb sends this as one multi-row INSERT
+ORDER_ITEM_INSERT = "INSERT INTO order_items (order_id, product_id, quantity) VALUES (%s, %s, %s)"
+
+
+def order_quantities(items):
+    """({product_id: total quantity}, order total) for [(product, quantity)]"""
+    quantities = {}
+    for product, qty in items:
+        quantities[product['id']] = quantities.get(product['id'], 0) + qty
+    return quantities, sum(product['price'] * qty for product, qty in items)
+
+
+def stock_update(quantities):
+    """(sql, params) taking every item's quantity off its stock in one statement.
+
+    Rows are locked in primary key order; a row without enough stock is left
+    alone, so a rowcount short of len(quantities) means nothing may be ordered.
+    """
+    product_ids = sorted(quantities)
+    case = ' '.join(['WHEN %s THEN %s'] * len(product_ids))
+    case_params = [value for pid in product_ids for value in (pid, quantities[pid])]
+    return """
+        UPDATE products
+        SET stock = stock - CASE id """ + case + """ END
+        WHERE id IN (""" + placeholders(product_ids) + """)
+          AND status = 'approved'
+          AND stock >= CASE id """ + case + """ END
+    """, case_params + product_ids + case_params
+
+
+def stock_check(quantities):
+    """(sql, params) reading what is available of each product after a short stock_update()"""
+    product_ids = sorted(quantities)
+    return "SELECT id, stock, status FROM products WHERE id IN (" + placeholders(product_ids) + ")", product_ids
+
+
+def out_of_stock(quantities, rows):
+    """OutOfStock for the stock_check() rows (dicts)"""
+    available = {row['id']: row['stock'] if row['status'] == 'approved' else 0 for row in rows}
+    return OutOfStock([(pid, quantities[pid], available.get(pid, 0))
+                       for pid in sorted(quantities) if available.get(pid, 0) < quantities[pid]])
+
+
+def _place_order(connection, user_id, items, payment_method, statements):
+    quantities, total = order_quantities(items)
+    cur = connection.cursor()
+    try:
+        # One statement for every item
+        cur.execute(*stock_update(quantities))
+        if cur.rowcount != len(quantities):
+            cur.execute(*stock_check(quantities))
+            raise out_of_stock(quantities, cur.fetchall())
+
+        cur.execute(ORDER_INSERT, (user_id, total, payment_method))
+        order_id = cur.lastrowid
+        cur.executemany(ORDER_ITEM_INSERT, [(order_id, pid, qty) for pid, qty in sorted(quantities.items())])
+        for sql, params in rollups.order_placed_statements(order_id) + list(statements):
+            cur.execute(sql, params)
+        connection.commit()
+        return order_id
+    finally:
+        cur.close()
@@ -0,0 +1,196 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from functools import wraps
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import request, make_response, current_app
+
+from cache import VersionedCache
+
+logger = logging.getLogger(__name__)
+
+
+class PageCache:
+    """Shared cache of whole rendered responses, keyed by the caller.
+
+    Entries live in an LRU memory tier and, when `disk_dir` is set, in files
+    other worker processes can read too. A response younger than `ttl` is
+    served as is; up to `stale_ttl` seconds after that it is still served
+    while a background request renders a fresh copy. invalidate() bumps a
+    version stamp shared by all processes, so older entries stop matching.
+    """
+
+    def __init__(self, name, ttl=60, stale_ttl=300, max_entries=500, disk_dir=None, stamp_dir='instance'):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.stats = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'refreshes': 0}
+        self._stamp = VersionedCache(name, stamp_dir=stamp_dir)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> entry dict
+        self._refreshing = set()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='page-cache')
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, hashlib.sha1(repr(key).encode()).hexdigest() + '.page')
+
+    def get(self, key):
+        """(entry, is_stale) for a usable entry, or (None, False)"""
+        version = self._stamp.version
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if (entry is None or entry['version'] != version) and self.disk_dir:
+            # Another process may have rendered it again since
+            entry = self._read(key)
+            if entry is not None and entry['version'] == version:
+                self._remember(key, entry)
+        if entry is None or entry['version'] != version:
+            return None, False
+        age = time.time() - entry['created']
+        if age >= self.ttl + self.stale_ttl:
+            return None, False
+        return entry, age >= self.ttl
+
+    def put(self, key, response, version=None):
+        entry = {
+            'body': response.get_data(),
+            'mimetype': response.mimetype,
+            'created': time.time(),
+            'version': self._stamp.version if version is None else version,
+        }
+        self._remember(key, entry)
+        if self.disk_dir:
+            self._write(key, entry)
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _read(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                header, body = f.read().split(b'\n', 1)
+        except (OSError, ValueError):
+            return None
+        entry = json.loads(header)
+        entry['body'] = body
+        return entry
+
+    def _write(self, key, entry):
+        header = json.dumps({k: v for k, v in entry.items() if k != 'body'}).encode()
+        path = self._path(key)
+        tmp_path = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(header + b'\n' + entry['body'])
+            os.replace(tmp_path, path)
+        except OSError:
+            logger.exception('Could not write page cache file %s', path)
+
+    def invalidate(self):
+        """Drop every cached page, in all processes.
+
+        Files on disk already stop matching with the new version; they are
+        removed in the background, off the caller's request.
+        """
+        self._stamp.invalidate()
+        with self._lock:
+            self._entries.clear()
+        if self.disk_dir:
+            self._executor.submit(self._remove_files, self._stamp.version)
+
+    def _remove_files(self, version):
+        for name in os.listdir(self.disk_dir):
+            if name.endswith('.page'):
+                path = os.path.join(self.disk_dir, name)
+                try:
+                    with open(path, 'rb') as f:
+                        header = json.loads(f.readline())
+                    # Keep pages already rendered again under the new version
+                    if header.get('version') != version:
+                        os.remove(path)
+                except (OSError, ValueError):
+                    pass  # another process got there first
+
+    def _refresh(self, app, key, path, view, args, kwargs):
+        try:
+            with app.test_request_context(path):
+                version = self._stamp.version
+                response = make_response(view(*args, **kwargs))
+                if response.status_code == 200:
+                    self.put(key, response, version)
+                    with self._lock:
+                        self.stats['refreshes'] += 1
+        except Exception:
+            logger.exception('Could not refresh cached page %s', path)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def hit(self, key, view, args=(), kwargs=None):
+        """The cached response for `key`, or None on a miss.
+
+        A stale entry is still returned; `view(*args, **kwargs)` then renders
+        a fresh copy in the background, in a request context of its own.
+        """
+        entry, stale = self.get(key)
+        if entry is None:
+            return None
+        if stale:
+            with self._lock:
+                self.stats['stale_hits'] += 1
+                start = key not in self._refreshing
+                self._refreshing.add(key)
+            if start:
+                self._executor.submit(self._refresh, current_app._get_current_object(), key,
+                                      request.full_path, view, args, kwargs or {})
+        else:
+            with self._lock:
+                self.stats['hits'] += 1
+        response = current_app.response_class(entry['body'], mimetype=entry['mimetype'])
+        response.headers['X-Cache'] = 'STALE' if stale else 'HIT'
+        return response
+
+    def miss(self):
+        """Count a miss; returns the version to store() the rendered response under.
+
+        The version is read before rendering so an invalidation during rendering is not papered over.
+        """
+        with self._lock:
+            self.stats['misses'] += 1
+        return self._stamp.version
+
+    def store(self, key, response, version):
+        if response.status_code == 200:
+            self.put(key, response, version)
+        response.headers['X-Cache'] = 'MISS'
+        return response
+
+    def cached(self, key_func):
+        """Decorator for views; key_func() returns the cache key, or None to bypass the cache"""
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                key = key_func()
+                if key is None:
+                    return view(*args, **kwargs)
+                response = self.hit(key, view, args, kwargs)
+                if response is None:
+                    version = self.miss()
+                    response = self.store(key, make_response(view(*args, **kwargs)), version)
+                return response
+            return wrapper
+        return decorator
@@ -0,0 +1,57 @@
+import json
+import math
+import base64
+import binascii
+
+DEFAULT_PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+
+
+def get_page_size(args, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    """Read ?per_page= from the request args, clamped to 1..maximum"""
+    size = args.get('per_page', default, type=int) or default
+    return max(1, min(size, maximum))
+
+
+def encode_cursor(values):
+    """Turn the sort-key values of the last row on a page into an opaque token"""
+    raw = json.dumps(list(values), default=str, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor(); returns None for a missing or tampered token"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (binascii.Error, ValueError):
+        return None
+    if not isinstance(values, list) or not all(_is_key_value(value) for value in values):
+        return None
+    return values
+
+
+def _is_key_value(value):
+    # Only scalars can stand in a sort key; JSON's NaN/Infinity cannot be sent to MySQL either
+    if isinstance(value, float):
+        return math.isfinite(value)
+    return value is None or isinstance(value, (str, int))
+
+
+def keyset_condition(columns, direction, values):
+    """Build the WHERE fragment that resumes right after the row holding `values`.
+
+    For columns ['p.price', 'p.id'] ascending this gives
+    (p.price > %s OR (p.price = %s AND p.id > %s)), which MySQL can answer
+    with a range scan on an index over those columns.
+    """
+    op = '>' if direction == 'ASC' else '<'
+    clauses = []
+    params = []
+    for i, column in enumerate(columns):
+        parts = ['%s = %%s' % c for c in columns[:i]] + ['%s %s %%s' % (column, op)]
+        clauses.append(' AND '.join(parts))
+        params.extend(values[:i + 1])
+    return '(' + ' OR '.join('(%s)' % c for c in clauses) + ')', params
@@ -0,0 +1,243 @@
+"""Admission control: token-bucket rate limits and a cap on requests in flight.
+
+A budget of (requests, per seconds) is a bucket holding up to `requests`
+tokens that refills at requests/per tokens a second; each admitted request
+spends one. Buckets live in a pluggable store:
+
+- MemoryBucketStore: this process only (tests, a single worker)
+- LocalBucketStore: a SQLite file shared by the worker processes on one host
+- DbBucketStore: the MySQL rate_limits table, shared by every host
+
+Checks run before the route does any work of its own, so a flood of logins
+or cart clicks is turned away without reaching MySQL (except through the
+'db' store's single-row update).
+"""
+import os
+import math
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict, defaultdict
+
+logger = logging.getLogger(__name__)
+
+# Rows untouched this long are deleted; longer than any budget takes to refill, so nothing is lost
+PRUNE_AFTER = 3600
+# Shared stores prune on one take in this many
+PRUNE_EVERY = 1000
+# Longer identities (say a pasted-in wall of text as the email) are keyed by their hash
+MAX_IDENTITY_LENGTH = 64
+
+
+def spend(tokens, updated_at, now, capacity, rate, cost=1):
+    """(tokens left, seconds until `cost` tokens are there) for a bucket last seen at `updated_at`.
+
+    The bucket refills first; a request that cannot be paid for leaves it untouched.
+    A negative `cost` gives tokens back, up to `capacity`.
+    """
+    tokens = min(capacity, tokens + max(0.0, now - updated_at) * rate)
+    if tokens >= cost:
+        return min(capacity, tokens - cost), 0.0
+    return tokens, (cost - tokens) / rate
+
+
+class MemoryBucketStore:
+    """Buckets in process memory, forgetting the least recently used beyond max_keys"""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at)
+
+    def take(self, key, capacity, rate, cost=1):
+        """Spend `cost` tokens; returns 0 or the seconds to wait before retrying"""
+        now = time.time()
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (capacity, now))
+            tokens, retry_after = spend(tokens, updated_at, now, capacity, rate, cost)
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return retry_after
+
+
+class LocalBucketStore:
+    """Buckets in a SQLite file, so every worker process on this host draws from the same budget"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS rate_limits (
+            bucket TEXT NOT NULL PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._local = threading.local()
+        self._takes = 0
+
+    def _connection(self):
+        conn = getattr(self._local, 'connection', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=2, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(self.SCHEMA)
+            self._local.connection = conn
+        return conn
+
+    def take(self, key, capacity, rate, cost=1):
+        conn = self._connection()
+        now = time.time()
+        # IMMEDIATE takes the write lock up front, so read-modify-write is atomic across processes
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tokens, updated_at FROM rate_limits WHERE bucket = ?', (key,)).fetchone()
+            tokens, retry_after = spend(*(row or (capacity, now)), now, capacity, rate, cost)
+            conn.execute('INSERT OR REPLACE INTO rate_limits (bucket, tokens, updated_at) VALUES (?, ?, ?)',
+                         (key, tokens, now))
+            self._takes += 1
+            if self._takes % PRUNE_EVERY == 0:
+                conn.execute('DELETE FROM rate_limits WHERE updated_at < ?', (now - PRUNE_AFTER,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return retry_after
+
+
+class DbBucketStore:
+    """Buckets in the MySQL rate_limits table (migration m0009), shared by all hosts.
+
+    Each take is one short transaction on a connection of its own from
+    `pool`, never the request's, so committing it cannot commit the route's
+    work along with it.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self._takes = 0
+
+    def take(self, key, capacity, rate, cost=1):
+        conn = self.pool.acquire()
+        now = time.time()
+        try:
+            cur = conn.cursor()
+            cur.execute("INSERT IGNORE INTO rate_limits (bucket, tokens, updated_at) VALUES (%s, %s, %s)",
+                        (key, capacity, now))
+            cur.execute("SELECT tokens, updated_at FROM rate_limits WHERE bucket = %s FOR UPDATE", (key,))
+            row = cur.fetchone()
+            tokens, retry_after = spend(row['tokens'], row['updated_at'], now, capacity, rate, cost)
+            cur.execute("UPDATE rate_limits SET tokens = %s, updated_at = %s WHERE bucket = %s", (tokens, now, key))
+            self._takes += 1
+            if self._takes % PRUNE_EVERY == 0:
+                cur.execute("DELETE FROM rate_limits WHERE updated_at < %s", (now - PRUNE_AFTER,))
+            cur.close()
+            conn.commit()
+        finally:
+            # release() rolls back whatever did not get committed
+            self.pool.release(conn)
+        return retry_after
+
+
+def create_bucket_store(backend, pool=None, path=None):
+    """Build the bucket store named by config RATE_LIMIT_BACKEND ('memory', 'local' or 'db')"""
+    if backend == 'memory':
+        return MemoryBucketStore()
+    if backend == 'local':
+        return LocalBucketStore(path)
+    if backend == 'db':
+        return DbBucketStore(pool)
+    raise ValueError('Unknown RATE_LIMIT_BACKEND %r' % backend)
+
+
+class RateLimiter:
+    """Per-route token buckets keyed by client IP and by account.
+
+    `limits` maps a budget name, or a route's endpoint to override its
+    budget, to {'ip': (requests, per seconds), 'account': (...)}. Every
+    route has buckets of its own, and a request only spends from them if
+    all of them admit it. If the store fails the request is let through: a
+    broken limiter must not take the shop down with it.
+
+    The 'ip' key is whatever the caller passes, normally request.remote_addr;
+    behind a reverse proxy that is the proxy's address unless the app is set
+    up to read X-Forwarded-For (config PROXY_FIX_X_FOR).
+    """
+
+    def __init__(self, store, limits, enabled=True):
+        self.store = store
+        self.limits = limits
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.rejected = defaultdict(int)  # (budget, key kind) -> requests turned away
+        self.errors = 0
+
+    def check(self, route, budget, identities):
+        """0 if the request may go ahead, else whole seconds until it may be retried.
+
+        `identities` is [(key kind, value)]; a None value skips that bucket.
+        """
+        if not self.enabled:
+            return 0
+        limits = self.limits.get(route) or self.limits.get(budget) or {}
+        taken = []  # (key, capacity, rate) of the buckets this request has spent from
+        for kind, identity in identities:
+            if identity is None or kind not in limits:
+                continue
+            requests, per = limits[kind]
+            identity = str(identity)
+            if len(identity) > MAX_IDENTITY_LENGTH:
+                identity = hashlib.sha1(identity.encode('utf-8')).hexdigest()
+            bucket = ('%s:%s:%s' % (route, kind, identity), requests, requests / per)
+            try:
+                retry_after = self.store.take(*bucket)
+            except Exception:
+                logger.exception('Rate limit store failed; letting the request through')
+                with self._lock:
+                    self.errors += 1
+                return 0
+            if retry_after:
+                # A locked-out account must not also drain its IP's budget (or the other way round)
+                self._refund(taken)
+                with self._lock:
+                    self.rejected[(budget, kind)] += 1
+                return max(1, math.ceil(retry_after))
+            taken.append(bucket)
+        return 0
+
+    def _refund(self, buckets):
+        """Give back the token a turned-away request spent from each bucket"""
+        for bucket in buckets:
+            try:
+                self.store.take(*bucket, cost=-1)
+            except Exception:
+                logger.exception('Rate limit store failed to refund a token')
+                with self._lock:
+                    self.errors += 1
+
+
+class ConcurrencyLimit:
+    """Caps the requests this process works on at once; the rest are shed immediately
+    instead of queueing for a thread or a DB connection."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.shed = 0
+
+    def try_enter(self):
+        with self._lock:
+            if self.limit is not None and self.in_flight >= self.limit:
+                self.shed += 1
+                return False
+            self.in_flight += 1
+            return True
+
+    def leave(self):
+        with self._lock:
+            self.in_flight -= 1
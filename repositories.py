@@ -0,0 +1,567 @@
+"""Data access for the routes: one repository per table, one method per use case.
+
+Each statement selects only the columns its caller uses and is written out
+once at import time, so every call sends the same text with bound params.
+Rows come back as compact namedtuples instead of dicts; they also answer
+row['column'] and row.get('column') so code written for DictCursor rows keeps
+working. Large results are streamed from an unbuffered server-side cursor.
+
+Writes never commit: the caller commits once the whole change is made.
+"""
+from collections import namedtuple
+
+import MySQLdb.cursors
+
+import rollups
+from metrics import instrument_cursor_class
+
+# Plain tuple cursors, timed like the connection's default DictCursor
+TupleCursor = instrument_cursor_class(MySQLdb.cursors.Cursor)
+StreamingCursor = instrument_cursor_class(MySQLdb.cursors.SSCursor, streaming=True)
+
+STREAM_BATCH_SIZE = 1000
+
+
+def _getitem(self, key):
+    if isinstance(key, str):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+    return tuple.__getitem__(self, key)
+
+
+def _get(self, key, default=None):
+    return getattr(self, key, default)
+
+
+def row_type(name, columns):
+    """A namedtuple class for `columns` that can also be indexed by column name"""
+    return type(name, (namedtuple(name, columns),), {'__slots__': (), '__getitem__': _getitem, 'get': _get})
+
+
+def placeholders(values):
+    return ', '.join(['%s'] * len(values))
+
+
+def where_clause(conditions):
+    return ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+
+
+# For existence checks
+RowId = row_type('RowId', 'id')
+
+
+class Repository:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def _one(self, row, sql, params=None):
+        cur = self.connection.cursor(TupleCursor)
+        try:
+            cur.execute(sql, params)
+            values = cur.fetchone()
+        finally:
+            cur.close()
+        return row._make(values) if values else None
+
+    def _all(self, row, sql, params=None):
+        cur = self.connection.cursor(TupleCursor)
+        try:
+            cur.execute(sql, params)
+            return [row._make(values) for values in cur.fetchall()]
+        finally:
+            cur.close()
+
+    def _stream(self, row, sql, params=None):
+        """Yield rows as MySQL sends them; the connection is busy until the generator is exhausted or closed"""
+        cur = self.connection.cursor(StreamingCursor)
+        try:
+            cur.execute(sql, params)
+            while True:
+                batch = cur.fetchmany(STREAM_BATCH_SIZE)
+                if not batch:
+                    break
+                for values in batch:
+                    yield row._make(values)
+        finally:
+            cur.close()
+
+    def _write(self, sql, params=None):
+        """Run an INSERT/UPDATE/DELETE; returns (rowcount, lastrowid)"""
+        cur = self.connection.cursor(TupleCursor)
+        try:
+            cur.execute(sql, params)
+            return cur.rowcount, cur.lastrowid
+        finally:
+            cur.close()
+
+    def _rollup(self, record, *args):
+        # rollups.* expect the connection's DictCursor
+        cur = self.connection.cursor()
+        try:
+            record(cur, *args)
+        finally:
+            cur.close()
+
+
+# ====================== CATEGORIES ======================
+
+Category = row_type('Category', 'id name')
+
+CATEGORIES_ALL = "SELECT id, name FROM categories"
+CATEGORY_INSERT = "INSERT INTO categories (name) VALUES (%s)"
+
+
+class CategoryRepository(Repository):
+    def all(self):
+        return self._all(Category, CATEGORIES_ALL)
+
+    def create(self, name):
+        return self._write(CATEGORY_INSERT, (name,))[1]
+
+
+# ====================== USERS ======================
+
+UserName = row_type('UserName', 'id fullname')
+MonthlySignups = row_type('MonthlySignups', 'month count')
+UserExport = row_type('UserExport', 'id fullname email status created_at')
+
+USER_EMAIL_TAKEN = "SELECT id FROM users WHERE email = %s LIMIT 1"
+USER_LOGIN = "SELECT id, fullname FROM users WHERE email = %s AND password = %s AND status = 'active'"
+USER_NAME = "SELECT id, fullname FROM users WHERE id = %s"
+USER_INSERT = "INSERT INTO users (fullname, email, password, status) VALUES (%s, %s, %s, 'active')"
+USER_TOGGLE_STATUS = "UPDATE users SET status = IF(status='active', 'inactive', 'active') WHERE id = %s"
+USER_SET_PASSWORD = "UPDATE users SET password = %s WHERE id = %s"
+SIGNUPS_BY_MONTH = """
+    SELECT MONTH(day) as month, SUM(signups) as count
+    FROM signups_daily
+    WHERE day >= %s AND day < %s
+    GROUP BY MONTH(day)
+"""
+# Never the password; join date order follows idx_users_created_at
+USER_EXPORT = "SELECT u.id, u.fullname, u.email, u.status, u.created_at FROM users u"
+USER_EXPORT_ORDER = " ORDER BY u.created_at, u.id"
+
+
+class UserRepository(Repository):
+    def email_taken(self, email):
+        return self._one(RowId, USER_EMAIL_TAKEN, (email,)) is not None
+
+    def login(self, email, password):
+        """The active user with these credentials, or None"""
+        return self._one(UserName, USER_LOGIN, (email, password))
+
+    def name(self, user_id):
+        return self._one(UserName, USER_NAME, (user_id,))
+
+    def create(self, fullname, email, password):
+        user_id = self._write(USER_INSERT, (fullname, email, password))[1]
+        self._rollup(rollups.record_signup)
+        return user_id
+
+    def toggle_status(self, user_id):
+        return self._write(USER_TOGGLE_STATUS, (user_id,))[0]
+
+    def set_password(self, user_id, password):
+        return self._write(USER_SET_PASSWORD, (password, user_id))[0]
+
+    def signups_by_month(self, start, end):
+        return self._all(MonthlySignups, SIGNUPS_BY_MONTH, (start, end))
+
+    def export(self, conditions=(), params=()):
+        """Stream all users matching the SQL `conditions` on users u"""
+        return self._stream(UserExport, USER_EXPORT + where_clause(conditions) + USER_EXPORT_ORDER, list(params))
+
+
+# ====================== PRODUCTS ======================
+
+SearchDocument = row_type('SearchDocument', 'id name description status')
+CatalogProduct = row_type('CatalogProduct', 'id name description price stock image updated_at category_name')
+CartProduct = row_type('CartProduct', 'id name description price stock image status category_id')
+EditableProduct = row_type('EditableProduct', 'id name description price stock category_id image')
+Suggestion = row_type('Suggestion', 'id name price stock status decline_reason image category_name')
+ProductImage = row_type('ProductImage', 'id image')
+SkuImage = row_type('SkuImage', 'sku image')
+ProductStock = row_type('ProductStock', 'id stock')
+SuggestionDocument = row_type('SuggestionDocument', 'id name category_id popularity')
+
+PRODUCT_SEARCH_DOCUMENTS = "SELECT id, name, description, status FROM products WHERE status = 'approved'"
+# Popularity is units ordered, summed once per product before the join
+PRODUCT_SUGGESTION_DOCUMENTS = """
+    SELECT p.id, p.name, p.category_id, COALESCE(ordered.units, 0) AS popularity
+    FROM products p
+    LEFT JOIN (SELECT product_id, SUM(quantity) AS units FROM order_items GROUP BY product_id) ordered
+        ON ordered.product_id = p.id
+    WHERE p.status = 'approved'
+"""
+PRODUCT_SEARCH_DOCUMENT = "SELECT id, name, description, status FROM products WHERE id = %s"
+PRODUCT_AVAILABLE = "SELECT id FROM products WHERE id = %s AND stock > 0 AND status = 'approved'"
+# Descriptions are only shown truncated in the cart, so they are clipped in SQL
+PRODUCTS_BY_IDS = """
+    SELECT id, name, LEFT(description, 200) as description, price, stock, image, status, category_id
+    FROM products WHERE id IN (%s)
+"""
+# Only the columns the catalog cards render; long descriptions are clipped in SQL
+CATALOG_SELECT = """
+    SELECT p.id, p.name, LEFT(p.description, 300) as description, p.price, p.stock, p.image,
+           p.updated_at, c.name as category_name
+    FROM products p
+    LEFT JOIN categories c ON p.category_id = c.id
+    WHERE p.stock > 0 AND p.status = 'approved'
+"""
+PRODUCT_FOR_EDIT = "SELECT id, name, description, price, stock, category_id, image FROM products WHERE id = %s"
+SUGGESTION_FOR_EDIT = PRODUCT_FOR_EDIT + " AND suggested_by = %s"
+SUGGESTIONS_BY_USER = """
+    SELECT p.id, p.name, p.price, p.stock, p.status, p.decline_reason, p.image, c.name as category_name
+    FROM products p
+    LEFT JOIN categories c ON p.category_id = c.id
+    WHERE p.suggested_by = %s
+    ORDER BY p.id DESC
+"""
+PRODUCT_IMAGE = "SELECT id, image FROM products WHERE id = %s"
+SUGGESTION_IMAGE = PRODUCT_IMAGE + " AND suggested_by = %s"
+PRODUCT_IMAGES = "SELECT id, image FROM products WHERE image IS NOT NULL AND image <> ''"
+PRODUCT_INSERT = """
+    INSERT INTO products
+    (name, description, price, stock, category_id, image, status, suggested_by)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+"""
+PRODUCT_UPDATE = """
+    UPDATE products
+    SET name = %s, description = %s, price = %s, stock = %s, category_id = %s, image = %s
+    WHERE id = %s
+"""
+# Edited suggestions go back to the admin for review
+SUGGESTION_UPDATE = """
+    UPDATE products
+    SET name = %s, description = %s, price = %s, stock = %s, category_id = %s, image = %s, status = 'pending'
+    WHERE id = %s
+"""
+PRODUCT_IMAGES_BY_SKU = "SELECT sku, image FROM products WHERE sku IN (%s)"
+# Bulk import: one multi-row statement per batch; an existing sku keeps its image unless a new one is given
+PRODUCT_UPSERT = """
+    INSERT INTO products (sku, name, description, price, stock, category_id, image, status)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE name = VALUES(name), description = VALUES(description), price = VALUES(price),
+        stock = VALUES(stock), category_id = VALUES(category_id), image = COALESCE(VALUES(image), image)
+"""
+PRODUCT_APPROVE = "UPDATE products SET status = 'approved', decline_reason = NULL WHERE id = %s"
+PRODUCT_DECLINE = "UPDATE products SET status = 'declined', decline_reason = %s WHERE id = %s"
+PRODUCT_DELETE = "DELETE FROM products WHERE id = %s"
+PRODUCT_RESTOCK = "UPDATE products SET stock = stock + %s WHERE id = %s"
+PRODUCT_STOCK = "SELECT id, stock FROM products WHERE id IN (%s)"
+
+
+def catalog_query(product_ids=None, category_id=None, order=None, after=None, limit=None):
+    """(sql, params) for catalog cards.
+
+    `product_ids` restricts to search hits, `order` is (columns, direction)
+    and `after` a keyset condition with its params from keyset_condition().
+    """
+    sql = CATALOG_SELECT
+    params = []
+    if product_ids:
+        sql += " AND p.id IN (%s)" % placeholders(product_ids)
+        params.extend(product_ids)
+    if category_id:
+        sql += " AND p.category_id = %s"
+        params.append(category_id)
+    if after:
+        sql += " AND " + after[0]
+        params.extend(after[1])
+    if order:
+        columns, direction = order
+        sql += " ORDER BY " + ', '.join('%s %s' % (c, direction) for c in columns)
+    if limit:
+        sql += " LIMIT %s"
+        params.append(limit)
+    return sql, params
+
+
+class ProductRepository(Repository):
+    def search_documents(self):
+        """Stream every approved product for a full search index rebuild"""
+        return self._stream(SearchDocument, PRODUCT_SEARCH_DOCUMENTS)
+
+    def suggestion_documents(self):
+        return self._stream(SuggestionDocument, PRODUCT_SUGGESTION_DOCUMENTS)
+
+    def search_document(self, product_id):
+        return self._one(SearchDocument, PRODUCT_SEARCH_DOCUMENT, (product_id,))
+
+    def is_available(self, product_id):
+        return self._one(RowId, PRODUCT_AVAILABLE, (product_id,)) is not None
+
+    def by_ids(self, product_ids):
+        """Cart and checkout rows for these ids, in no particular order"""
+        if not product_ids:
+            return []
+        return self._all(CartProduct, PRODUCTS_BY_IDS % placeholders(product_ids), list(product_ids))
+
+    def catalog(self, product_ids=None, category_id=None, order=None, after=None, limit=None):
+        """Approved, in-stock catalog cards; see catalog_query()"""
+        return self._all(CatalogProduct, *catalog_query(product_ids, category_id, order, after, limit))
+
+    def for_edit(self, product_id):
+        return self._one(EditableProduct, PRODUCT_FOR_EDIT, (product_id,))
+
+    def suggestion_for_edit(self, product_id, user_id):
+        return self._one(EditableProduct, SUGGESTION_FOR_EDIT, (product_id, user_id))
+
+    def suggestions_by(self, user_id):
+        return self._all(Suggestion, SUGGESTIONS_BY_USER, (user_id,))
+
+    def image(self, product_id, suggested_by=None):
+        """(id, image) of the product, or None if missing (or not suggested by `suggested_by`)"""
+        if suggested_by is None:
+            return self._one(ProductImage, PRODUCT_IMAGE, (product_id,))
+        return self._one(ProductImage, SUGGESTION_IMAGE, (product_id, suggested_by))
+
+    def images(self):
+        """Stream (id, image) of every product with an image"""
+        return self._stream(ProductImage, PRODUCT_IMAGES)
+
+    def images_by_sku(self, skus):
+        """{sku: image} for the skus that exist"""
+        if not skus:
+            return {}
+        skus = list(skus)
+        return {row.sku: row.image for row in self._all(SkuImage, PRODUCT_IMAGES_BY_SKU % placeholders(skus), skus)}
+
+    def upsert_many(self, rows, created):
+        """Insert or update [(sku, name, description, price, stock, category_id, image)] as approved products.
+
+        `created` is how many of them are new, for the products counter.
+        """
+        if not rows:
+            return
+        cur = self.connection.cursor(TupleCursor)
+        try:
+            # MySQLdb sends these as a single multi-row INSERT
+            cur.executemany(PRODUCT_UPSERT, [row + ('approved',) for row in rows])
+        finally:
+            cur.close()
+        if created:
+            self._rollup(rollups.record_products_changed, created)
+
+    def create(self, name, description, price, stock, category_id, image, status='approved', suggested_by=None):
+        product_id = self._write(PRODUCT_INSERT, (name, description, price, stock, category_id, image,
+                                                  status, suggested_by))[1]
+        self._rollup(rollups.record_products_changed, 1)
+        return product_id
+
+    def update(self, product_id, name, description, price, stock, category_id, image, resubmit=False):
+        sql = SUGGESTION_UPDATE if resubmit else PRODUCT_UPDATE
+        return self._write(sql, (name, description, price, stock, category_id, image, product_id))[0]
+
+    def approve(self, product_id):
+        return self._write(PRODUCT_APPROVE, (product_id,))[0]
+
+    def decline(self, product_id, reason):
+        return self._write(PRODUCT_DECLINE, (reason, product_id))[0]
+
+    def delete(self, product_id):
+        deleted = self._write(PRODUCT_DELETE, (product_id,))[0]
+        if deleted:
+            self._rollup(rollups.record_products_changed, -deleted)
+        return deleted
+
+    def stock_levels(self, product_ids):
+        """{product_id: stock} for these ids"""
+        if not product_ids:
+            return {}
+        product_ids = list(product_ids)
+        return {row.id: row.stock for row in self._all(ProductStock, PRODUCT_STOCK % placeholders(product_ids), product_ids)}
+
+    def restock(self, quantities):
+        """Put [(product_id, quantity)] back on the shelf"""
+        cur = self.connection.cursor(TupleCursor)
+        try:
+            cur.executemany(PRODUCT_RESTOCK, [(qty, pid) for pid, qty in quantities])
+        finally:
+            cur.close()
+
+
+# ====================== ORDERS ======================
+
+OrderSummary = row_type('OrderSummary', 'id order_date total_amount status proof_image items')
+OrderItemSummary = row_type('OrderItemSummary', 'order_id quantity product_name image')
+OrderItem = row_type('OrderItem', 'product_id quantity')
+OrderState = row_type('OrderState', 'id status order_date total_amount')
+OrderProof = row_type('OrderProof', 'id proof_image')
+DailySales = row_type('DailySales', 'date sales')
+WeeklySales = row_type('WeeklySales', 'week sales')
+MonthlySales = row_type('MonthlySales', 'month sales')
+OrderExport = row_type('OrderExport', 'id order_date user_id customer_name email payment_method status '
+                                      'total_amount product_id product_name quantity')
+DailySalesExport = row_type('DailySalesExport', 'date order_count sales')
+WeeklySalesExport = row_type('WeeklySalesExport', 'week order_count sales')
+MonthlySalesExport = row_type('MonthlySalesExport', 'month order_count sales')
+ORDER_EXPORT_ITEM_FIELDS = ('product_id', 'product_name', 'quantity')
+
+# Newest first; keyset on (order_date, id) uses idx_orders_user_date
+ORDER_HISTORY = "SELECT o.id, o.order_date, o.total_amount, o.status, o.proof_image FROM orders o WHERE o.user_id = %s"
+ORDER_HISTORY_ITEMS = """
+    SELECT oi.order_id, oi.quantity, p.name AS product_name, p.image
+    FROM order_items oi
+    LEFT JOIN products p ON oi.product_id = p.id
+    WHERE oi.order_id IN (%s)
+    ORDER BY oi.id
+"""
+ORDER_ITEMS = "SELECT product_id, quantity FROM order_items WHERE order_id = %s"
+ORDER_OF_USER = "SELECT id, status, order_date, total_amount FROM orders WHERE id = %s AND user_id = %s"
+ORDER_FOR_UPDATE = "SELECT id, status, order_date, total_amount FROM orders WHERE id = %s FOR UPDATE"
+ORDER_PROOF = "SELECT id, proof_image FROM orders WHERE id = %s AND user_id = %s"
+ORDER_SET_PROOF = "UPDATE orders SET proof_image = %s WHERE id = %s"
+ORDER_SET_STATUS = "UPDATE orders SET status = %s WHERE id = %s"
+ORDER_SET_STATUS_NOTE = "UPDATE orders SET status = %s, admin_note = %s WHERE id = %s"
+# Read from the daily rollup; weeks and months are keyed with their year
+SALES_DAILY = "SELECT day as date, sales FROM sales_daily WHERE sales <> 0 ORDER BY day"
+SALES_WEEKLY = """
+    SELECT DATE_FORMAT(MIN(day), '%x-W%v') as week, SUM(sales) as sales FROM sales_daily
+    GROUP BY YEARWEEK(day, 3) HAVING SUM(sales) <> 0 ORDER BY YEARWEEK(day, 3)
+"""
+SALES_MONTHLY = """
+    SELECT DATE_FORMAT(MIN(day), '%Y-%m') as month, SUM(sales) as sales FROM sales_daily
+    GROUP BY YEAR(day), MONTH(day) HAVING SUM(sales) <> 0 ORDER BY YEAR(day), MONTH(day)
+"""
+SALES_BY_MONTH = """
+    SELECT MONTH(day) as month, SUM(sales) as sales
+    FROM sales_daily
+    WHERE day >= %s AND day < %s
+    GROUP BY MONTH(day)
+"""
+# One row per order item (an order without items gets one row of NULLs). Ordered on
+# idx_orders_date, whose (order_date, id) keeps each order's item rows together.
+ORDER_EXPORT = """
+    SELECT o.id, o.order_date, o.user_id, u.fullname AS customer_name, u.email, o.payment_method, o.status,
+        o.total_amount, oi.product_id, p.name AS product_name, oi.quantity
+    FROM orders o
+    JOIN users u ON o.user_id = u.id
+    LEFT JOIN order_items oi ON oi.order_id = o.id
+    LEFT JOIN products p ON oi.product_id = p.id
+"""
+ORDER_EXPORT_ORDER = " ORDER BY o.order_date, o.id"
+# (row, select, grouping) per period; always run with params, hence the %% escapes
+SALES_EXPORTS = {
+    'daily': (DailySalesExport,
+              "SELECT day AS date, order_count, sales FROM sales_daily",
+              " ORDER BY day"),
+    'weekly': (WeeklySalesExport,
+               "SELECT DATE_FORMAT(MIN(day), '%%x-W%%v') AS week, SUM(order_count), SUM(sales) FROM sales_daily",
+               " GROUP BY YEARWEEK(day, 3) ORDER BY YEARWEEK(day, 3)"),
+    'monthly': (MonthlySalesExport,
+                "SELECT DATE_FORMAT(MIN(day), '%%Y-%%m') AS month, SUM(order_count), SUM(sales) FROM sales_daily",
+                " GROUP BY YEAR(day), MONTH(day) ORDER BY YEAR(day), MONTH(day)"),
+}
+SALES_REPORTS = {
+    'daily': (DailySales, SALES_DAILY),
+    'weekly': (WeeklySales, SALES_WEEKLY),
+    'monthly': (MonthlySales, SALES_MONTHLY),
+}
+
+
+def order_history_query(user_id, per_page, after=None):
+    """(sql, params) for a page of order history plus one row to tell whether there is more"""
+    sql = ORDER_HISTORY
+    params = [user_id]
+    if after:
+        sql += " AND " + after[0]
+        params.extend(after[1])
+    sql += " ORDER BY o.order_date DESC, o.id DESC LIMIT %s"
+    params.append(per_page + 1)
+    return sql, params
+
+
+class OrderHistoryPage:
+    """Assembles OrderSummary rows from the order_history_query() rows and their items' rows"""
+
+    def __init__(self, rows, per_page):
+        self.has_more = len(rows) > per_page
+        self.rows = rows[:per_page]
+        self.items = {values[0]: [] for values in self.rows}
+
+    @property
+    def order_ids(self):
+        return list(self.items)
+
+    def items_query(self):
+        return ORDER_HISTORY_ITEMS % placeholders(self.items), self.order_ids
+
+    def add_items(self, rows):
+        for values in rows:
+            self.items[values[0]].append(OrderItemSummary._make(values))
+
+    def result(self):
+        """(orders, has_more)"""
+        return [OrderSummary._make(tuple(values) + (self.items[values[0]],)) for values in self.rows], self.has_more
+
+
+class OrderRepository(Repository):
+    def history(self, user_id, per_page, after=None):
+        """A page of the customer's orders, newest first, each with its items; returns (orders, has_more).
+
+        `after` is a keyset condition on (o.order_date, o.id) from keyset_condition().
+        Two queries per page: the orders, then the items of just those orders.
+        """
+        cur = self.connection.cursor(TupleCursor)
+        try:
+            cur.execute(*order_history_query(user_id, per_page, after))
+            page = OrderHistoryPage(cur.fetchall(), per_page)
+            if page.order_ids:
+                cur.execute(*page.items_query())
+                page.add_items(cur.fetchall())
+        finally:
+            cur.close()
+        return page.result()
+
+    def of_user(self, order_id, user_id):
+        return self._one(OrderState, ORDER_OF_USER, (order_id, user_id))
+
+    def lock(self, order_id):
+        """Status, date and amount of the order, row-locked until commit"""
+        return self._one(OrderState, ORDER_FOR_UPDATE, (order_id,))
+
+    def proof(self, order_id, user_id):
+        return self._one(OrderProof, ORDER_PROOF, (order_id, user_id))
+
+    def set_proof(self, order_id, filename):
+        return self._write(ORDER_SET_PROOF, (filename, order_id))[0]
+
+    def items(self, order_id):
+        return self._all(OrderItem, ORDER_ITEMS, (order_id,))
+
+    def set_status(self, order, status, note=None):
+        """Change an OrderState's status, keeping the sales rollups in step"""
+        if note is None:
+            self._write(ORDER_SET_STATUS, (status, order.id))
+        else:
+            self._write(ORDER_SET_STATUS_NOTE, (status, note, order.id))
+        self._rollup(rollups.record_status_change, order, status)
+
+    def sales_report(self, period):
+        row, sql = SALES_REPORTS.get(period, SALES_REPORTS['monthly'])
+        return self._all(row, sql)
+
+    def sales_by_month(self, start, end):
+        return self._all(MonthlySales, SALES_BY_MONTH, (start, end))
+
+    def export(self, conditions=(), params=()):
+        """Stream orders matching the SQL `conditions` on orders o, one OrderExport per item"""
+        return self._stream(OrderExport, ORDER_EXPORT + where_clause(conditions) + ORDER_EXPORT_ORDER, list(params))
+
+    def sales_export(self, period, conditions=(), params=()):
+        """Stream sales per day, week or month from the daily rollup; `conditions` are on its `day` column"""
+        row, select, grouping = SALES_EXPORTS[period]
+        return self._stream(row, select + where_clause(conditions) + grouping, list(params))
+
+
+class Repositories:
+    """All repositories on one connection"""
+
+    def __init__(self, connection):
+        self.categories = CategoryRepository(connection)
+        self.users = UserRepository(connection)
+        self.products = ProductRepository(connection)
+        self.orders = OrderRepository(connection)
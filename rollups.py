@@ -0,0 +1,128 @@
+"""Pre-aggregated sales/signup tables read by the admin dashboard and sales report.
+
+Every function takes the caller's cursor (or returns the statements for the
+caller to run) and does not commit, so rollup updates land in the same
+transaction as the order/user/product change that caused them. rebuild()
+recomputes everything from the base tables.
+"""
+
+# Orders in these statuses count towards sales figures
+SALES_STATUSES = ('Shipped', 'Delivered')
+
+TABLES = [
+    """
+    CREATE TABLE IF NOT EXISTS sales_daily (
+        day DATE NOT NULL PRIMARY KEY,
+        order_count INT NOT NULL DEFAULT 0,
+        sales DECIMAL(14, 2) NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS signups_daily (
+        day DATE NOT NULL PRIMARY KEY,
+        signups INT NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS stats_counters (
+        name VARCHAR(32) NOT NULL PRIMARY KEY,
+        value DECIMAL(16, 2) NOT NULL DEFAULT 0
+    )
+    """,
+]
+
+
+def ensure_tables(cur):
+    for ddl in TABLES:
+        cur.execute(ddl)
+
+
+COUNTER_BUMP = """
+    INSERT INTO stats_counters (name, value) VALUES (%s, %s)
+    ON DUPLICATE KEY UPDATE value = value + VALUES(value)
+"""
+ORDER_PLACED = """
+    INSERT INTO sales_daily (day, order_count, sales)
+    SELECT DATE(order_date), 1, 0 FROM orders WHERE id = %s
+    ON DUPLICATE KEY UPDATE order_count = order_count + 1
+"""
+
+
+def bump_counter(cur, name, delta):
+    cur.execute(COUNTER_BUMP, (name, delta))
+
+
+def record_signup(cur):
+    cur.execute("""
+        INSERT INTO signups_daily (day, signups) VALUES (CURDATE(), 1)
+        ON DUPLICATE KEY UPDATE signups = signups + 1
+    """)
+    bump_counter(cur, 'users', 1)
+
+
+def order_placed_statements(order_id):
+    """[(sql, params)] counting a new order, run by ordering.place_order() and its async twin"""
+    return [(ORDER_PLACED, (order_id,)), (COUNTER_BUMP, ('orders', 1))]
+
+
+def record_status_change(cur, order, new_status):
+    """Move an order's amount in or out of sales when its status changes.
+
+    `order` needs order_date, total_amount and the status it had before the change.
+    """
+    was_sale = order['status'] in SALES_STATUSES
+    is_sale = new_status in SALES_STATUSES
+    if was_sale == is_sale:
+        return
+    amount = order['total_amount'] if is_sale else -order['total_amount']
+    cur.execute("""
+        INSERT INTO sales_daily (day, order_count, sales) VALUES (DATE(%s), 0, %s)
+        ON DUPLICATE KEY UPDATE sales = sales + VALUES(sales)
+    """, (order['order_date'], amount))
+    bump_counter(cur, 'sales', amount)
+
+
+def record_products_changed(cur, delta):
+    bump_counter(cur, 'products', delta)
+
+
+COUNTERS_SELECT = "SELECT name, value FROM stats_counters"
+
+
+def counters_from_rows(rows):
+    """The dashboard totals from the COUNTERS_SELECT rows (dicts)"""
+    counters = {'users': 0, 'orders': 0, 'products': 0, 'sales': 0}
+    for row in rows:
+        counters[row['name']] = row['value'] if row['name'] == 'sales' else int(row['value'])
+    return counters
+
+
+def read_counters(cur):
+    cur.execute(COUNTERS_SELECT)
+    return counters_from_rows(cur.fetchall())
+
+
+def rebuild(cur):
+    """Recompute every rollup from the base tables (backfill / repair)"""
+    ensure_tables(cur)
+    cur.execute("DELETE FROM sales_daily")
+    cur.execute("""
+        INSERT INTO sales_daily (day, order_count, sales)
+        SELECT DATE(order_date), COUNT(*),
+               COALESCE(SUM(CASE WHEN status IN ('Shipped', 'Delivered') THEN total_amount END), 0)
+        FROM orders
+        GROUP BY DATE(order_date)
+    """)
+    cur.execute("DELETE FROM signups_daily")
+    cur.execute("""
+        INSERT INTO signups_daily (day, signups)
+        SELECT DATE(created_at), COUNT(*) FROM users GROUP BY DATE(created_at)
+    """)
+    cur.execute("DELETE FROM stats_counters")
+    cur.execute("""
+        INSERT INTO stats_counters (name, value)
+        SELECT 'users', COUNT(*) FROM users
+        UNION ALL SELECT 'orders', COALESCE(SUM(order_count), 0) FROM sales_daily
+        UNION ALL SELECT 'sales', COALESCE(SUM(sales), 0) FROM sales_daily
+        UNION ALL SELECT 'products', COUNT(*) FROM products
+    """)
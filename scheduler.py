@@ -0,0 +1,70 @@
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicJob:
+    """Runs `func` every `interval` seconds on a daemon thread and keeps run statistics.
+
+    `func` returns the number of rows it changed, or None when it skipped the
+    run (e.g. another worker holds the job lock).
+    """
+
+    def __init__(self, name, func, interval):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.stats = {
+            'runs': 0,
+            'skipped': 0,
+            'failures': 0,
+            'rows_total': 0,
+            'last_rows': None,
+            'last_run': None,
+            'last_duration': None,
+        }
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """Run the job on a daemon thread of this process; a no-op while that thread is alive"""
+        with self._start_lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run_forever, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def run_once(self):
+        started = time.time()
+        try:
+            rows = self.func()
+        except Exception:
+            self.stats['failures'] += 1
+            logger.exception('[%s] run failed', self.name)
+            return None
+        duration = time.time() - started
+
+        self.stats['last_run'] = started
+        self.stats['last_duration'] = duration
+        if rows is None:
+            self.stats['skipped'] += 1
+            return None
+        self.stats['runs'] += 1
+        self.stats['last_rows'] = rows
+        self.stats['rows_total'] += rows
+        if rows:
+            logger.info('[%s] %d row(s) updated in %.3fs', self.name, rows, duration)
+        return rows
+
+    def run_forever(self):
+        """Run the job every `interval` seconds in the calling thread until stop()"""
+        while not self._stop.is_set():
+            self.run_once()
+            self._stop.wait(self.interval)
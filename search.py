@@ -0,0 +1,312 @@
+import re
+import math
+import time
+import threading
+from bisect import bisect_left, insort
+from heapq import nsmallest
+from collections import defaultdict
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Words in the product name count more than words in the description
+NAME_WEIGHT = 3
+DESCRIPTION_WEIGHT = 1
+# A query token that only prefix-matches a term scores lower than an exact hit
+PREFIX_PENALTY = 0.5
+
+
+def tokenize(text):
+    if not text:
+        return []
+    return TOKEN_RE.findall(text.lower())
+
+
+class RebuiltIndex:
+    """Base for the in-memory indexes, rebuilt in full from the database every `max_age` seconds.
+
+    refresh() lets one thread rebuild while the others keep answering from
+    the current contents (they only wait when nothing has been loaded yet).
+    The new contents are built aside and swapped in; add()/remove() calls made
+    in the meantime are replayed onto them.
+    """
+
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+        self.loaded_at = None
+        self._lock = threading.RLock()
+        self._rebuild_lock = threading.Lock()
+        self._ready = False    # loaded at least once
+        self._changes = None   # changes made while a rebuild is under way
+
+    @property
+    def is_stale(self):
+        if self.loaded_at is None:
+            return True
+        return self.max_age is not None and time.time() - self.loaded_at > self.max_age
+
+    def invalidate(self):
+        """Rebuild from the database on next use, e.g. after a bulk import"""
+        self.loaded_at = None
+
+    def refresh(self, fetch, force=False):
+        """load(*fetch()) if the index is stale (or `force`); returns True if this call rebuilt it"""
+        if not (force or self.is_stale):
+            return False
+        if not self._rebuild_lock.acquire(blocking=not self._ready):
+            return False  # another thread is rebuilding; keep serving what is loaded
+        try:
+            # Whoever held the lock may have just rebuilt it
+            if not (force or self.is_stale):
+                return False
+            self._reload(fetch)
+            return True
+        finally:
+            self._rebuild_lock.release()
+
+    def load(self, *sources):
+        """Rebuild the whole index from `sources`, see _build()"""
+        self._reload(lambda: sources)
+
+    def _reload(self, fetch):
+        with self._lock:
+            self._changes = []
+        try:
+            fresh = self._build(*fetch())
+        except BaseException:
+            with self._lock:
+                self._changes = None
+            raise
+        with self._lock:
+            self._install(fresh)
+            for change in self._changes:
+                change()
+            self._changes = None
+            self.loaded_at = time.time()
+            self._ready = True
+
+    def _record(self, change):
+        # Called with the lock held: apply now, and again on top of a rebuild that is under way
+        change()
+        if self._changes is not None:
+            self._changes.append(change)
+
+    def _build(self, *sources):
+        """A new, unshared instance holding the contents for `sources`"""
+        raise NotImplementedError
+
+    def _install(self, fresh):
+        """Take over the contents of `fresh` (called with the lock held)"""
+        raise NotImplementedError
+
+
+class ProductSearchIndex(RebuiltIndex):
+    """In-memory inverted index over approved products (name + description)"""
+
+    def __init__(self, max_age=300):
+        super().__init__(max_age)
+        self._postings = defaultdict(dict)   # term -> {product_id: weight}
+        self._doc_terms = {}                 # product_id -> set of terms
+        self._terms = []                     # sorted terms, for prefix lookups
+
+    def __len__(self):
+        return len(self._doc_terms)
+
+    def load(self, products):
+        """Rebuild the whole index from rows with id, name and description"""
+        super().load(products)
+
+    def _build(self, products):
+        fresh = ProductSearchIndex(self.max_age)
+        for product in products:
+            fresh._add(product)
+        return fresh
+
+    def _install(self, fresh):
+        self._postings, self._doc_terms, self._terms = fresh._postings, fresh._doc_terms, fresh._terms
+
+    def add(self, product):
+        def change():
+            self._remove(int(product['id']))
+            self._add(product)
+        with self._lock:
+            self._record(change)
+
+    def remove(self, product_id):
+        with self._lock:
+            self._record(lambda: self._remove(int(product_id)))
+
+    def _add(self, product):
+        product_id = int(product['id'])
+        weights = defaultdict(int)
+        for token in tokenize(product.get('name')):
+            weights[token] += NAME_WEIGHT
+        for token in tokenize(product.get('description')):
+            weights[token] += DESCRIPTION_WEIGHT
+
+        for term, weight in weights.items():
+            if term not in self._postings:
+                insort(self._terms, term)
+            self._postings[term][product_id] = weight
+        self._doc_terms[product_id] = set(weights)
+
+    def _remove(self, product_id):
+        for term in self._doc_terms.pop(product_id, ()):
+            postings = self._postings[term]
+            postings.pop(product_id, None)
+            if not postings:
+                del self._postings[term]
+                i = bisect_left(self._terms, term)
+                if i < len(self._terms) and self._terms[i] == term:
+                    del self._terms[i]
+
+    def _matching_terms(self, token):
+        # Exact term first, then every term that starts with the token
+        i = bisect_left(self._terms, token)
+        while i < len(self._terms) and self._terms[i].startswith(token):
+            term = self._terms[i]
+            yield term, 1.0 if term == token else PREFIX_PENALTY
+            i += 1
+
+    def search(self, query, limit=500):
+        """Return product ids matching every query token, best match first"""
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return []
+
+        with self._lock:
+            total_docs = len(self._doc_terms) or 1
+            scores = None
+            for token in tokens:
+                token_scores = {}
+                for term, factor in self._matching_terms(token):
+                    postings = self._postings[term]
+                    idf = math.log(1 + total_docs / len(postings))
+                    for product_id, weight in postings.items():
+                        score = weight * idf * factor
+                        if score > token_scores.get(product_id, 0):
+                            token_scores[product_id] = score
+
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {pid: scores[pid] + s for pid, s in token_scores.items() if pid in scores}
+                if not scores:
+                    return []
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], -item[0]))
+        return [product_id for product_id, _ in ranked[:limit]]
+
+
+def normalize(text):
+    """Lowercased words joined by single spaces, the form suggestion keys and queries are compared in"""
+    return ' '.join(tokenize(text))
+
+
+class SuggestionIndex(RebuiltIndex):
+    """In-memory prefix index for search-box typeahead over approved products and categories.
+
+    Every word-start suffix of a name ("red wool scarf", "wool scarf",
+    "scarf") is kept in one sorted list of (key, kind, id), so a prefix lookup
+    is a bisect plus a scan of the matching range. Matches are ranked by
+    popularity: units ordered for a product, the sum over its products for a
+    category. Answers are memoized per prefix, so a prefix with a long range
+    is only scanned once; a change forgets just the prefixes of the keys it
+    touched.
+    """
+
+    def __init__(self, max_age=300, memo_size=20000):
+        super().__init__(max_age)
+        self.memo_size = memo_size
+        self._keys = []         # sorted (key, kind, id)
+        self._names = {}        # (kind, id) -> display name
+        self._popularity = {}   # (kind, id) -> units ordered
+        self._memo = {}         # prefix -> (limit, suggestions)
+
+    def load(self, products, categories):
+        """Rebuild from product rows (id, name, category_id, popularity) and category rows (id, name)"""
+        super().load(products, categories)
+
+    def _build(self, products, categories):
+        fresh = SuggestionIndex(self.max_age, self.memo_size)
+        category_popularity = defaultdict(int)
+        for product in products:
+            fresh._popularity[('product', product['id'])] = product['popularity']
+            fresh._names[('product', product['id'])] = product['name']
+            if product['category_id'] is not None:
+                category_popularity[product['category_id']] += product['popularity']
+        for category in categories:
+            fresh._popularity[('category', category['id'])] = category_popularity[category['id']]
+            fresh._names[('category', category['id'])] = category['name']
+        fresh._keys = sorted((key, kind, item_id) for (kind, item_id), name in fresh._names.items()
+                             for key in self._suffixes(name))
+        return fresh
+
+    def _install(self, fresh):
+        self._keys, self._names, self._popularity = fresh._keys, fresh._names, fresh._popularity
+        self._memo = {}
+
+    def add(self, product):
+        """Add or rename an approved product; its popularity is kept until the next load"""
+        self._put('product', int(product['id']), product['name'])
+
+    def remove(self, product_id):
+        def change():
+            self._drop(('product', int(product_id)))
+            self._popularity.pop(('product', int(product_id)), None)
+        with self._lock:
+            self._record(change)
+
+    def add_category(self, category):
+        self._put('category', int(category['id']), category['name'])
+
+    def suggest(self, query, limit=8):
+        """[(kind, id, name)] for names with a word starting with `query`, most popular first"""
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        with self._lock:
+            memo = self._memo.get(prefix)
+            if memo and memo[0] == limit:
+                return memo[1]
+            matches = set()
+            i = bisect_left(self._keys, (prefix,))
+            while i < len(self._keys) and self._keys[i][0].startswith(prefix):
+                matches.add(self._keys[i][1:])
+                i += 1
+            best = nsmallest(limit, matches, key=lambda item: (-self._popularity.get(item, 0), self._names[item]))
+            suggestions = [(kind, item_id, self._names[(kind, item_id)]) for kind, item_id in best]
+            if len(self._memo) >= self.memo_size:
+                self._memo = {}
+            self._memo[prefix] = (limit, suggestions)
+        return suggestions
+
+    def _put(self, kind, item_id, name):
+        def change():
+            self._drop((kind, item_id))
+            self._names[(kind, item_id)] = name
+            self._popularity.setdefault((kind, item_id), 0)
+            for key in self._suffixes(name):
+                insort(self._keys, (key, kind, item_id))
+                self._forget(key)
+        with self._lock:
+            self._record(change)
+
+    def _drop(self, item):
+        name = self._names.pop(item, None)
+        if name is None:
+            return
+        for key in self._suffixes(name):
+            i = bisect_left(self._keys, (key,) + item)
+            if i < len(self._keys) and self._keys[i] == (key,) + item:
+                del self._keys[i]
+            self._forget(key)
+
+    def _forget(self, key):
+        # Drop the memoized answers that `key` appears in
+        for end in range(1, len(key) + 1):
+            self._memo.pop(key[:end], None)
+
+    @staticmethod
+    def _suffixes(name):
+        words = tokenize(name)
+        return {' '.join(words[i:]) for i in range(len(words))}
@@ -0,0 +1,200 @@
+import os
+import re
+import asyncio
+import hashlib
+import tempfile
+
+try:
+    import aiofiles
+    import aiofiles.os
+except ImportError:  # aiofiles is optional; only the ASGI mode (asgi.py) writes uploads with it
+    aiofiles = None
+
+EXT_RE = re.compile(r'^\.[a-z0-9]{1,5}$')
+
+# file_refs statements, also run on the ASGI mode's async connections
+REF_ADD = """
+    INSERT INTO file_refs (path, refcount) VALUES (%s, 1)
+    ON DUPLICATE KEY UPDATE refcount = refcount + 1
+"""
+REF_DROP = "UPDATE file_refs SET refcount = refcount - 1 WHERE path = %s"
+REF_COUNT = "SELECT refcount FROM file_refs WHERE path = %s"
+REF_LOCK = "SELECT refcount FROM file_refs WHERE path = %s FOR UPDATE"
+REF_DELETE = "DELETE FROM file_refs WHERE path = %s"
+
+
+class UploadTooLarge(Exception):
+    """Raised when an upload exceeds the store's size limit"""
+
+
+class BlobStore:
+    """Content-addressed upload storage with reference counting.
+
+    Files are stored once under `<sha256><ext>`, however many rows point at
+    them. Reference counts live in the file_refs table and are updated on the
+    caller's cursor, in the same transaction as the row that uses the file.
+    Files are only ever deleted by purge(), after that transaction commits or
+    rolls back: a file save() wrote for a transaction that is rolled back has
+    no reference left and purge() removes it.
+    """
+
+    def __init__(self, folder, namespace, max_size, chunk_size=64 * 1024):
+        self.folder = folder
+        self.namespace = namespace
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+        os.makedirs(folder, exist_ok=True)
+
+    def _ref_key(self, filename):
+        return '%s/%s' % (self.namespace, filename)
+
+    def _extension(self, file):
+        ext = os.path.splitext(file.filename or '')[1].lower()
+        return ext if EXT_RE.match(ext) else ''
+
+    def _too_large(self):
+        return UploadTooLarge('File is larger than %d MB' % (self.max_size // (1024 * 1024)))
+
+    def save(self, cur, file, new_files=None):
+        """Stream a werkzeug FileStorage to disk while hashing it; returns the stored filename.
+
+        The filename is also appended to `new_files` when this call wrote the
+        file (rather than finding the same content stored); pass those to
+        purge() if the transaction does not commit.
+        """
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                while True:
+                    chunk = file.stream.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_size:
+                        raise self._too_large()
+                    digest.update(chunk)
+                    out.write(chunk)
+
+            filename = digest.hexdigest() + self._extension(file)
+            path = os.path.join(self.folder, filename)
+            # Take the file_refs row lock first: a purge() of the same content waits for
+            # this transaction, or has already deleted the file and it is written again
+            cur.execute(REF_ADD, (self._ref_key(filename),))
+            if os.path.exists(path):
+                os.remove(tmp_path)  # same content already stored
+            else:
+                os.replace(tmp_path, path)
+                if new_files is not None:
+                    new_files.append(filename)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return filename
+
+    def release(self, cur, filename):
+        """Drop one reference. Returns True if nothing uses the file any more; the caller
+        then passes it to purge() once its transaction has committed."""
+        if not filename:
+            return False
+        key = self._ref_key(filename)
+        cur.execute(REF_DROP, (key,))
+        cur.execute(REF_COUNT, (key,))
+        row = cur.fetchone()
+        # Files uploaded before file_refs existed have no row and only one user
+        return not (row and row['refcount'] > 0)
+
+    def purge(self, connection, filename):
+        """Delete a file release() reported unused, in a transaction of its own.
+
+        The count is read again under a row lock, so a save() of the same content
+        since then (or a release() that was rolled back) keeps the file. Returns
+        True if it was deleted.
+        """
+        key = self._ref_key(filename)
+        cur = connection.cursor()
+        try:
+            cur.execute(REF_LOCK, (key,))
+            row = cur.fetchone()
+            if row and row['refcount'] > 0:
+                connection.commit()
+                return False
+            cur.execute(REF_DELETE, (key,))
+            path = os.path.join(self.folder, filename)
+            if os.path.exists(path):
+                os.remove(path)
+            connection.commit()
+            return True
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            cur.close()
+
+    async def save_async(self, cur, file, new_files=None):
+        """save() for the ASGI mode: `cur` is an aiomysql cursor, the file is written with aiofiles.
+
+        The upload may be spooled to disk (ASGI_BODY_SPOOL_SIZE), so it is read on a worker thread too.
+        """
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = await asyncio.to_thread(tempfile.mkstemp, dir=self.folder, prefix='.upload-')
+        os.close(fd)
+        try:
+            async with aiofiles.open(tmp_path, 'wb') as out:
+                while True:
+                    chunk = await asyncio.to_thread(file.stream.read, self.chunk_size)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_size:
+                        raise self._too_large()
+                    digest.update(chunk)
+                    await out.write(chunk)
+
+            filename = digest.hexdigest() + self._extension(file)
+            path = os.path.join(self.folder, filename)
+            await cur.execute(REF_ADD, (self._ref_key(filename),))
+            if await aiofiles.os.path.exists(path):
+                await aiofiles.os.remove(tmp_path)  # same content already stored
+            else:
+                await aiofiles.os.replace(tmp_path, path)
+                if new_files is not None:
+                    new_files.append(filename)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return filename
+
+    async def release_async(self, cur, filename):
+        """release() on an aiomysql DictCursor"""
+        if not filename:
+            return False
+        key = self._ref_key(filename)
+        await cur.execute(REF_DROP, (key,))
+        await cur.execute(REF_COUNT, (key,))
+        row = await cur.fetchone()
+        return not (row and row['refcount'] > 0)
+
+    async def purge_async(self, conn, filename):
+        """purge() on an aiomysql connection"""
+        key = self._ref_key(filename)
+        try:
+            async with conn.cursor() as cur:
+                await cur.execute(REF_LOCK, (key,))
+                row = await cur.fetchone()
+                if row and row['refcount'] > 0:
+                    await conn.commit()
+                    return False
+                await cur.execute(REF_DELETE, (key,))
+                path = os.path.join(self.folder, filename)
+                if await aiofiles.os.path.exists(path):
+                    await aiofiles.os.remove(path)
+            await conn.commit()
+            return True
+        except Exception:
+            await conn.rollback()
+            raise
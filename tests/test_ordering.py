@@ -0,0 +1,113 @@
+import pytest
+
+MySQLdb = pytest.importorskip('MySQLdb')
+
+from ordering import place_order, stock_update, out_of_stock, OutOfStock, ORDER_INSERT  # noqa: E402
+
+
+class FakeConnection:
+    """Records statements; the stock UPDATE matches `rows_updated` rows"""
+
+    def __init__(self, rows_updated=None, stock=(), failures=()):
+        self.rows_updated = rows_updated
+        self.stock = list(stock)
+        self.failures = list(failures)
+        self.statements = []
+        self.commits = 0
+        self.rollbacks = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.rowcount = 0
+        self.lastrowid = None
+
+    def execute(self, sql, params=None):
+        if self.conn.failures:
+            raise self.conn.failures.pop(0)
+        self.conn.statements.append((sql, params))
+        if sql.strip().startswith('UPDATE products'):
+            self.rowcount = self.conn.rows_updated
+        if sql == ORDER_INSERT:
+            self.lastrowid = 42
+
+    def executemany(self, sql, rows):
+        self.conn.statements.append((sql, rows))
+
+    def fetchall(self):
+        return self.conn.stock
+
+    def close(self):
+        pass
+
+
+def product(product_id, price=10):
+    return {'id': product_id, 'price': price}
+
+
+def test_stock_update_is_one_conditional_statement():
+    sql, params = stock_update({7: 2, 3: 1})
+    assert sql.count('UPDATE products') == 1
+    assert 'stock >= CASE id' in sql
+    # Rows in primary key order: CASE params, the id list, the CASE params again
+    assert params == [3, 1, 7, 2, 3, 7, 3, 1, 7, 2]
+
+
+def test_out_of_stock_lists_shortfalls():
+    error = out_of_stock({1: 2, 2: 1, 3: 5}, [
+        {'id': 1, 'stock': 1, 'status': 'approved'},
+        {'id': 2, 'stock': 9, 'status': 'approved'},
+        {'id': 3, 'stock': 9, 'status': 'pending'},
+    ])
+    assert error.shortfalls == [(1, 2, 1), (3, 5, 0)]
+
+
+def test_order_and_extra_statements_commit_together():
+    conn = FakeConnection(rows_updated=2)
+    order_id = place_order(conn, 5, [(product(1), 2), (product(2), 1)], 'cash',
+                           [('DELETE FROM cart_items WHERE cart_id = %s', (9,))])
+    assert order_id == 42
+    assert conn.commits == 1 and conn.rollbacks == 0
+    assert ('DELETE FROM cart_items WHERE cart_id = %s', (9,)) in conn.statements
+
+
+def test_short_stock_update_rolls_back():
+    conn = FakeConnection(rows_updated=1, stock=[{'id': 1, 'stock': 0, 'status': 'approved'},
+                                                 {'id': 2, 'stock': 5, 'status': 'approved'}])
+    with pytest.raises(OutOfStock) as raised:
+        place_order(conn, 5, [(product(1), 1), (product(2), 1)], 'cash')
+    assert raised.value.shortfalls == [(1, 1, 0)]
+    assert conn.commits == 0 and conn.rollbacks == 1
+    assert not any(sql == ORDER_INSERT for sql, _ in conn.statements)
+
+
+def test_deadlock_is_retried():
+    deadlock = MySQLdb.OperationalError(1213, 'Deadlock found when trying to get lock')
+    conn = FakeConnection(rows_updated=1, failures=[deadlock, deadlock])
+    assert place_order(conn, 5, [(product(1), 1)], 'cash', backoff=0) == 42
+    assert conn.rollbacks == 2 and conn.commits == 1
+
+
+def test_retries_give_up():
+    deadlock = MySQLdb.OperationalError(1213, 'Deadlock found when trying to get lock')
+    conn = FakeConnection(rows_updated=1, failures=[deadlock] * 3)
+    with pytest.raises(MySQLdb.OperationalError):
+        place_order(conn, 5, [(product(1), 1)], 'cash', retries=2, backoff=0)
+    assert conn.rollbacks == 3 and conn.commits == 0
+
+
+def test_other_errors_are_not_retried():
+    conn = FakeConnection(rows_updated=1, failures=[MySQLdb.OperationalError(2006, 'MySQL server has gone away')])
+    with pytest.raises(MySQLdb.OperationalError):
+        place_order(conn, 5, [(product(1), 1)], 'cash', backoff=0)
+    assert conn.rollbacks == 1
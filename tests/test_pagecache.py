@@ -0,0 +1,87 @@
+import os
+
+import pytest
+from flask import Flask
+
+from pagecache import PageCache
+
+
+@pytest.fixture
+def site(tmp_path):
+    pages = PageCache('pages', ttl=60, stale_ttl=300, disk_dir=str(tmp_path / 'pages'), stamp_dir=str(tmp_path))
+    app = Flask(__name__)
+    renders = []
+
+    @app.route('/')
+    @pages.cached(lambda: 'home')
+    def home():
+        renders.append(1)
+        return 'render %d' % len(renders)
+
+    yield app.test_client(), pages, renders
+    pages._executor.shutdown(wait=True)
+
+
+def age(pages, seconds):
+    for entry in pages._entries.values():
+        entry['created'] -= seconds
+
+
+def wait_for_background(pages):
+    # The cache has one worker thread; this runs after whatever was queued before it
+    pages._executor.submit(lambda: None).result(5)
+
+
+def test_fresh_page_is_served_from_the_cache(site):
+    client, pages, renders = site
+    assert client.get('/').headers['X-Cache'] == 'MISS'
+    response = client.get('/')
+    assert response.headers['X-Cache'] == 'HIT'
+    assert response.get_data(as_text=True) == 'render 1'
+    assert pages.stats['hits'] == 1 and pages.stats['misses'] == 1
+
+
+def test_stale_page_is_served_while_it_is_refreshed(site):
+    client, pages, renders = site
+    client.get('/')
+    age(pages, 61)
+    response = client.get('/')
+    assert response.headers['X-Cache'] == 'STALE'
+    assert response.get_data(as_text=True) == 'render 1'
+    wait_for_background(pages)
+    response = client.get('/')
+    assert response.headers['X-Cache'] == 'HIT'
+    assert response.get_data(as_text=True) == 'render 2'
+    assert pages.stats['stale_hits'] == 1 and pages.stats['refreshes'] == 1
+
+
+def test_page_past_its_stale_window_is_a_miss(site):
+    client, pages, renders = site
+    client.get('/')
+    age(pages, 61 + 300)
+    assert client.get('/').headers['X-Cache'] == 'MISS'
+    assert len(renders) == 2
+
+
+def test_other_processes_read_the_disk_tier(site):
+    client, pages, renders = site
+    client.get('/')
+    pages._entries.clear()   # as seen from another worker process
+    response = client.get('/')
+    assert response.headers['X-Cache'] == 'HIT'
+    assert len(renders) == 1
+
+
+def test_invalidate_drops_pages_everywhere(site, tmp_path):
+    client, pages, renders = site
+    client.get('/')
+    other = PageCache('pages', disk_dir=pages.disk_dir, stamp_dir=str(tmp_path))
+    assert other.get('home')[0]['body'] == b'render 1'
+    pages.invalidate()
+    assert other.get('home') == (None, False)
+    assert client.get('/').headers['X-Cache'] == 'MISS'
+    assert other.get('home')[0]['body'] == b'render 2'
+    wait_for_background(pages)
+    # The old file was removed in the background, the new render kept
+    assert len(os.listdir(pages.disk_dir)) == 1
+    other._executor.shutdown()
@@ -0,0 +1,43 @@
+import datetime
+
+from werkzeug.datastructures import MultiDict
+
+from pagination import get_page_size, encode_cursor, decode_cursor, keyset_condition
+
+
+def test_cursor_round_trip():
+    cursor = encode_cursor([12.5, 'Blue hat', 7])
+    assert '=' not in cursor
+    assert decode_cursor(cursor) == [12.5, 'Blue hat', 7]
+
+
+def test_cursor_dates_come_back_as_strings():
+    cursor = encode_cursor([datetime.datetime(2024, 5, 1, 12, 30), 3])
+    assert decode_cursor(cursor) == ['2024-05-01 12:30:00', 3]
+
+
+def test_missing_or_tampered_cursor_is_none():
+    assert decode_cursor(None) is None
+    assert decode_cursor('') is None
+    assert decode_cursor('not base64!') is None
+    assert decode_cursor(encode_cursor([1])[:-1] + '*') is None
+    # Valid JSON, but not a list of sort-key scalars
+    assert decode_cursor('eyJhIjoxfQ') is None           # {"a":1}
+    assert decode_cursor(encode_cursor([[1, 2]])) is None
+    assert decode_cursor('WyJ4IixOYU5d') is None         # ["x",NaN]
+
+
+def test_keyset_condition():
+    sql, params = keyset_condition(['p.price', 'p.id'], 'ASC', [10, 4])
+    assert sql == '((p.price > %s) OR (p.price = %s AND p.id > %s))'
+    assert params == [10, 10, 4]
+    sql, _ = keyset_condition(['o.order_date', 'o.id'], 'DESC', ['2024-01-01', 9])
+    assert '<' in sql and '>' not in sql
+
+
+def test_page_size_is_clamped():
+    assert get_page_size(MultiDict()) == 24
+    assert get_page_size(MultiDict({'per_page': '10'})) == 10
+    assert get_page_size(MultiDict({'per_page': '5000'})) == 100
+    assert get_page_size(MultiDict({'per_page': '-3'})) == 1
+    assert get_page_size(MultiDict({'per_page': 'abc'}), default=12) == 12
@@ -0,0 +1,64 @@
+import pytest
+
+from ratelimit import spend, MemoryBucketStore, LocalBucketStore, RateLimiter
+
+LIMITS = {'login': {'ip': (2, 60), 'account': (1, 60)}}
+
+
+def test_spend_refills_and_clamps():
+    # Half a token a second for 4 seconds refills 2; capacity caps it at 3
+    assert spend(0, 100, 104, 3, 0.5) == (1.0, 0.0)
+    assert spend(3, 100, 200, 3, 0.5) == (2, 0.0)
+    # Not enough: the bucket is left as it is and the wait is reported
+    assert spend(0.5, 100, 100, 3, 0.5) == (0.5, 1.0)
+
+
+def test_refund_never_overfills():
+    assert spend(3, 100, 100, 3, 0.5, cost=-1) == (3, 0.0)
+    assert spend(1, 100, 100, 3, 0.5, cost=-1) == (2, 0.0)
+
+
+def test_memory_store_takes_and_refunds():
+    store = MemoryBucketStore()
+    assert store.take('k', 1, 1 / 60) == 0
+    assert store.take('k', 1, 1 / 60) > 0
+    store.take('k', 1, 1 / 60, cost=-1)
+    assert store.take('k', 1, 1 / 60) == 0
+
+
+def test_rejected_request_refunds_its_other_buckets():
+    limiter = RateLimiter(MemoryBucketStore(), LIMITS)
+    assert limiter.check('login', 'login', [('ip', '10.0.0.1'), ('account', 'a@x.com')]) == 0
+    # The account is out of tokens; the IP token spent on the way is given back
+    assert limiter.check('login', 'login', [('ip', '10.0.0.1'), ('account', 'a@x.com')]) > 0
+    assert limiter.check('login', 'login', [('ip', '10.0.0.1'), ('account', 'b@x.com')]) == 0
+    assert limiter.check('login', 'login', [('ip', '10.0.0.1'), ('account', 'c@x.com')]) > 0
+    assert limiter.rejected == {('login', 'account'): 1, ('login', 'ip'): 1}
+
+
+def test_routes_and_missing_identities():
+    limiter = RateLimiter(MemoryBucketStore(), LIMITS)
+    assert limiter.check('login', 'login', [('ip', None), ('account', 'a@x.com')]) == 0
+    # Every route has buckets of its own
+    assert limiter.check('register', 'login', [('account', 'a@x.com')]) == 0
+    assert limiter.check('login', 'login', [('account', 'a@x.com')]) > 0
+    assert limiter.check('catalog', 'unlimited', [('ip', '10.0.0.1')] * 5) == 0
+
+
+def test_failing_store_lets_requests_through():
+    class BrokenStore:
+        def take(self, key, capacity, rate, cost=1):
+            raise OSError('disk full')
+
+    limiter = RateLimiter(BrokenStore(), LIMITS)
+    assert limiter.check('login', 'login', [('ip', '10.0.0.1')]) == 0
+    assert limiter.errors == 1
+
+
+def test_local_store_is_shared_by_processes(tmp_path):
+    path = str(tmp_path / 'rate_limits.sqlite3')
+    first, second = LocalBucketStore(path), LocalBucketStore(path)
+    assert first.take('k', 1, 1 / 60) == 0
+    assert second.take('k', 1, 1 / 60) == pytest.approx(60, abs=1)
+    second.take('k', 1, 1 / 60, cost=-1)
+    assert first.take('k', 1, 1 / 60) == 0
@@ -0,0 +1,74 @@
+import threading
+
+from search import ProductSearchIndex
+
+PRODUCTS = [
+    {'id': 1, 'name': 'Red shirt', 'description': 'Cotton'},
+    {'id': 2, 'name': 'Blue hat', 'description': 'Goes with a red shirt'},
+]
+
+
+def test_search_ranks_name_matches_first():
+    index = ProductSearchIndex()
+    index.load(PRODUCTS)
+    assert index.search('red shirt') == [1, 2]
+    assert index.search('hat') == [2]
+    assert index.search('shi') == [1, 2]      # prefix match
+    assert index.search('red wool') == []
+
+
+def test_changes_during_a_rebuild_are_replayed():
+    index = ProductSearchIndex()
+    index.load(PRODUCTS)
+
+    def fetch():
+        # An admin edits products while the rebuild reads the database
+        index.add({'id': 3, 'name': 'Green scarf', 'description': ''})
+        index.remove(1)
+        return (PRODUCTS,)
+
+    assert index.refresh(fetch, force=True)
+    assert index.search('scarf') == [3]
+    assert index.search('cotton') == []
+    assert len(index) == 2
+
+
+def test_readers_are_not_blocked_by_a_rebuild():
+    index = ProductSearchIndex()
+    index.load(PRODUCTS)
+    reading = threading.Event()
+    release = threading.Event()
+
+    def slow_fetch():
+        reading.set()
+        release.wait(5)
+        return ([{'id': 4, 'name': 'Wool socks', 'description': ''}],)
+
+    rebuild = threading.Thread(target=index.refresh, args=(slow_fetch, True))
+    rebuild.start()
+    try:
+        assert reading.wait(5)
+        # A second refresh does not wait for the first; the old contents still answer
+        assert not index.refresh(lambda: ([],), force=True)
+        assert index.search('hat') == [2]
+    finally:
+        release.set()
+        rebuild.join(5)
+    assert index.search('hat') == []
+    assert index.search('socks') == [4]
+
+
+def test_failed_rebuild_keeps_the_index():
+    index = ProductSearchIndex()
+    index.load(PRODUCTS)
+
+    def broken_fetch():
+        raise RuntimeError('database went away')
+
+    try:
+        index.refresh(broken_fetch, force=True)
+    except RuntimeError:
+        pass
+    index.add({'id': 5, 'name': 'Umbrella', 'description': ''})
+    assert index.search('umbrella') == [5]
+    assert index.search('hat') == [2]
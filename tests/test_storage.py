@@ -0,0 +1,121 @@
+import io
+import os
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+from storage import BlobStore, UploadTooLarge, REF_ADD, REF_DROP, REF_COUNT, REF_LOCK, REF_DELETE
+
+
+class FileRefs:
+    """The file_refs table, with just enough of a transaction to roll back"""
+
+    def __init__(self):
+        self.rows = {}
+        self.committed = {}
+
+    def cursor(self):
+        return FileRefsCursor(self)
+
+    def commit(self):
+        self.committed = dict(self.rows)
+
+    def rollback(self):
+        self.rows = dict(self.committed)
+
+
+class FileRefsCursor:
+    def __init__(self, table):
+        self.table = table
+        self.row = None
+
+    def execute(self, sql, params):
+        rows = self.table.rows
+        key, = params
+        if sql == REF_ADD:
+            rows[key] = rows.get(key, 0) + 1
+        elif sql == REF_DROP:
+            if key in rows:
+                rows[key] -= 1
+        elif sql in (REF_COUNT, REF_LOCK):
+            self.row = {'refcount': rows[key]} if key in rows else None
+        elif sql == REF_DELETE:
+            rows.pop(key, None)
+        else:
+            raise AssertionError('unexpected statement %r' % sql)
+
+    def fetchone(self):
+        return self.row
+
+    def close(self):
+        pass
+
+
+def upload(data, filename='proof.JPG'):
+    return FileStorage(io.BytesIO(data), filename=filename)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return BlobStore(str(tmp_path), 'proofs', max_size=1024, chunk_size=16)
+
+
+def stored_files(store):
+    return sorted(os.listdir(store.folder))
+
+
+def test_same_content_is_stored_once(store):
+    db = FileRefs()
+    first = store.save(db.cursor(), upload(b'x' * 100))
+    second = store.save(db.cursor(), upload(b'x' * 100, 'other.jpg'))
+    assert first == second and first.endswith('.jpg')
+    assert stored_files(store) == [first]
+    assert db.rows == {'proofs/' + first: 2}
+
+
+def test_file_is_purged_once_unused(store):
+    db = FileRefs()
+    filename = store.save(db.cursor(), upload(b'receipt'))
+    store.save(db.cursor(), upload(b'receipt'))
+    db.commit()
+    assert not store.release(db.cursor(), filename)
+    assert store.release(db.cursor(), filename)
+    db.commit()
+    assert store.purge(db, filename)
+    assert stored_files(store) == []
+    assert db.committed == {}
+
+
+def test_purge_keeps_a_file_saved_again(store):
+    db = FileRefs()
+    filename = store.save(db.cursor(), upload(b'receipt'))
+    db.commit()
+    assert store.release(db.cursor(), filename)
+    db.commit()
+    # The same content is uploaded again before the purge runs
+    store.save(db.cursor(), upload(b'receipt'))
+    db.commit()
+    assert not store.purge(db, filename)
+    assert stored_files(store) == [filename]
+
+
+def test_rolled_back_save_is_purged(store):
+    db = FileRefs()
+    kept = store.save(db.cursor(), upload(b'committed'))
+    db.commit()
+    new_files = []
+    store.save(db.cursor(), upload(b'committed'), new_files)
+    orphan = store.save(db.cursor(), upload(b'rolled back'), new_files)
+    assert new_files == [orphan]   # only files this save wrote
+    db.rollback()
+    for filename in new_files:
+        assert store.purge(db, filename)
+    assert stored_files(store) == [kept]
+
+
+def test_too_large_upload_leaves_nothing(store):
+    db = FileRefs()
+    with pytest.raises(UploadTooLarge):
+        store.save(db.cursor(), upload(b'x' * 2000))
+    assert stored_files(store) == []
+    assert db.rows == {}